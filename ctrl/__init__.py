@@ -1,9 +1,15 @@
 import warnings
-from threading import Thread, Timer, Condition
+from threading import Thread, Condition, RLock, current_thread
 import numpy
 import importlib
+import heapq
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from . import block
+from .profiler import Profiler
+from . import parallel
 
 # alternative perf_counter
 import sys
@@ -20,6 +26,13 @@ IDLE = 0
 RUNNING = 1
 EXITING = 2
 
+# slots of signals is_running and duty
+IS_RUNNING = 0
+DUTY = 1
+
+# generations of signal slots, unique across controllers
+generations = itertools.count(1)
+
 class Controller:
     """
     :py:class:`ctrl.Controller` provides functionality for running
@@ -33,6 +46,17 @@ class Controller:
 
     Upon initialization a Controller state is set to IDLE.
 
+    If :py:attr:`auto_order` is True then filters are executed in the
+    order given by the dependencies of their signals, see
+    :py:meth:`ctrl.Controller.sort_filters`, instead of the order in
+    which they were added.
+
+    If :py:attr:`workers` is positive then independent branches of
+    filters, see :py:func:`ctrl.parallel.partition`, are executed
+    concurrently on a pool with :py:attr:`workers` threads.
+
+    :param bool auto_order: sort filters automatically (default False)
+    :param int workers: number of threads for parallel filters (default 0)
     :param kwargs: should be left empty
     :raises: :py:class:`ctrl.ControllerException` if any parameters are passed to py:data`**kwargs`
 
@@ -47,12 +71,33 @@ class Controller:
         
         # real-time loop
         self.is_running = False
+        self.thread = None
+
+        # timers
+        self.timer_condition = Condition()
+        self.timer_thread = None
+        self.timer_updates = deque()
 
         # duty
         self.duty = 0
 
+        # profiler
+        self.profiler = None
+
+        # guards changes to blocks and the compilation of the plan,
+        # which run in different threads
+        self.plan_lock = RLock()
+
         # noclock
         self.noclock = kwargs.pop('noclock', False)
+
+        # automatic ordering of filters
+        self.auto_order = kwargs.pop('auto_order', False)
+        self.algebraic_loops = [ ]
+
+        # parallel execution of filters
+        self.workers = kwargs.pop('workers', 0)
+        self.executor = None
         
         # no arguments are supposed to be left out
         if len(kwargs) > 0:
@@ -63,9 +108,18 @@ class Controller:
 
     def __reset(self):
 
-        # signals
-        self.signals = { 'is_running': self.is_running, 
-                         'duty': self.duty }
+        # signals: values are stored in slots indexed through signal_slots
+        self.signal_slots = { 'is_running': IS_RUNNING,
+                              'duty': DUTY }
+        self.signal_values = [ self.is_running,
+                               self.duty ]
+        self.signal_generation = next(generations)
+
+        # values of signals at the end of the last iteration
+        self.signal_snapshot = tuple(self.signal_values)
+
+        # execution plan, compiled at start()
+        self.plan = None
 
         # devices
         self.devices = { }
@@ -84,7 +138,14 @@ class Controller:
 
         # timers
         self.timers = { }
-        self.running_timers = { }
+
+        # scheduled commands: heaps of (iteration or time, order,
+        # commands) and queue of entries not yet merged by the loop
+        self.iteration = 0
+        self.schedule_heaps = { 'iteration': [ ],
+                                'time': [ ] }
+        self.schedule_queue = deque()
+        self.schedule_order = itertools.count()
 
         if not self.noclock:
 
@@ -120,6 +181,11 @@ class Controller:
         # call stop
         self.stop()
 
+        # close blocks
+        for blocks in (self.sources, self.filters, self.sinks, self.timers):
+            for item in blocks.values():
+                item['block'].close()
+
         # call __reset
         self.__reset()
 
@@ -146,7 +212,7 @@ class Controller:
         """
         Returns a string with information on the Controller.
 
-        :param options: can be one of `devices`, `signals`, `sources`, `filters`, `sinks`, `timers`, `all`, `summary`, or `class`
+        :param options: can be one of `devices`, `signals`, `sources`, `filters`, `sinks`, `timers`, `profile`, `all`, `summary`, or `class`
         :return: string with information on the Controller
         """
 
@@ -253,7 +319,15 @@ class Controller:
                 result += '> signals\n  ' + \
                           '\n  '.join('{}. {}'.format(k+1,key) 
                                       for k,key in 
-                                      enumerate(sorted(self.signals.keys()))) + '\n'
+                                      enumerate(sorted(self.signal_slots.keys()))) + '\n'
+
+            elif options == 'profile':
+
+                result += '> profile\n'
+                if self.profiler is None:
+                    result += '  disabled\n'
+                else:
+                    result += str(self.profiler)
 
             elif options == 'class':
 
@@ -265,7 +339,7 @@ class Controller:
                     .format(self.__class__,
                             len(self.devices),
                             len(self.timers),
-                            len(self.signals),
+                            len(self.signal_slots),
                             len(self.sources), 
                             len(self.filters),
                             len(self.sinks))
@@ -283,11 +357,12 @@ class Controller:
         :param str label: the signal label
         """
         assert isinstance(label, str)
-        if label in self.signals:
+        if label in self.signal_slots:
             warnings.warn("Signal '{}' already present.".format(label),
                           ControllerWarning)
         else:
-            self.signals[label] = 0
+            self.signal_slots[label] = len(self.signal_values)
+            self.signal_values.append(0)
 
     def add_signals(self, *labels):
         """
@@ -325,15 +400,17 @@ class Controller:
                               ControllerWarning)
                 return
                 
-        # used in a filter?
+        # used in a timer? timers may have no inputs
         for (l, device) in self.timers.items():
-            if label in device['outputs'] or label in device['inputs']:
+            if label in device['outputs'] or label in (device['inputs'] or ()):
                 warnings.warn("Signal '{}' still in use by timer '{}' and can't be removed.".format(label, l),
                               ControllerWarning)
                 return
 
-        # otherwise go ahead
-        self.signals.pop(label)
+        # otherwise go ahead; slot is left unused
+        with self.plan_lock:
+            self.signal_values[self.signal_slots.pop(label)] = 0
+            self.signal_generation = next(generations)
 
     def set_signal(self, label, value):
         """
@@ -342,9 +419,9 @@ class Controller:
         :param str label: the signal label
         :param value: the value to be set
         """
-        if label not in self.signals:
+        if label not in self.signal_slots:
             raise ControllerException("Signal '{}' does not exist".format(label))
-        self.signals[label] = value
+        self.signal_values[self.signal_slots[label]] = value
 
     def get_signal(self, label):
         """
@@ -353,7 +430,7 @@ class Controller:
         :param str label: the signal label
         :return: the signal value
         """
-        return self.signals[label]
+        return self.signal_values[self.signal_slots[label]]
 
     def get_signals(self, *labels):
         """
@@ -363,7 +440,152 @@ class Controller:
         :return: the signal values
         :rtype: list
         """
-        return [self.signals[label] for label in labels]
+        return [self.signal_values[self.signal_slots[label]]
+                for label in labels]
+
+    def get_snapshot(self, *labels):
+        """
+        Get the value of signals at the end of the last completed
+        iteration of the Controller loop.
+
+        Unlike :py:meth:`get_signals`, all values are guaranteed to
+        come from the same iteration. The loop publishes an immutable
+        copy of all signals at the end of each iteration, so readers
+        never block the loop. If the loop is not running and has
+        completed its last iteration the current values are returned.
+
+        :param vargs labels: the signal labels
+        :return: the signal values
+        :rtype: list
+        """
+        slots = self.signal_slots
+        if self.is_loop_running():
+            snapshot = self.signal_snapshot
+        else:
+            snapshot = self.signal_values
+        return [snapshot[slots[label]] for label in labels]
+
+    def is_loop_running(self):
+        """
+        Return `True` if the loop is running or has not completed its
+        last iteration yet.
+
+        :rtype: bool
+        """
+        return self.is_running or (self.thread is not None and
+                                   self.thread.is_alive())
+
+    def set_signals(self, mapping):
+        """
+        Set the value of multiple signals at once.
+
+        If the loop is running the values are applied together at the
+        beginning of the next iteration, so that no iteration sees only
+        some of them.
+
+        :param dict mapping: the signal values by label
+        :raise: :py:class:`ctrl.ControllerException` if a signal does not exist
+        """
+        self.set_slots(self.get_signal_slots(*mapping.keys()),
+                       list(mapping.values()))
+
+    def get_signals_array(self, *labels):
+        """
+        Get the value of scalar signals as an array.
+
+        Values come from the same iteration, see :py:meth:`get_snapshot`.
+
+        :param vargs labels: the signal labels
+        :return: the signal values
+        :rtype: numpy.ndarray
+        :raise: :py:class:`ctrl.ControllerException` if a signal does not exist
+        """
+        return self.get_slots(self.get_signal_slots(*labels))
+
+    def get_signal_slots(self, *labels):
+        """
+        Get the slots of signals.
+
+        Slots identify signals in :py:meth:`set_slots` and
+        :py:meth:`get_slots` and remain valid until the controller is
+        reset or a signal is removed, see :py:meth:`lookup_signal_slots`.
+
+        :param vargs labels: the signal labels
+        :return: the signal slots
+        :rtype: list
+        :raise: :py:class:`ctrl.ControllerException` if a signal does not exist
+        """
+        slots = self.signal_slots
+        for label in labels:
+            if label not in slots:
+                raise ControllerException("Signal '{}' does not exist".format(label))
+        return [slots[label] for label in labels]
+
+    def lookup_signal_slots(self, *labels):
+        """
+        Get the slots of signals and their generation.
+
+        The generation changes whenever slots become invalid, that is
+        when the controller is reset or a signal is removed. Passing
+        it to :py:meth:`set_slots` and :py:meth:`get_slots` rejects
+        slots that were looked up before.
+
+        :param vargs labels: the signal labels
+        :return: tuple (generation, slots)
+        :rtype: tuple
+        :raise: :py:class:`ctrl.ControllerException` if a signal does not exist
+        """
+        return (self.signal_generation, self.get_signal_slots(*labels))
+
+    def __check_slots(self, slots, generation):
+        # raise if slots are stale or out of range
+        if generation and generation != self.signal_generation:
+            raise ControllerException('Signal slots are stale')
+        if slots and not 0 <= min(slots) <= max(slots) < len(self.signal_values):
+            raise ControllerException('Invalid signal slot')
+
+    def set_slots(self, slots, values, generation = 0):
+        """
+        Set the value of signals by slot, see :py:meth:`set_signals`.
+
+        :param slots: the signal slots, see :py:meth:`get_signal_slots`
+        :param values: the signal values
+        :param int generation: the generation of the slots, see :py:meth:`lookup_signal_slots`; not checked if 0 (default 0)
+        :raise: :py:class:`ctrl.ControllerException` if a slot is not valid or stale
+        """
+        slots = numpy.asarray(slots).tolist()
+        values = numpy.asarray(values).tolist() \
+            if isinstance(values, numpy.ndarray) else list(values)
+        if len(slots) != len(values):
+            raise ControllerException('Number of slots and values must match')
+        self.__check_slots(slots, generation)
+
+        updates = tuple(zip(slots, values))
+        if self.is_loop_running():
+            # apply at the beginning of the next iteration
+            self.timer_updates.append(updates)
+        else:
+            for (slot, value) in updates:
+                self.signal_values[slot] = value
+
+    def get_slots(self, slots, generation = 0):
+        """
+        Get the value of scalar signals by slot, see :py:meth:`get_signals_array`.
+
+        :param slots: the signal slots, see :py:meth:`get_signal_slots`
+        :param int generation: the generation of the slots, see :py:meth:`lookup_signal_slots`; not checked if 0 (default 0)
+        :return: the signal values
+        :rtype: numpy.ndarray
+        :raise: :py:class:`ctrl.ControllerException` if a slot is not valid or stale
+        """
+        slots = numpy.asarray(slots, dtype = int).tolist()
+        self.__check_slots(slots, generation)
+        if self.is_loop_running():
+            values = self.signal_snapshot
+        else:
+            values = self.signal_values
+        return numpy.array([values[slot] for slot in slots],
+                           dtype = float)
 
     def list_signals(self):
         """
@@ -372,7 +594,7 @@ class Controller:
         :return: a list of signal labels
         :rtype: list
         """
-        return list(self.signals.keys())
+        return list(self.signal_slots.keys())
 
     # sources
     def add_source(self, label, source, outputs, order = -1):
@@ -392,21 +614,23 @@ class Controller:
 
         assert isinstance(source, block.Block)
         assert isinstance(outputs, (list, tuple))
-        self.sources[label] = {
-            'block': source,
-            'outputs': outputs
-        }
-        if order < 0:
-            self.sources_order.append(label)
-        else:
-            self.sources_order.insert(order, label)
+        with self.plan_lock:
+            self.sources[label] = {
+                'block': source,
+                'outputs': outputs
+            }
+            if order < 0:
+                self.sources_order.append(label)
+            else:
+                self.sources_order.insert(order, label)
+            self.plan = None
 
-        # make sure output signals exist
-        for s in outputs:
-            if s not in self.signals:
-                warnings.warn("Signal '{}' was not present and is being automatically added.".format(s),
-                              ControllerWarning)
-                self.add_signal(s)
+            # make sure output signals exist
+            for s in outputs:
+                if s not in self.signal_slots:
+                    warnings.warn("Signal '{}' was not present and is being automatically added.".format(s),
+                                  ControllerWarning)
+                    self.add_signal(s)
 
     def remove_source(self, label):
         """
@@ -414,8 +638,10 @@ class Controller:
 
         :param str label: the source label
         """
-        self.sources_order.remove(label)
-        self.sources.pop(label)
+        with self.plan_lock:
+            self.sources_order.remove(label)
+            self.sources.pop(label)['block'].close()
+            self.plan = None
 
     def set_source(self, label, **kwargs):
         """
@@ -434,7 +660,9 @@ class Controller:
         if 'outputs' in kwargs:
             values = kwargs.pop('outputs')
             assert isinstance(values, (list, tuple))
-            self.sources[label]['outputs'] = values
+            with self.plan_lock:
+                self.sources[label]['outputs'] = values
+                self.plan = None
 
         self.sources[label]['block'].set(**kwargs)
 
@@ -497,21 +725,23 @@ class Controller:
 
         assert isinstance(sink, block.Block)
         assert inputs == '*' or isinstance(inputs, (list, tuple))
-        self.sinks[label] = {
-            'block': sink,
-            'inputs': inputs
-        }
-        if order < 0:
-            self.sinks_order.append(label)
-        else:
-            self.sinks_order.insert(order, label)
-
-        # make sure input signals exist
-        for s in inputs:
-            if s not in self.signals:
-                warnings.warn("Signal '{}' was not present and is being automatically added.".format(s),
-                              ControllerWarning)
-                self.add_signal(s)
+        with self.plan_lock:
+            self.sinks[label] = {
+                'block': sink,
+                'inputs': inputs
+            }
+            if order < 0:
+                self.sinks_order.append(label)
+            else:
+                self.sinks_order.insert(order, label)
+            self.plan = None
+
+            # make sure input signals exist
+            for s in inputs:
+                if s not in self.signal_slots:
+                    warnings.warn("Signal '{}' was not present and is being automatically added.".format(s),
+                                  ControllerWarning)
+                    self.add_signal(s)
                 
     def remove_sink(self, label):
         """
@@ -519,8 +749,10 @@ class Controller:
 
         :param str label: the sink label
         """
-        self.sinks_order.remove(label)
-        self.sinks.pop(label)
+        with self.plan_lock:
+            self.sinks_order.remove(label)
+            self.sinks.pop(label)['block'].close()
+            self.plan = None
 
     def set_sink(self, label, **kwargs):
         """
@@ -539,7 +771,9 @@ class Controller:
         if 'inputs' in kwargs:
             values = kwargs.pop('inputs')
             assert isinstance(values, (list, tuple))
-            self.sinks[label]['inputs'] = values
+            with self.plan_lock:
+                self.sinks[label]['inputs'] = values
+                self.plan = None
             
         self.sinks[label]['block'].set(**kwargs)
 
@@ -565,6 +799,18 @@ class Controller:
         """
         return self.sinks[label]['block'].read()
 
+    def read_sink_since(self, label, index):
+        """
+        Read rows written to sink since index. Call method
+        `ctrl.block.Logger.read_since(index)`.
+
+        :param str label: the sink label
+        :param int index: the global row index
+        :return: tuple with the rows, the new index and the number of dropped rows
+        :rtype: tuple
+        """
+        return self.sinks[label]['block'].read_since(index)
+
     def write_sink(self, label, *values):
         """
         Write to sink. Call method `ctrl.block.write(*values)`.
@@ -605,29 +851,31 @@ class Controller:
         assert isinstance(filter_, block.Block)
         assert isinstance(inputs, (list, tuple))
         assert isinstance(outputs, (list, tuple))
-        self.filters[label] = { 
-            'block': filter_,  
-            'inputs': inputs,
-            'outputs': outputs
-        }
-        if order < 0:
-            self.filters_order.append(label)
-        else:
-            self.filters_order.insert(order, label)
-
-        # make sure input signals exist
-        for s in inputs:
-            if s not in self.signals:
-                warnings.warn("Signal '{}' was not present and is being automatically added.".format(s),
-                              ControllerWarning)
-                self.add_signal(s)
+        with self.plan_lock:
+            self.filters[label] = { 
+                'block': filter_,  
+                'inputs': inputs,
+                'outputs': outputs
+            }
+            if order < 0:
+                self.filters_order.append(label)
+            else:
+                self.filters_order.insert(order, label)
+            self.plan = None
+
+            # make sure input signals exist
+            for s in inputs:
+                if s not in self.signal_slots:
+                    warnings.warn("Signal '{}' was not present and is being automatically added.".format(s),
+                                  ControllerWarning)
+                    self.add_signal(s)
                 
-        # make sure output signals exist
-        for s in outputs:
-            if s not in self.signals:
-                warnings.warn("Signal '{}' was not present and is being automatically added".format(s),
-                              ControllerWarning)
-                self.add_signal(s)
+            # make sure output signals exist
+            for s in outputs:
+                if s not in self.signal_slots:
+                    warnings.warn("Signal '{}' was not present and is being automatically added".format(s),
+                                  ControllerWarning)
+                    self.add_signal(s)
             
     def remove_filter(self, label):
         """
@@ -635,8 +883,10 @@ class Controller:
 
         :param str label: the filter label
         """
-        self.filters_order.remove(label)
-        self.filters.pop(label)
+        with self.plan_lock:
+            self.filters_order.remove(label)
+            self.filters.pop(label)['block'].close()
+            self.plan = None
 
     def set_filter(self, label, **kwargs):
         """
@@ -656,12 +906,16 @@ class Controller:
         if 'inputs' in kwargs:
             values = kwargs.pop('inputs')
             assert isinstance(values, (list, tuple))
-            self.filters[label]['inputs'] = values
+            with self.plan_lock:
+                self.filters[label]['inputs'] = values
+                self.plan = None
 
         if 'outputs' in kwargs:
             values = kwargs.pop('outputs')
             assert isinstance(values, (list, tuple))
-            self.filters[label]['outputs'] = values
+            with self.plan_lock:
+                self.filters[label]['outputs'] = values
+                self.plan = None
 
         self.filters[label]['block'].set(**kwargs)
             
@@ -816,6 +1070,12 @@ class Controller:
         """
         Add timer to Controller.
 
+        Timers read their inputs from the values of the signals at the
+        end of the last completed iteration, see
+        :py:meth:`get_snapshot`, or from outputs of timers not yet
+        applied, and their outputs are applied by the loop at the
+        beginning of the next iteration.
+
         :param str label: the timer label
         :param ctrl.block blk: the timer block
         :param list inputs: a list of input signals
@@ -850,7 +1110,7 @@ class Controller:
 
         :param str label: the timer label
         """
-        self.timers.pop(label)
+        self.timers.pop(label)['block'].close()
         
     def set_timer(self, label, **kwargs):
         """
@@ -918,7 +1178,194 @@ class Controller:
         :rtype: list
         """
         return list(self.timers.keys())
+
+    # schedule
+    def schedule(self, commands, iteration = None, time = None):
+        """
+        Schedule commands to be executed by the Controller loop.
+
+        All commands are executed together in a single iteration of
+        the loop, after sources are read and before filters are
+        processed, so that filters and sinks see all their effects at
+        once. Each command is one of the tuples
+
+        * `('set_signal', label, value)`
+        * `('set_filter', label, attributes)`, where `attributes` is a dictionary of attributes as in :py:meth:`set_filter`
+
+        Commands are executed at the iteration with index
+        :py:data:`iteration`, counted from zero every time the loop
+        starts, or at the first iteration in which the signal `clock`
+        reaches :py:data:`time`. Commands that are due at the same
+        iteration are executed in the order they were scheduled.
+        Changes to the inputs or outputs of filters take effect in
+        the following iteration.
+
+        :param list commands: the commands
+        :param int iteration: the index of the iteration
+        :param float time: the time
+        :raise: :py:class:`ctrl.ControllerException` if a command is not valid or if neither or both `iteration` and `time` are given
+        """
+        if (iteration is None) == (time is None):
+            raise ControllerException('Either iteration or time must be given')
+
+        if iteration is None:
+            self.load_schedule([(time, commands)], time = True)
+        else:
+            self.load_schedule([(iteration, commands)])
+
+    def load_schedule(self, entries, time = False, clear = False):
+        """
+        Schedule multiple entries at once, for example a reference
+        trajectory, see :py:meth:`schedule`.
+
+        :param list entries: list of tuples (iteration, commands), or (time, commands) if `time` is `True`
+        :param bool time: whether entries are scheduled by time (default `False`)
+        :param bool clear: whether to remove all entries scheduled before (default `False`)
+        :raise: :py:class:`ctrl.ControllerException` if a command is not valid
+        """
+        key = 'time' if time else 'iteration'
+        if time and 'clock' not in self.signal_slots:
+            raise ControllerException("Signal 'clock' does not exist")
+
+        queue = [ ]
+        for (when, commands) in entries:
+            commands = tuple(tuple(command) for command in commands)
+            for command in commands:
+                if len(command) != 3:
+                    raise ControllerException("Invalid command '{}'".format(command))
+                (name, label, value) = command
+                if name == 'set_signal':
+                    if label not in self.signal_slots:
+                        raise ControllerException("Signal '{}' does not exist".format(label))
+                elif name == 'set_filter':
+                    if label not in self.filters:
+                        raise ControllerException("Filter '{}' does not exist".format(label))
+                    if not isinstance(value, dict):
+                        raise ControllerException('Filter attributes must be a dictionary')
+                else:
+                    raise ControllerException("Unknown command '{}'".format(name))
+            queue.append((key, (when, next(self.schedule_order), commands)))
+
+        if clear:
+            self.clear_schedule()
+        # the loop merges queued entries at its next iteration
+        self.schedule_queue.extend(queue)
+
+    def clear_schedule(self):
+        """
+        Remove all scheduled commands.
+        """
+        if self.is_loop_running():
+            # let the loop clear its entries
+            self.schedule_queue.append(None)
+        else:
+            self.schedule_queue.clear()
+            for heap in self.schedule_heaps.values():
+                heap.clear()
+
+    def list_schedule(self):
+        """
+        List scheduled commands that have not been executed yet.
+
+        :return: dictionary with the lists of tuples (iteration, commands) and (time, commands) under the keys `iteration` and `time`, in order of execution
+        :rtype: dict
+        """
+        schedule = { key: list(heap)
+                     for (key, heap) in self.schedule_heaps.items() }
+        for entry in list(self.schedule_queue):
+            if entry is None:
+                for entries in schedule.values():
+                    entries.clear()
+            else:
+                schedule[entry[0]].append(entry[1])
+        return { key: [(when, commands)
+                       for (when, order, commands) in sorted(entries)]
+                 for (key, entries) in schedule.items() }
+
+    def run_schedule(self):
+        """
+        Execute the scheduled commands that are due at the current
+        iteration.
+        """
+        heaps = self.schedule_heaps
+
+        # merge queued entries
+        queue = self.schedule_queue
+        while queue:
+            entry = queue.popleft()
+            if entry is None:
+                for heap in heaps.values():
+                    heap.clear()
+            else:
+                heapq.heappush(heaps[entry[0]], entry[1])
+
+        heap = heaps['iteration']
+        while heap and heap[0][0] <= self.iteration:
+            self.execute_commands(heapq.heappop(heap)[2])
+
+        heap = heaps['time']
+        clock = self.signal_slots.get('clock')
+        if heap and clock is not None:
+            time = self.signal_values[clock]
+            while heap and heap[0][0] <= time:
+                self.execute_commands(heapq.heappop(heap)[2])
+
+    def execute_commands(self, commands):
+        """
+        Execute scheduled commands, see :py:meth:`schedule`.
+
+        :param tuple commands: the commands
+        """
+        values = self.signal_values
+        for (name, label, value) in commands:
+            try:
+                if name == 'set_signal':
+                    values[self.signal_slots[label]] = value
+                else:
+                    self.set_filter(label, **value)
+            except Exception as e:
+                # do not interrupt the loop
+                warnings.warn("Scheduled command '{}' on '{}' failed: {}".format(name, label, e),
+                              ControllerWarning)
         
+    # profiling
+    def set_profiling(self, enabled = True):
+        """
+        Enable or disable profiling of the Controller loop.
+
+        When enabled the duration of every `read` and `write` of
+        sources, filters and sinks as well as the loop period, jitter
+        and duty are recorded. Enabling profiling resets all
+        previously recorded data.
+
+        :param bool enabled: True or False (default True)
+        """
+        with self.plan_lock:
+            if enabled:
+                if self.profiler is None:
+                    self.profiler = Profiler()
+                else:
+                    self.profiler.reset()
+            else:
+                self.profiler = None
+            self.plan = None
+
+    def get_profile(self):
+        """
+        Get profile of the Controller loop.
+
+        Statistics are indexed by keys of the form `sources.label.read`,
+        `filters.label.write`, `sinks.label.write`, `loop.period`,
+        `loop.jitter` and `loop.duty`, and have the keys `count`, `min`,
+        `mean`, `max`, and `p99`. Times are in seconds.
+
+        :return: dictionary of statistics, empty if not profiling
+        :rtype: dict
+        """
+        if self.profiler is None:
+            return { }
+        return self.profiler.stats()
+
     def __enter__(self):
         if self.debug > 0:
             print('> Starting controller')
@@ -930,111 +1377,375 @@ class Controller:
             print('> Stoping controller')
         self.stop()
 
+    def sort_filters(self):
+        """
+        Sort filters according to the dependencies of their signals.
+
+        A filter is executed after all filters that write to its
+        input signals. Filters that are not ordered by their
+        dependencies keep the order in :py:attr:`filters_order`. If
+        filters form an algebraic loop then the loop is broken at the
+        first filter in :py:attr:`filters_order`, which reads the
+        values of the signals in the loop from the previous iteration,
+        and a :py:class:`ctrl.ControllerWarning` is issued. The labels
+        of these filters are stored in :py:attr:`algebraic_loops`.
+
+        :return: list of filter labels in execution order
+        :rtype: list
+        """
+        index = { label: k for (k, label) in enumerate(self.filters_order) }
+
+        # filters writing to each signal
+        producers = { }
+        for label in self.filters_order:
+            for s in self.filters[label]['outputs']:
+                producers.setdefault(s, set()).add(label)
+
+        # dependency graph
+        dependencies = { }
+        dependents = { label: set() for label in self.filters_order }
+        for label in self.filters_order:
+            dependencies[label] = set(p
+                                      for s in self.filters[label]['inputs']
+                                      for p in producers.get(s, ())
+                                      if p != label)
+            for p in dependencies[label]:
+                dependents[p].add(label)
+
+        # Kahn's algorithm, ties resolved by filters_order
+        ready = [index[label] for label in self.filters_order
+                 if not dependencies[label]]
+        heapq.heapify(ready)
+        remaining = set(self.filters_order)
+        order = [ ]
+        self.algebraic_loops = [ ]
+        while remaining:
+
+            if ready:
+                label = self.filters_order[heapq.heappop(ready)]
+
+            else:
+                # algebraic loop, break at first remaining filter
+                label = min(remaining, key = index.get)
+                self.algebraic_loops.append(label)
+                inputs = [s for s in self.filters[label]['inputs']
+                          if producers.get(s, set()) & remaining - {label}]
+                warnings.warn("Algebraic loop detected: filter '{}' reads signal(s) '{}' from the previous iteration.".format(label, ', '.join(inputs)),
+                              ControllerWarning)
+
+            remaining.discard(label)
+            order.append(label)
+            for d in dependents[label]:
+                if d in remaining and dependencies[d]:
+                    dependencies[d].discard(label)
+                    if not dependencies[d]:
+                        heapq.heappush(ready, index[d])
+
+        return order
+
+    def compile_plan(self):
+        """
+        Compile sources, filters and sinks into an execution plan.
+
+        Each entry in the plan holds a block together with the slots
+        of its input and output signals so that :py:meth:`run` does
+        not need to look up signals by label. The plan is compiled by
+        :py:meth:`start` and recompiled whenever sources, filters or
+        sinks change. Compilation holds :py:attr:`plan_lock`, as do
+        changes to sources, filters and sinks, so that a plan is never
+        compiled from a block being added or removed by another thread.
+
+        :return: tuple with the sources, filters and sinks plans
+        :rtype: tuple
+        """
+        with self.plan_lock:
+            slots = self.signal_slots
+
+            # wrap blocks if profiling
+            if self.profiler is None:
+                wrap = lambda kind, label, block: block
+            else:
+                wrap = self.profiler.wrap
+
+            # sort filters
+            if self.auto_order:
+                filters_order = self.sort_filters()
+            else:
+                filters_order = self.filters_order
+
+            sources = tuple((wrap('sources', label, self.sources[label]['block']),
+                             tuple(slots[s] for s in self.sources[label]['outputs']))
+                            for label in self.sources_order)
+
+            filters = tuple((wrap('filters', label, self.filters[label]['block']),
+                             tuple(slots[s] for s in self.filters[label]['inputs']),
+                             tuple(slots[s] for s in self.filters[label]['outputs']))
+                            for label in filters_order)
+
+            # run independent branches of filters in parallel
+            if self.workers > 0 and len(filters) > 1:
+                branches = parallel.partition(filters,
+                                              [self.filters[label]['inputs']
+                                               for label in filters_order],
+                                              [self.filters[label]['outputs']
+                                               for label in filters_order])
+                if len(branches) > 1:
+                    if self.executor is None:
+                        self.executor = ThreadPoolExecutor(max_workers = self.workers)
+                    filters = ((parallel.ParallelFilters(branches,
+                                                         self.signal_values,
+                                                         self.executor),
+                                (), ()),)
+
+            sinks = tuple((wrap('sinks', label, self.sinks[label]['block']),
+                           tuple(slots[s] for s in self.sinks[label]['inputs']))
+                          for label in self.sinks_order)
+
+            self.plan = (sources, filters, sinks)
+            return self.plan
+
+    def step(self):
+        """
+        Execute one iteration of the Controller loop: read all
+        sources, process all filters and write to all sinks.
+
+        :return: the duty of the iteration
+        :rtype: float
+        """
+
+        # signal values
+        values = self.signal_values
+
+        # Retrieve plan, compile if it has changed
+        (sources, filters, sinks) = self.plan or self.compile_plan()
+
+        # apply outputs of timers at the iteration boundary
+        if self.timer_updates:
+            self.apply_timer_updates()
+
+        # Read all sources
+        first = True
+        t0 = 0
+        for (source, outputs) in sources:
+            if source.is_enabled():
+                # retrieve outputs
+                for (slot, value) in zip(outputs, source.read()):
+                    values[slot] = value
+                # Begin profiling
+                if first:
+                    t0 = perf_counter()
+                    first = False
+
+        # execute scheduled commands
+        if (self.schedule_queue or self.schedule_heaps['iteration'] or
+            self.schedule_heaps['time']):
+            self.run_schedule()
+        self.iteration += 1
+
+        # Process all filters
+        for (fltr, inputs, outputs) in filters:
+            if fltr.is_enabled():
+                # write signals to inputs
+                fltr.write(*[values[slot] for slot in inputs])
+                # retrieve outputs
+                for (slot, value) in zip(outputs, fltr.read()):
+                    values[slot] = value
+
+        # Write to all sinks
+        for (sink, inputs) in sinks:
+            if sink.is_enabled():
+                # write inputs
+                sink.write(*[values[slot] for slot in inputs])
+
+        # update is_running
+        self.is_running = values[IS_RUNNING]
+
+        # update duty
+        duty = perf_counter() - t0
+        values[DUTY] = duty
+        self.duty = max(self.duty, duty)
+
+        # publish snapshot
+        self.signal_snapshot = tuple(values)
+
+        # profile loop
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.tick(t0, duty)
+
+        return duty
+    
     def run(self):
 
         # Loop
         self.is_running = True
-        self.signals['is_running'] = self.is_running
+        self.signal_values[IS_RUNNING] = self.is_running
 
         self.duty = 0
-        self.signals['duty'] = self.duty
+        self.signal_values[DUTY] = self.duty
 
         while self.is_running and self.state != EXITING:
 
             # Run the loop
             #print("*** LOOP ****")
+            self.step()
+
+        # wake up timer thread
+        self.timer_condition.acquire()
+        self.timer_condition.notify_all()
+        self.timer_condition.release()
+
+    def run_for(self, steps):
+        """
+        Run Controller loop synchronously in the calling thread.
+
+        The loop runs for at most :py:data:`steps` iterations or until
+        the signal `is_running` becomes False. Devices are enabled and
+        disabled as in :py:meth:`start` and :py:meth:`stop`.
+
+        Timers also run in the calling thread and fire when the
+        signal `clock` reaches their deadline, counted from the value
+        of `clock` after the first iteration. With a
+        :py:class:`ctrl.block.clock.VirtualClock` the results are
+        therefore reproducible and do not depend on wall time.
+
+        :param int steps: maximum number of iterations
+        :return: number of iterations executed
+        :rtype: int
+        :raise: :py:class:`ctrl.ControllerException` if the loop is running in another thread
+        """
+        if self.thread is not None and self.thread.is_alive():
+            raise ControllerException('Controller loop is already running')
+
+        # enable devices
+        for label, device in self.devices.items():
+            if device['enable']:
+                device['instance'].set_enabled(True)
+
+        values = self.signal_values
+        clock = self.signal_slots.get('clock')
+        heap = None
+
+        self.compile_plan()
+        self.is_running = True
+        values[IS_RUNNING] = self.is_running
+        self.signal_snapshot = tuple(values)
+        self.iteration = 0
+
+        k = 0
+        while k < steps and self.is_running and self.state != EXITING:
+
+            self.step()
+            k += 1
+
+            if clock is None or not self.timers:
+                continue
             
-            # Read all sources
-            first = True
-            t0 = 0
-            for label in self.sources_order:
-                block = self.sources[label]
-                source = block['block']
-                if source.is_enabled():
-                    # retrieve outputs
-                    self.signals.update(dict(zip(block['outputs'], 
-                                                 source.read())))
-                    # Begin profiling
-                    if first:
-                        t0 = perf_counter()
-                        first = False
-
-            # Process all filters
-            for label in self.filters_order:
-                block = self.filters[label]
-                fltr = block['block']
-                if fltr.is_enabled():
-                    # write signals to inputs
-                    fltr.write(*[self.signals[label] 
-                                 for label in block['inputs']])
-                    # retrieve outputs
-                    self.signals.update(dict(zip(block['outputs'], 
-                                                 fltr.read())))
-
-            # Write to all sinks
-            for label in self.sinks_order:
-                block = self.sinks[label]
-                sink = block['block']
-                if sink.is_enabled():
-                    # write inputs
-                    sink.write(*[self.signals[label]
-                                 for label in block['inputs']])
-
-            # update is_running
-            self.is_running = self.signals['is_running']
-
-            # update duty
-            duty = perf_counter() - t0
-            self.signals['duty'] = duty
-            self.duty = max(self.duty, duty)
+            # Schedule timers on the first iteration
+            time = values[clock]
+            if heap is None:
+                heap = [(time + device['period'], n, label, device)
+                        for (n, (label, device)) in enumerate(self.timers.items())]
+                heapq.heapify(heap)
+                
+            # Run expired timers
+            while heap and heap[0][0] <= time:
+                (deadline, n, label, device) = heap[0]
+                if device['repeat']:
+                    heapq.heapreplace(heap,
+                                      (deadline + device['period'],
+                                       n, label, device))
+                else:
+                    heapq.heappop(heap)
+                self.tick(label, device)
+
+        # apply outputs of the last timers
+        self.apply_timer_updates()
+
+        # disable devices
+        for label, device in self.devices.items():
+            if device['enable']:
+                device['instance'].set_enabled(False)
 
-    def tick(self, label, device):
+        self.is_running = False
+        values[IS_RUNNING] = self.is_running
+
+        return k
 
-        # Acquire lock
-        device['condition'].acquire()
+    def tick(self, label, device):
 
         # Got a tick, run device
+
+        # Inputs come from the snapshot of the last completed
+        # iteration and outputs are queued to be applied by the loop
+        # at the beginning of the next iteration
+
+        slots = self.signal_slots
+        values = self.signal_snapshot
         
         if device['inputs']:
+
+            # outputs of timers not yet applied by the loop
+            pending = { }
+            for update in list(self.timer_updates):
+                pending.update(update)
             
             # write signals to inputs
-            device['block'].write(*[self.signals[label] 
+            device['block'].write(*[pending.get(slots[label],
+                                                values[slots[label]])
                                     for label in device['inputs']])
             
         if device['outputs']:
                 
-            # retrieve outputs
-            self.signals.update(dict(zip(device['outputs'], 
-                                         device['block'].read())))
+            # queue outputs
+            self.timer_updates.append(
+                tuple((slots[label], value)
+                      for (label, value) in zip(device['outputs'],
+                                                device['block'].read())))
 
-        # Notify lock
-        device['condition'].notify_all()
-        
-        # Release lock
-        device['condition'].release()
+    def apply_timer_updates(self):
+        """
+        Apply the outputs of timers queued by :py:meth:`tick`.
+        """
+        values = self.signal_values
+        updates = self.timer_updates
+        while updates:
+            for (slot, value) in updates.popleft():
+                values[slot] = value
     
-    def run_timer(self, label, device):
-
-        while self.is_running and self.state != EXITING:
-
-            # Acquire condition
-            device['condition'].acquire()
-            
-            # Setup timer
-            self.running_timers[label] = Timer(device['period'],
-                                               self.tick,
-                                               args = (label, device))
-            self.running_timers[label].start()
-
-            # Wait 
-            device['condition'].wait()
+    def run_timers(self):
+
+        # Schedule all timers in a heap ordered by deadline
+        t0 = perf_counter()
+        heap = [(t0 + device['period'], k, label, device)
+                for (k, (label, device)) in enumerate(self.timers.items())]
+        heapq.heapify(heap)
+
+        # Acquire condition
+        self.timer_condition.acquire()
+
+        while heap and self.is_running and self.state != EXITING:
+
+            # Wait for earliest deadline
+            (deadline, k, label, device) = heap[0]
+            delay = deadline - perf_counter()
+            if delay > 0:
+                self.timer_condition.wait(delay)
+                continue
+
+            # Reschedule or remove
+            if device['repeat']:
+                heapq.heapreplace(heap,
+                                  (deadline + device['period'],
+                                   k, label, device))
+            else:
+                heapq.heappop(heap)
 
-            # and release
-            device['condition'].release()
+            # Got a tick
+            self.tick(label, device)
 
-            # repeat
-            if not device['repeat']:
-                break
+        # and release
+        self.timer_condition.release()
             
     def start(self):
         """
@@ -1046,16 +1757,22 @@ class Controller:
             if device['enable']:
                 device['instance'].set_enabled(True)
 
+        # compile execution plan
+        self.compile_plan()
+
+        # initial snapshot
+        self.signal_snapshot = tuple(self.signal_values)
+        self.iteration = 0
+
         # Start thread
+        self.is_running = True
         self.thread = Thread(target = self.run)
         self.thread.start()
 
-        # start timer threads
-        for label, device in self.timers.items():
-            device['condition'] = Condition()
-            thread = Thread(target = self.run_timer,
-                            args = (label, device))
-            thread.start()
+        # start timer thread
+        if self.timers:
+            self.timer_thread = Thread(target = self.run_timers)
+            self.timer_thread.start()
         
         # change state to running
         self.state = RUNNING
@@ -1068,25 +1785,34 @@ class Controller:
         # Stop thread
         if self.is_running:
             self.is_running = False
-            self.signals['is_running'] = self.is_running
+            self.signal_values[IS_RUNNING] = self.is_running
 
-        # start timer threads
-        for (label,t) in self.running_timers.items():
-            # Try cancelling timer
-            t.cancel()
-            # Release condition
-            device = self.timers[label]
-            device['condition'].acquire()
-            device['condition'].notify_all()
-            device['condition'].release()
+        # wake up timer thread and wait for it to finish
+        self.timer_condition.acquire()
+        self.timer_condition.notify_all()
+        self.timer_condition.release()
 
-        self.running_timers = { }
+        if self.timer_thread and self.timer_thread is not current_thread():
+            self.timer_thread.join()
 
         # then disable devices
         for label, device in self.devices.items():
             if device['enable']:
                 device['instance'].set_enabled(False)
 
+        # wait for loop to finish its last iteration
+        if self.thread and self.thread is not current_thread():
+            self.thread.join()
+
+        # apply outputs of the last timers
+        self.apply_timer_updates()
+
+        # shutdown pool of parallel filters
+        if self.executor is not None:
+            self.executor.shutdown(wait = False)
+            self.executor = None
+            self.plan = None
+
         # change state to idle
         self.state = IDLE
 
@@ -0,0 +1,587 @@
+"""
+This module provides :py:class:`ctrl.aioclient.Controller`, an
+:py:mod:`asyncio` version of :py:class:`ctrl.client.Controller` whose
+methods are coroutines, for example::
+
+    async def main():
+        async with Controller(host = 'localhost', port = 9999) as controller:
+            (clock, encoder1) = await asyncio.gather(
+                controller.get_signal('clock'),
+                controller.get_signal('encoder1'))
+
+Requests issued concurrently are pipelined on a single connection and
+their replies are matched to the requests in order.
+"""
+
+import asyncio
+import collections
+import socket
+import numpy
+
+from . import packet
+import ctrl
+
+class Subscription:
+    """
+    :py:class:`ctrl.aioclient.Subscription` receives samples of
+    signals streamed by a server, see
+    :py:meth:`ctrl.aioclient.Controller.subscribe`.
+
+    Frames are received on a dedicated connection, for example::
+
+        async with await controller.subscribe(['clock'], rate = 10) as subscription:
+            async for (frame, dropped) in subscription:
+                print(frame)
+
+    See :py:class:`ctrl.client.Subscription` for the parameters.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.parser = packet.Parser()
+        self.packets = collections.deque()
+
+    @classmethod
+    async def open(cls, host, port, labels,
+                   decimation = 1, rate = 0, size = 1000, name = None):
+        """
+        Open a connection and subscribe to signals.
+
+        :return: the subscription
+        :rtype: ctrl.aioclient.Subscription
+        """
+        (reader, writer) = await asyncio.open_connection(host, port)
+        subscription = cls(reader, writer)
+
+        # select the remote controller first
+        if name is not None:
+            writer.write(packet.pack('C', '3') + packet.pack('S', name))
+            await subscription.acknowledge()
+
+        writer.write(packet.pack('C', 'a') +
+                     packet.pack('P', list(labels)) +
+                     packet.pack('I', decimation) +
+                     packet.pack('D', rate) +
+                     packet.pack('I', size))
+        await subscription.acknowledge()
+        return subscription
+
+    async def acknowledge(self):
+        # receive acknowledgment, raise and close if error
+        await self.writer.drain()
+        (type, value) = await self.receive()
+        if type == 'E':
+            self.writer.close()
+            self.writer = None
+            raise value
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.read()
+
+    async def receive(self):
+        while not self.packets:
+            data = await self.reader.read(65536)
+            if not data:
+                raise ConnectionError('Connection closed by server')
+            self.packets.extend(self.parser.feed(data))
+        return self.packets.popleft()
+
+    async def read(self):
+        """
+        Wait for the next frame, see :py:meth:`ctrl.client.Subscription.read`.
+
+        :return: tuple (frame, dropped)
+        :rtype: tuple
+        """
+        (type, frame) = await self.receive()
+        (type, dropped) = await self.receive()
+        return (frame, dropped)
+
+    async def close(self):
+        """
+        Unsubscribe and close the connection.
+        """
+        if self.writer is None:
+            return
+        self.writer.write(packet.pack('C', 'b'))
+        await self.writer.drain()
+        # discard frames sent before the acknowledgment
+        while await self.receive() != ('A', 'b'):
+            pass
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.writer = None
+
+class Controller:
+    """
+    :py:class:`ctrl.aioclient.Controller` provides a controller that
+    can remotely interact with a server from :py:mod:`asyncio` code.
+
+    It offers the same methods as :py:class:`ctrl.client.Controller`
+    as coroutines. The connection is opened on the first request and
+    kept open; it is reopened if it was lost. Entering the context
+    of the controller starts the remote loop and exiting it stops the
+    loop and closes the connection.
+
+    :param host: host name or ip address (default: 'localhost')
+    :param port: port number (default: 9999)
+    """
+
+    def __init__(self, host = 'localhost', port = 9999):
+
+        self.host = host
+        self.port = port
+
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.replies = collections.deque()
+        # serializes (re)connections
+        self.lock = None
+        self.slots = {}
+        self.generation = 0
+        self.name = None
+        self.shutdown_request = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.stop()
+        await self.close()
+
+    async def open(self):
+        """
+        Open the connection to the server.
+
+        Requests are sent on the new connection only after the
+        remote controller has been selected, see :py:meth:`select`.
+        """
+        (reader, writer) = await asyncio.open_connection(self.host, self.port)
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP,
+                                                   socket.TCP_NODELAY, 1)
+        # each connection matches its own replies
+        replies = collections.deque()
+        task = asyncio.create_task(self.receive(reader, replies))
+
+        # select the remote controller again
+        if self.name is not None:
+            future = asyncio.get_running_loop().create_future()
+            replies.append(future)
+            writer.write(packet.pack('C', '3') + packet.pack('S', self.name))
+            try:
+                (type, value) = await future
+                if type == 'E':
+                    raise value
+            except Exception:
+                writer.close()
+                await task
+                raise
+
+        (self.reader, self.writer, self.task, self.replies) = (reader, writer,
+                                                                task, replies)
+        # slots are negotiated again on every connection
+        self.slots = {}
+
+    async def close(self):
+        """
+        Close the connection to the server.
+        """
+        (writer, task) = (self.writer, self.task)
+        if writer is None:
+            return
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+        await task
+        if self.writer is writer:
+            (self.reader, self.writer, self.task) = (None, None, None)
+
+    async def receive(self, reader, replies):
+        # match replies to pending requests in order
+        parser = packet.Parser()
+        reply = None
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for (type, value) in parser.feed(data):
+                    if isinstance(replies[0], asyncio.Queue):
+                        # stream packets of downloads
+                        replies[0].put_nowait((type, value))
+                        if type == 'A':
+                            replies.popleft()
+                        continue
+                    if type != 'A':
+                        reply = (type, value)
+                        continue
+                    future = replies.popleft()
+                    if not future.done():
+                        future.set_result(reply or ('A', None))
+                    reply = None
+        except ConnectionError:
+            pass
+        # fail pending requests of this connection
+        while replies:
+            future = replies.popleft()
+            if isinstance(future, asyncio.Queue):
+                future.put_nowait(('E', ConnectionError('Connection lost')))
+            elif not future.done():
+                future.set_exception(ConnectionError('Connection lost'))
+        if reader is self.reader:
+            self.writer = None
+
+    async def send(self, command, *vargs):
+        """
+        Send command and wait for its reply.
+
+        :param str command: the command code
+        :param vargs vargs: pairs of argument type and value
+        :return: the value of the reply, `None` if there is no reply
+        :raise: the exception raised by the remote controller
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.request(future, command, *vargs)
+        (type, value) = await future
+
+        # If error, raise exception
+        if type == 'E':
+            raise value
+
+        return value
+
+    async def request(self, reply, command, *vargs):
+        """
+        Send command, reconnecting if needed.
+
+        :param reply: the future that receives the reply, or the queue that receives all packets up to the acknowledgment
+        :param str command: the command code
+        :param vargs vargs: pairs of argument type and value
+        """
+        # Make sure vargs is in pairs
+        n = len(vargs)
+        assert n % 2 == 0
+
+        buffer = [packet.pack('C', command)]
+        for (argtype, argvalue) in (vargs[i:i+2] for i in range(0, n, 2)):
+            buffer.append(packet.pack(argtype, argvalue))
+
+        # Reconnect if needed, once for all concurrent requests
+        if self.writer is None or self.writer.is_closing():
+            if self.lock is None:
+                self.lock = asyncio.Lock()
+            async with self.lock:
+                if self.writer is None or self.writer.is_closing():
+                    await self.open()
+
+        self.replies.append(reply)
+        self.writer.write(b''.join(buffer))
+        await self.writer.drain()
+
+    # Controller methods
+    async def help(self, value = ''):
+        return await self.send('A', 'S', value)
+
+    async def info(self, *options):
+        return await self.send('B', 'R', options)
+
+    async def reset(self, **kwargs):
+        self.slots = {}
+        return await self.send('Z', 'K', kwargs)
+
+    async def select(self, name):
+        """
+        Select the remote controller, see
+        :py:meth:`ctrl.client.Controller.select`.
+        """
+        await self.send('3', 'S', name)
+        self.name = name
+        self.slots = {}
+
+    async def list_controllers(self):
+        return await self.send('4')
+
+    # signals
+    async def add_signal(self, label):
+        await self.send('C', 'S', label)
+
+    async def set_signal(self, label, values):
+        await self.send('D', 'S', label, 'P', values)
+
+    async def get_signal(self, label):
+        return await self.send('E', 'S', label)
+
+    async def get_signals(self, *labels):
+        return await self.send('e', 'R', labels)
+
+    async def get_snapshot(self, *labels):
+        return await self.send('n', 'R', labels)
+
+    async def lookup_signal_slots(self, *labels):
+        return await self.send('h', 'R', labels)
+
+    async def set_slots(self, slots, values, generation = 0):
+        await self.send('k', 'V', numpy.asarray(slots, dtype = numpy.int32),
+                        'V', numpy.asarray(values, dtype = float),
+                        'I', generation)
+
+    async def get_slots(self, slots, generation = 0):
+        return await self.send('l', 'V', numpy.asarray(slots, dtype = numpy.int32),
+                               'I', generation)
+
+    async def lookup_slots(self, labels):
+        """
+        Return the slots of signals, see
+        :py:meth:`ctrl.client.Controller.lookup_slots`.
+        """
+        if any(label not in self.slots for label in labels):
+            (generation, slots) = await self.lookup_signal_slots(*labels)
+            if generation != self.generation:
+                # slots negotiated before are stale
+                self.slots = {}
+                self.generation = generation
+            self.slots.update(zip(labels, slots))
+        return numpy.array([self.slots[label] for label in labels],
+                           dtype = numpy.int32)
+
+    async def set_signals(self, mapping):
+        (labels, values) = (list(mapping.keys()), list(mapping.values()))
+        slots = await self.lookup_slots(labels)
+        try:
+            await self.set_slots(slots, values, self.generation)
+        except ctrl.ControllerException:
+            # negotiate stale slots again
+            self.slots = {}
+            await self.set_slots(await self.lookup_slots(labels), values,
+                                 self.generation)
+
+    async def get_signals_array(self, *labels):
+        slots = await self.lookup_slots(labels)
+        try:
+            return await self.get_slots(slots, self.generation)
+        except ctrl.ControllerException:
+            # negotiate stale slots again
+            self.slots = {}
+            return await self.get_slots(await self.lookup_slots(labels),
+                                        self.generation)
+
+    async def list_signals(self):
+        return await self.send('F')
+
+    async def remove_signal(self, label):
+        self.slots.pop(label, None)
+        await self.send('G', 'S', label)
+
+    # sources
+    async def add_source(self, label, source, signals, order = -1):
+        await self.send('H', 'S', label, 'P', source, 'P', signals, 'I', order)
+
+    async def set_source(self, label, **kwargs):
+        await self.send('I', 'S', label, 'K', kwargs)
+
+    async def get_source(self, label, *keys):
+        return await self.send('i', 'S', label, 'R', keys)
+
+    async def remove_source(self, label):
+        return await self.send('J', 'S', label)
+
+    async def list_sources(self):
+        return await self.send('K')
+
+    async def write_source(self, label, *values):
+        await self.send('L', 'S', label, 'R', values)
+
+    async def read_source(self, label):
+        return await self.send('M', 'S', label)
+
+
+    # sinks
+    async def add_sink(self, label, sink, signals, order = -1):
+        await self.send('N', 'S', label, 'P', sink, 'P', signals, 'I', order)
+
+    async def set_sink(self, label, **kwargs):
+        await self.send('O', 'S', label, 'K', kwargs)
+
+    async def get_sink(self, label, *keys):
+        return await self.send('o', 'S', label, 'R', keys)
+
+    async def remove_sink(self, label):
+        return await self.send('P', 'S', label)
+
+    async def list_sinks(self):
+        return await self.send('Q')
+
+    async def write_sink(self, label, *values):
+        await self.send('R', 'S', label, 'R', values)
+
+    async def download_sink(self, label, index = 0, rows = 4096, level = 0):
+        """
+        Download the rows written to a sink in chunks, see
+        :py:meth:`ctrl.client.Controller.download_sink`.
+
+        :return: asynchronous iterator over tuples (index, chunk, dropped)
+        """
+        retry = True
+        while True:
+            queue = asyncio.Queue()
+            try:
+                await self.request(queue, '2', 'S', label, 'I', index,
+                                   'I', rows, 'I', level)
+            except ConnectionError:
+                if not retry:
+                    raise
+                retry = False
+                continue
+
+            # packets are queued until the acknowledgment, even if
+            # the iteration stops early
+            error = None
+            while True:
+                (type, value) = await queue.get()
+                if type == 'A':
+                    break
+                if type == 'E':
+                    error = value
+                    if isinstance(error, ConnectionError):
+                        break
+                    continue
+                (start, dropped, data) = value
+                chunk = packet.unpack_rows(data)
+                index = start + len(chunk)
+                retry = True
+                yield (start, chunk, dropped)
+
+            if isinstance(error, ConnectionError) and retry:
+                # connection was lost, resume once
+                retry = False
+                continue
+            if error is not None:
+                raise error
+            return
+
+    async def read_sink(self, label):
+        return await self.send('S', 'S', label)
+
+    async def read_sink_since(self, label, index):
+        return await self.send('s', 'S', label, 'I', index)
+
+
+    # filters
+    async def add_filter(self, label, filter_, 
+                         input_signals, output_signals,
+                         order = -1):
+        await self.send('T', 'S', label, 'P', filter_, 
+                        'P', input_signals, 'P', output_signals, 
+                        'I', order)
+
+    async def set_filter(self, label, **kwargs):
+        await self.send('U', 'S', label, 'K', kwargs)
+
+    async def get_filter(self, label, *keys):
+        return await self.send('u', 'S', label, 'R', keys)
+
+    async def remove_filter(self, label):
+        return await self.send('V', 'S', label)
+
+    async def list_filters(self):
+        return await self.send('W')
+
+    async def write_filter(self, label, *values):
+        await self.send('X', 'S', label, 'R', values)
+
+    async def read_filter(self, label):
+        return await self.send('Y', 'S', label)
+
+    # schedule
+    async def schedule(self, commands, iteration = None, time = None):
+        await self.send('m', 'P', commands,
+                        'K', {'iteration': iteration, 'time': time})
+
+    async def load_schedule(self, entries, time = False, clear = False):
+        await self.send('r', 'P', entries, 'K', {'time': time, 'clear': clear})
+
+    async def clear_schedule(self):
+        await self.send('r', 'P', [], 'K', {'clear': True})
+
+    async def list_schedule(self):
+        return await self.send('1')
+
+    # devices
+    async def add_device(self, label, device_module, device_class, **kwargs):
+        await self.send('z',
+                        'S', label,
+                        'S', device_module,
+                        'S', device_class,
+                        'K', kwargs)
+
+    # timers
+    async def add_timer(self, label, blk, inputs, outputs, period, repeat = True):
+        await self.send('t', 'S', label,
+                        'P', blk, 'P', inputs, 'P', outputs, 
+                        'D', period, 'I', repeat)
+        
+    async def set_timer(self, label, **kwargs):
+        await self.send('f', 'S', label, 'K', kwargs)
+
+    async def get_timer(self, label, *keys):
+        return await self.send('g', 'S', label, 'R', keys)
+
+    async def remove_timer(self, label):
+        return await self.send('v', 'S', label)
+
+    async def list_timers(self):
+        return await self.send('w')
+
+    async def write_timer(self, label, *values):
+        await self.send('x', 'S', label, 'R', values)
+
+    async def read_timer(self, label):
+        return await self.send('y', 'S', label)
+    
+    # subscriptions
+    async def subscribe(self, labels, decimation = 1, rate = 0, size = 1000):
+        """
+        Subscribe to signals streamed by the server, see
+        :py:meth:`ctrl.client.Controller.subscribe`.
+
+        :return: the subscription
+        :rtype: ctrl.aioclient.Subscription
+        """
+        return await Subscription.open(self.host, self.port, labels,
+                                       decimation, rate, size, self.name)
+
+    # profiling
+    async def set_profiling(self, enabled = True):
+        await self.send('p', 'I', enabled)
+
+    async def get_profile(self):
+        return await self.send('q')
+    
+    async def start(self):
+        await self.send('c')
+
+    async def stop(self):
+        if not self.shutdown_request:
+            await self.send('d')
+
+    async def join(self):
+        await self.send('j')
+            
+    async def shutdown(self):
+        self.shutdown_request = True
+        await self.send('0')
+
@@ -0,0 +1,326 @@
+"""
+This module provides :py:class:`ctrl.aioserver.Server`, an
+:py:mod:`asyncio` implementation of the server in
+:py:mod:`ctrl.server`.
+
+The server executes the same commands as
+:py:class:`ctrl.server.Handler`, see
+:py:func:`ctrl.server.set_controller`, and can therefore be used with
+both :py:class:`ctrl.client.Controller` and
+:py:class:`ctrl.aioclient.Controller`. Requests are parsed without
+blocking as data arrives and commands are executed in an executor, so
+that any number of clients can be connected at once.
+"""
+
+import asyncio
+import functools
+
+from . import packet
+from . import server
+import ctrl
+
+class Server:
+    """
+    :py:class:`ctrl.aioserver.Server` serves the controllers in
+    :py:data:`ctrl.server.controllers`.
+
+    Requests from each client are executed in the order they are
+    received; requests from different clients are executed
+    concurrently.
+
+    :param str host: host name or ip address (default 'localhost')
+    :param int port: port number (default 9999)
+    :param executor: a :py:class:`concurrent.futures.Executor` that executes the commands; the default executor of the event loop is used if `None` (default `None`)
+    """
+
+    def __init__(self, host = 'localhost', port = 9999, executor = None):
+
+        self.host = host
+        self.port = port
+        self.executor = executor
+        self.server = None
+        self.connections = {}
+
+    async def start(self):
+        """
+        Start listening for connections.
+        """
+        self.server = await asyncio.start_server(self.handle,
+                                                 self.host, self.port,
+                                                 reuse_address = True)
+
+    async def serve_forever(self):
+        """
+        Start listening for connections, if not listening yet, and
+        serve until :py:meth:`close` or until the command '0' is received.
+        """
+        if self.server is None:
+            await self.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # close connections that are still open
+            tasks = list(self.connections.values())
+            for connection in list(self.connections):
+                connection.writer.close()
+            await asyncio.gather(*tasks, return_exceptions = True)
+
+    def close(self):
+        """
+        Stop listening for connections.
+        """
+        if self.server is not None:
+            self.server.close()
+
+    async def call(self, function, *vargs, **kwargs):
+        """
+        Call function in the executor.
+
+        :param function: the function
+        :param vargs vargs: positional arguments
+        :param kwargs kwargs: keyword arguments
+        :return: the value returned by function
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(function,
+                                                            *vargs, **kwargs))
+
+    async def handle(self, reader, writer):
+        """
+        Handle the requests of a client.
+
+        :param reader: a :py:class:`asyncio.StreamReader`
+        :param writer: a :py:class:`asyncio.StreamWriter`
+        """
+        address = writer.get_extra_info('peername')
+        if server.verbose_level > 1:
+            print('> Connected to {}'.format(address))
+
+        connection = Connection(self, writer)
+        stream = packets(reader)
+        self.connections[connection] = asyncio.current_task()
+        try:
+            async for (type, code) in stream:
+
+                if type != 'C':
+                    await connection.write(
+                        packet.pack('S', "Command expected, '{}' received".format(type))
+                        + packet.pack('A', code))
+                    continue
+
+                if server.verbose_level > 2:
+                    print(">> Got '{}'".format(code))
+
+                # commands are executed by the selected controller
+                (controller, commands) = server.get_controller(connection.name)
+                (argument_type, output_type, function,
+                 short_help) = commands.get(code, ('', '', None, ''))
+
+                # Handle input arguments
+                vargs = []
+                kwargs = {}
+                error = None
+                for letter in argument_type:
+                    (type, arg) = await stream.__anext__()
+                    if type == 'E':
+                        # argument was refused
+                        error = arg
+                    elif type == 'K':
+                        kwargs = arg
+                    elif type == 'R':
+                        vargs.extend(arg)
+                    else:
+                        vargs.append(arg)
+
+                # shutdown?
+                if code == '0':
+                    print('> Be patient, shutting down server...')
+                    for (_controller, _commands) in server.controllers.values():
+                        _controller.set_state(ctrl.EXITING)
+                    await connection.write(packet.pack('A', code))
+                    self.close()
+                    break
+
+                # subscriptions are bound to the connection
+                if code == 'a':
+                    function = connection.subscribe
+                elif code == 'b':
+                    function = connection.unsubscribe
+                elif code == '2':
+                    function = connection.download
+                elif code == '3':
+                    function = connection.select
+                elif code == 'Z':
+                    # reset the selected controller by default
+                    kwargs.setdefault('name', connection.name)
+
+                try:
+
+                    if error is not None:
+                        raise error
+
+                    # Call function
+                    if code in ('a', 'b', '2', '3'):
+                        message = await function(*vargs, **kwargs)
+                    else:
+                        message = await self.call(function, *vargs, **kwargs)
+
+                except Exception as inst:
+
+                    # Something bad happen
+                    message = inst
+                    output_type = 'E'
+                    if server.verbose_level > 1:
+                        print('> **Exception**: ', inst)
+
+                # send reply and acknowledgment at once
+                if output_type == '':
+                    buffer = b''
+                else:
+                    buffer = server.pack_reply(output_type, message)
+                await connection.write(buffer + packet.pack('A', code))
+
+                # start publishing
+                connection.publish()
+
+        except (StopAsyncIteration, NameError, ConnectionError):
+            pass
+
+        finally:
+            if server.verbose_level > 1:
+                print('> Closed connection to {}'.format(address))
+            self.connections.pop(connection, None)
+            writer.close()
+            await connection.unsubscribe()
+
+async def packets(reader):
+    """
+    Parse packets as data is received.
+
+    :param reader: a :py:class:`asyncio.StreamReader`
+    :return: asynchronous iterator over (type, value) tuples
+    """
+    parser = packet.Parser()
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+        for value in parser.feed(data):
+            yield value
+
+class Connection:
+    """
+    State of the connection with a client of a
+    :py:class:`ctrl.aioserver.Server`.
+
+    :param ctrl.aioserver.Server server: the server
+    :param writer: a :py:class:`asyncio.StreamWriter`
+    """
+
+    def __init__(self, server, writer):
+
+        self.server = server
+        self.writer = writer
+        self.subscription = None
+        self.task = None
+        self.name = ctrl.server.DEFAULT
+
+    async def write(self, buffer):
+        self.writer.write(buffer)
+        await self.writer.drain()
+
+    async def select(self, name):
+        """
+        Select the controller, see :py:meth:`ctrl.server.Handler.select`.
+        """
+        server.get_controller(name)
+        self.name = name
+
+    async def subscribe(self, labels, decimation = 1, rate = 0, size = 1000):
+        """
+        Subscribe to signals, see :py:meth:`ctrl.server.Handler.subscribe`.
+        """
+        await self.unsubscribe()
+
+        label = '_subscription_{}_'.format(id(self))
+        publisher = server.Publisher(decimation = decimation, size = size)
+        (controller, commands) = server.get_controller(self.name)
+        await self.server.call(controller.add_sink,
+                               label, publisher, list(labels))
+        self.subscription = (controller, label, publisher, rate)
+
+    async def unsubscribe(self):
+        """
+        Cancel the subscription.
+        """
+        if self.subscription is None:
+            return
+
+        (controller, label, publisher, rate) = self.subscription
+        self.subscription = None
+        publisher.close()
+        if self.task is not None:
+            await self.task
+            self.task = None
+        await self.server.call(controller.remove_sink, label)
+
+    async def download(self, label, index = 0, rows = 4096, level = 0):
+        """
+        Download the rows written to a sink, see
+        :py:meth:`ctrl.server.Handler.download`.
+        """
+        (controller, commands) = server.get_controller(self.name)
+        chunks = server.pack_chunks(controller, label, index, rows, level)
+        while True:
+            # read and pack rows in the executor
+            buffer = await self.server.call(next, chunks, None)
+            if buffer is None:
+                break
+            await self.write(buffer)
+
+    def publish(self):
+        """
+        Start publishing frames if subscribed.
+        """
+        if self.subscription is not None and self.task is None:
+            self.task = asyncio.create_task(self.send_frames(*self.subscription))
+
+    async def send_frames(self, controller, label, publisher, rate):
+        if rate <= 0:
+            # the publisher wakes the loop up instead of blocking a
+            # thread of the executor while waiting for samples
+            loop = asyncio.get_running_loop()
+            event = asyncio.Event()
+            publisher.listener = lambda: loop.call_soon_threadsafe(event.set)
+            # samples may have been collected before
+            event.set()
+        try:
+            while not publisher.closed:
+                if rate > 0:
+                    await asyncio.sleep(1 / rate)
+                else:
+                    # wait for the next sample
+                    await event.wait()
+                    event.clear()
+                (rows, dropped) = publisher.read(0)
+                if rows:
+                    try:
+                        # wait for the client, samples are dropped meanwhile
+                        await self.write(server.pack_frame(rows, dropped))
+                    except ConnectionError:
+                        break
+        finally:
+            publisher.listener = None
+
+def run(host = 'localhost', port = 9999):
+    """
+    Run a :py:class:`ctrl.aioserver.Server` until it is closed.
+
+    :param str host: host name or ip address (default 'localhost')
+    :param int port: port number (default 9999)
+    """
+    asyncio.run(Server(host, port).serve_forever())
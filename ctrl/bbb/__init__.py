@@ -27,7 +27,7 @@ class Controller(ctrl.Controller):
         self.clock.set_period(self.period)
 
         # initialize clock signals
-        self.signals['clock'] = self.clock.time
+        self.set_signal('clock', self.clock.time)
         self.time_origin = self.clock.time_origin
 
     # period
@@ -70,6 +70,17 @@ class Block:
         """
         pass
 
+    def close(self):
+        """
+        Close :py:class:`ctrl.block.Block`.
+
+        Called when the block is removed from a
+        :py:class:`ctrl.Controller`. Does nothing here but allows
+        another :py:class:`ctrl.block.Block` to release resources,
+        such as background threads.
+        """
+        pass
+
     def set(self, exclude = (), **kwargs):
         """
         Set properties of :py:class:`ctrl.block.Block`.
@@ -618,12 +629,52 @@ class Apply(BufferBlock):
         # apply on buffer
         self.buffer = (self.function(*self.buffer), )
 
+def infer_dtypes(values):
+    """
+    Infer compact dtypes for the columns obtained by stacking values.
+
+    Booleans are stored as `bool`. Integers are stored as `int64`,
+    unless they are numpy integers of at most 32 bits, which keep
+    their dtype. Floats are stored as `float32`, unless the first
+    values do not fit in `float32`, and the first column, usually the
+    clock, is stored as `float64`.
+
+    :param vararg values: list of values
+    :return: list with the dtype of each column
+    :rtype: list
+    """
+    dtypes = []
+    for value in values:
+        value = numpy.asarray(value)
+        kind = value.dtype.kind
+        if kind == 'b':
+            dtype = numpy.bool_
+        elif kind in 'iu':
+            dtype = value.dtype.type if value.dtype.itemsize <= 4 else numpy.int64
+        elif kind == 'f' and numpy.any(numpy.abs(value[numpy.isfinite(value)])
+                                       > numpy.finfo(numpy.float32).max):
+            dtype = numpy.float64
+        else:
+            dtype = numpy.float32
+        dtypes.extend([dtype] * value.size)
+    if dtypes and dtypes[0] == numpy.float32:
+        dtypes[0] = numpy.float64
+    return dtypes
+
 class Logger(Block):
     """
     :py:class:`ctrl.block.Logger` stores signals into an array.
 
+    If :py:attr:`dtype` is a single dtype then :py:attr:`data` is a
+    2D array with that dtype. If :py:attr:`dtype` is a list with the
+    dtype of each column, or `infer` to infer the dtypes from the
+    first write, see :py:func:`ctrl.block.infer_dtypes`, then
+    :py:attr:`data` is a 1D structured array with fields `f0`, `f1`,
+    etc, one for each column.
+
     :param int number_of_rows: number of stored rows (default 12000)
     :param int number_of_columns: number of columns (default 0)
+    :param dtype: dtype of all columns, list of dtypes of each column or `infer` (default float)
     """
 
     def __init__(self,
@@ -631,6 +682,9 @@ class Logger(Block):
                  number_of_columns = 0, 
                  **kwargs):
 
+        # dtype
+        self.dtype = kwargs.pop('dtype', float)
+
         # reshape
         self.reshape(number_of_rows, number_of_columns)
 
@@ -642,7 +696,7 @@ class Logger(Block):
     def get(self, *keys, exclude = ()):
 
         # call super
-        return super().get(*keys, exclude = exclude + ('data',))
+        return super().get(*keys, exclude = exclude + ('data', 'dtype'))
 
     def set(self, exclude = (), **kwargs):
         """
@@ -652,16 +706,48 @@ class Logger(Block):
         :param int current: current index
         :param int page: current page index
         :param bool auto_reset: auto reset flag
+        :param dtype: dtype of the columns, clears the log
         :param kwargs kwargs: other keyword arguments
         :raise: `BlockException` if any of the :py:data:`kwargs` is left unprocessed
         """
 
+        if 'dtype' in kwargs:
+            self.dtype = kwargs.pop('dtype')
+            self.reshape(self.data.shape[0], self.get_number_of_columns())
+
         # call super
-        return super().set(exclude + ('data',), **kwargs)
-    
-    def reshape(self, number_of_rows, number_of_columns):
+        return super().set(exclude + ('data', 'dtype'), **kwargs)
+
+    def get_number_of_columns(self):
+        """
+        Return the number of columns of :py:attr:`data`.
 
-        self.data = numpy.zeros((number_of_rows, number_of_columns), float)
+        :return: the number of columns
+        :rtype: int
+        """
+        if self.data.dtype.names:
+            return len(self.data.dtype.names)
+        return self.data.shape[1]
+    
+    def reshape(self, number_of_rows, number_of_columns, dtypes = None):
+
+        dtype = self.dtype
+        if dtypes is None and isinstance(dtype, (list, tuple)):
+            dtypes = dtype
+
+        if dtypes is not None and number_of_columns > 0:
+            # structured array with one field per column
+            if len(dtypes) != number_of_columns:
+                raise BlockException('Number of dtypes does not match number of columns')
+            self.data = numpy.zeros((number_of_rows, ),
+                                    [('f{}'.format(k), dtype)
+                                     for (k, dtype) in enumerate(dtypes)])
+        elif isinstance(dtype, (list, tuple)) or \
+             (isinstance(dtype, str) and dtype == 'infer'):
+            # dtypes not known yet
+            self.data = numpy.zeros((number_of_rows, number_of_columns), float)
+        else:
+            self.data = numpy.zeros((number_of_rows, number_of_columns), dtype)
         self.reset()
 
     def reset(self):
@@ -679,11 +765,11 @@ class Logger(Block):
 
         # set return value
         if self.page == 0:
-            retval = self.data[:self.current,:]
+            retval = self.data[:self.current]
 
         else:
-            retval =  numpy.vstack((self.data[self.current:,:],
-                                    self.data[:self.current,:]))
+            retval =  numpy.concatenate((self.data[self.current:],
+                                         self.data[:self.current]))
 
         # reset after read?
         if self.auto_reset:
@@ -693,21 +779,64 @@ class Logger(Block):
         return retval
     
     read = get_log
+
+    def read_since(self, index):
+        """
+        Read rows written since the global row index :py:data:`index`.
+
+        Rows are returned as at most two views of :py:attr:`data`,
+        in the order they were written, without copying. Pass the
+        returned index as :py:data:`index` in the next call to read
+        only new rows. Rows that have already been overwritten are
+        reported as dropped. If :py:data:`index` is ahead of the
+        logger, for example because it has been reset, all rows are
+        returned.
+
+        :param int index: the global row index, see :py:meth:`get_current_index`
+        :return: tuple with the views, the new index and the number of dropped rows
+        :rtype: tuple
+        """
+        rows = self.data.shape[0]
+        end = self.get_current_index()
+        if index > end:
+            index = 0
+
+        # oldest row still available
+        start = max(index, end - rows)
+        dropped = start - index
+
+        (i, j) = (start % rows, end % rows) if rows else (0, 0)
+        if start == end:
+            views = ()
+        elif i < j:
+            views = (self.data[i:j], )
+        elif j == 0:
+            views = (self.data[i:], )
+        else:
+            views = (self.data[i:], self.data[:j])
+            
+        return (views, end, dropped)
         
     def write(self, *values):
 
         #print('values = {}'.format(values))
 
         # stack first
-        values = numpy.hstack(values)
+        row = numpy.hstack(values)
 
         # reshape?
-        if self.data.shape[1] != len(values):
+        if self.get_number_of_columns() != len(row):
             # reshape log
-            self.reshape(self.data.shape[0], len(values))
+            if isinstance(self.dtype, str) and self.dtype == 'infer':
+                self.reshape(self.data.shape[0], len(row), infer_dtypes(values))
+            else:
+                self.reshape(self.data.shape[0], len(row))
         
         # Log data
-        self.data[self.current, :] = values
+        if self.data.dtype.names:
+            self.data[self.current] = tuple(row)
+        else:
+            self.data[self.current, :] = row
 
         if self.current < self.data.shape[0] - 1:
             # increment current pointer
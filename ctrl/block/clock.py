@@ -148,30 +148,62 @@ class Clock(block.Block):
 
         return (success, period)
 
-from threading import Thread, Timer, Condition
+from threading import Thread, Timer, Condition, current_thread
 
 class TimerClock(Clock):
     """
     :py:class:`ctrl.block.clock.TimerClock` provides a clock that
     reads the current time periodically.
 
+    If :py:attr:`absolute` is True then a single thread sleeps until
+    the absolute deadlines :math:`t_0 + k T`, where :math:`T` is the
+    period, so that ticks do not drift. Deadlines that are missed are
+    skipped and counted in :py:attr:`missed_deadlines`. Otherwise a
+    new :py:class:`threading.Timer` is started every period.
+
+    :py:meth:`read` returns at once if a tick happened since the
+    previous read, so that a reader that overruns a period catches up
+    with the clock; ticks that were never read are also counted in
+    :py:attr:`missed_deadlines`.
+
     :param float period: period in seconds
+    :param bool absolute: if True tick at absolute deadlines (default False)
 
     """
     def __init__(self, **kwargs):
 
         self.period = kwargs.pop('period', 0.01)
+        self.absolute = kwargs.pop('absolute', False)
         
         super().__init__(**kwargs)
 
+        self.missed_deadlines = 0
+
+        # count of the last tick read, None before the first read
+        self.consumed = None
+
         self.condition = Condition()
         self.timer = None
+        self.thread = None
         self.running = False
 
         if self.enabled:
             self.enabled = False
             self.set_enabled(True)
     
+    def reset(self):
+        """
+        Reset :py:class:`ctrl.block.clock.TimerClock` by setting the
+        origin of time to the present time and the clock count and
+        missed deadlines to zero.
+        """
+
+        # call super
+        super().reset()
+
+        self.missed_deadlines = 0
+        self.consumed = None
+
     def set(self, exclude = (), **kwargs):
         """
         Set properties of :py:class:`ctrl.block.clock.TimerClock`. 
@@ -195,6 +227,8 @@ class TimerClock(Clock):
         Available attributes are those from :py:meth:`ctrl.block.clock.Clock.get` and:
 
         1. :py:attr:`period`
+        2. :py:attr:`absolute`
+        3. :py:attr:`missed_deadlines`
 
         The elapsed time since initialization or last reset can be
         obtained using the method :py:meth:`ctrl.block.clock.TimerClock.read`.
@@ -207,7 +241,8 @@ class TimerClock(Clock):
         return super().get(*keys, exclude = exclude + ('condition',
                                                        'timer',
                                                        'running',
-                                                       'thread') )
+                                                       'thread',
+                                                       'consumed') )
     
     def tick(self):
 
@@ -234,6 +269,11 @@ class TimerClock(Clock):
 
         #print('> run')
         self.running = True
+
+        if self.absolute:
+            self.run_absolute()
+            return
+        
         while self.enabled and self.running:
 
             # Acquire condition
@@ -257,6 +297,40 @@ class TimerClock(Clock):
         
         # print('> END OF RUN!')
 
+    def run_absolute(self):
+
+        period = self.period
+        t0 = perf_counter()
+        k = 0
+        
+        while self.enabled and self.running:
+
+            # period changed? restart from last deadline
+            if self.period != period:
+                t0 += k * period
+                period = self.period
+                k = 0
+
+            # sleep until next deadline
+            k += 1
+            delay = t0 + k * period - perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            elif delay < -period:
+                # skip missed deadlines
+                missed = int(-delay // period)
+                self.missed_deadlines += missed
+                k += missed
+
+            if not self.running:
+                break
+                
+            # Got a tick
+            self.tick()
+
+        self.running = False
+
     def set_enabled(self, enabled = True):
         """
         Set :py:class:`ctrl.block.clock.TimerClock` :py:attr:`enabled` state.
@@ -276,6 +350,9 @@ class TimerClock(Clock):
             # set enabled
             super().set_enabled(enabled)
 
+            # ticks before enabling are not pending
+            self.consumed = None
+
             # Start thread
             self.thread = Thread(target = self.run)
             self.thread.start()
@@ -300,6 +377,14 @@ class TimerClock(Clock):
             # and release
             self.condition.release()
 
+            # cancel pending timer
+            if self.timer is not None:
+                self.timer.cancel()
+
+            # wait for thread to finish
+            if self.thread is not None and self.thread is not current_thread():
+                self.thread.join()
+
     def read(self):
         """
         Read from :py:class:`ctrl.block.clock.TimerClock`.
@@ -312,9 +397,65 @@ class TimerClock(Clock):
 
             # Acquire condition
             self.condition.acquire()
-            # wait 
-            self.condition.wait()
+            if self.consumed is None:
+                # first read, wait for the next tick
+                count = self.count
+                self.condition.wait_for(lambda: self.count != count or
+                                        not self.enabled)
+            else:
+                # wait unless a tick is pending
+                self.condition.wait_for(lambda: self.count != self.consumed or
+                                        not self.enabled)
+                # count ticks that were never read
+                if self.count > self.consumed + 1:
+                    self.missed_deadlines += self.count - self.consumed - 1
+            self.consumed = self.count
             # and release
             self.condition.release()
         
         return (self.time - self.time_origin, )
+
+class VirtualClock(Clock):
+    """
+    :py:class:`ctrl.block.clock.VirtualClock` provides a clock that
+    advances by :py:attr:`period` every time it is read, without
+    waiting.
+
+    It is used to simulate controllers as fast as possible and with
+    reproducible results, see :py:meth:`ctrl.Controller.run_for`.
+
+    :param float period: period in seconds
+    """
+    def __init__(self, **kwargs):
+
+        self.period = kwargs.pop('period', 0.01)
+        
+        super().__init__(**kwargs)
+
+        self.time_origin = self.time = 0
+
+    def reset(self):
+        """
+        Reset :py:class:`ctrl.block.clock.VirtualClock` by setting the
+        origin of time to the present virtual time and the clock count
+        to zero.
+        """
+
+        self.time_origin = self.time
+        self.count = 0
+        
+    def read(self):
+        """
+        Read from :py:class:`ctrl.block.clock.VirtualClock`.
+
+        Time is advanced by :py:attr:`period` if the clock is enabled.
+
+        :return: tuple with elapsed virtual time since initialization or last reset
+        """
+
+        if self.enabled:
+
+            self.count += 1
+            self.time = self.time_origin + self.count * self.period
+
+        return (self.time - self.time_origin, )
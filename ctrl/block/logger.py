@@ -0,0 +1,711 @@
+"""
+This module provides loggers that extend :py:class:`ctrl.block.Logger`.
+"""
+
+import os
+import time
+import threading
+import numpy
+
+from .. import block
+
+# bytes reserved for the header of .npy files
+HEADER_SIZE = 128
+
+def check_single_dtype(kwargs):
+    """
+    Raise if the dtype in :py:data:`kwargs` is not a single dtype.
+
+    :param dict kwargs: keyword arguments of the logger
+    :raise: :py:class:`ctrl.block.BlockException` if dtype is a list or `infer`
+    """
+    dtype = kwargs.get('dtype', float)
+    if isinstance(dtype, (list, tuple)) or \
+       (isinstance(dtype, str) and dtype == 'infer'):
+        raise block.BlockException('dtype must be a single dtype')
+
+def write_npy_header(file, shape, dtype = float):
+    """
+    Write a .npy header of fixed size :py:data:`HEADER_SIZE`.
+
+    The header can be rewritten in place when the number of rows
+    changes because its size does not depend on :py:data:`shape`.
+
+    :param file: binary file open for writing
+    :param tuple shape: the shape of the array
+    :param dtype: the dtype of the array (default float)
+    """
+    header = "{{'descr': {!r}, 'fortran_order': False, 'shape': {!r}, }}".format(
+        numpy.lib.format.dtype_to_descr(numpy.dtype(dtype)), tuple(shape))
+    prefix = numpy.lib.format.magic(1, 0)
+    length = HEADER_SIZE - len(prefix) - 2
+    header = header.ljust(length - 1) + '\n'
+    file.seek(0)
+    file.write(prefix + length.to_bytes(2, 'little') + header.encode('latin1'))
+
+def create_npy(filename, shape, dtype = float):
+    """
+    Create a .npy file of :py:data:`shape` filled with zeros.
+
+    The header records no rows, see :py:func:`write_npy_header`. The
+    file is written under a temporary name and then renamed, so that
+    an existing file with the same name is replaced rather than
+    truncated under its memory maps.
+
+    :param str filename: name of the .npy file
+    :param tuple shape: the shape of the array
+    :param dtype: the dtype of the array (default float)
+    """
+    temporary = filename + '.tmp'
+    with open(temporary, 'wb') as file:
+        write_npy_header(file, (0, shape[1]), dtype)
+        file.truncate(HEADER_SIZE + numpy.dtype(dtype).itemsize * shape[0] * shape[1])
+    os.replace(temporary, filename)
+
+class MemmapLogger(block.Logger):
+    """
+    :py:class:`ctrl.block.logger.MemmapLogger` stores signals into
+    a memory-mapped .npy file.
+
+    Rows are appended to the file :py:attr:`filename`, whose capacity
+    starts at :py:attr:`number_of_rows` and doubles whenever it is
+    full by extending the file in place. If :py:attr:`max_rows` is
+    given, the file rolls over once it holds :py:attr:`max_rows` rows:
+    it is renamed to `<root>.<page>.npy` and replaced by the next
+    file, incrementing :py:attr:`page`. The next file is created in a
+    background thread ahead of time, so that rolling over only
+    renames files in the control loop.
+
+    Writing a row is a single copy into the mapped file and
+    :py:meth:`get_log` returns a view of the mapped file, without
+    copying. The header of the file is updated with the number of
+    rows written by :py:meth:`flush`, so that the file can be opened
+    with :py:func:`numpy.load`.
+
+    :param str filename: name of the .npy file
+    :param int number_of_rows: initial number of rows (default 12000)
+    :param int max_rows: maximum number of rows per file, unlimited if `None` (default `None`)
+    :param dtype: dtype of all columns (default float)
+    :param kwargs kwargs: other keyword arguments
+    :raise: :py:class:`ctrl.block.BlockException` if :py:attr:`filename` is not given
+    """
+
+    def __init__(self, **kwargs):
+
+        check_single_dtype(kwargs)
+
+        self.filename = kwargs.pop('filename', None)
+        if not isinstance(self.filename, str):
+            raise block.BlockException('filename must be given')
+
+        self.max_rows = kwargs.pop('max_rows', None)
+        if self.max_rows is not None and not isinstance(self.max_rows, int):
+            raise block.BlockException('max_rows must be int')
+
+        self.number_of_rows = kwargs.get('number_of_rows', 12000)
+        if self.max_rows is not None:
+            self.number_of_rows = min(self.number_of_rows, self.max_rows)
+            kwargs['number_of_rows'] = self.number_of_rows
+
+        self.spare = None
+
+        super().__init__(**kwargs)
+
+    def __getstate__(self):
+        # threads cannot be pickled
+        state = self.__dict__.copy()
+        state['spare'] = None
+        return state
+
+    def get(self, *keys, exclude = ()):
+
+        # call super
+        return super().get(*keys, exclude = exclude + ('spare',))
+
+    def set(self, exclude = (), **kwargs):
+        """
+        Set properties of :py:class:`ctrl.block.logger.MemmapLogger`.
+
+        :param tuple exclude: attributes to exclude
+        :param kwargs kwargs: other keyword arguments
+        :raise: `BlockException` if any of the :py:data:`kwargs` is left unprocessed
+        """
+
+        # call super
+        return super().set(exclude + ('spare',), **kwargs)
+
+    def get_segment(self, page):
+        """
+        Return the name of the file holding the rows of a rolled over page.
+
+        :param int page: the page
+        :return: the file name
+        :rtype: str
+        """
+        root = self.filename[:-4] if self.filename.endswith('.npy') else self.filename
+        return '{}.{}.npy'.format(root, page)
+
+    def reshape(self, number_of_rows, number_of_columns):
+
+        if number_of_rows * number_of_columns == 0:
+            # nothing to map yet
+            self.data = numpy.zeros((number_of_rows, number_of_columns), self.dtype)
+
+        else:
+            create_npy(self.filename, (number_of_rows, number_of_columns), self.dtype)
+            self.data = numpy.memmap(self.filename, dtype = self.dtype, mode = 'r+',
+                                     offset = HEADER_SIZE,
+                                     shape = (number_of_rows, number_of_columns))
+            if self.max_rows is not None:
+                self.prepare(number_of_columns)
+
+        self.reset()
+
+    def prepare(self, number_of_columns):
+        """
+        Create the next file in a background thread.
+
+        The next file is named `<root>.next.npy` and has room for
+        :py:attr:`max_rows` rows.
+
+        :param int number_of_columns: the number of columns
+        """
+        # wait for the file being created with the previous shape
+        if self.spare is not None:
+            self.spare.join()
+        self.spare = threading.Thread(target = create_npy,
+                                      args = (self.get_segment('next'),
+                                              (self.max_rows, number_of_columns),
+                                              self.dtype),
+                                      daemon = True)
+        self.spare.start()
+
+    def get_current_index(self):
+        return self.page * (self.max_rows or 0) + self.current
+
+    def flush(self):
+        """
+        Flush the mapped file and update its header with the number of rows written.
+        """
+        if isinstance(self.data, numpy.memmap):
+            self.data.flush()
+            with open(self.filename, 'r+b') as file:
+                write_npy_header(file, (self.current, self.data.shape[1]), self.dtype)
+
+    def get_log(self):
+
+        retval = self.data[:self.current,:]
+
+        # reset after read?
+        if self.auto_reset:
+            self.reset()
+
+        # return values
+        return retval
+
+    read = get_log
+
+    def read_since(self, index):
+        """
+        Read rows written since the global row index :py:data:`index`.
+
+        Rows in files that have rolled over are read from these
+        files, one view for each file; rows in files that no longer
+        exist are reported as dropped. See
+        :py:meth:`ctrl.block.Logger.read_since`.
+
+        :param int index: the global row index, see :py:meth:`get_current_index`
+        :return: tuple with the views, the new index and the number of dropped rows
+        :rtype: tuple
+        """
+        end = self.get_current_index()
+        if index > end:
+            index = 0
+
+        # first row of the current file
+        first = end - self.current
+        views = ()
+        dropped = 0
+
+        # rows in files that have rolled over
+        while index < first:
+            (page, offset) = divmod(index, self.max_rows)
+            try:
+                log = numpy.load(self.get_segment(page), mmap_mode = 'r')
+            except OSError:
+                dropped += self.max_rows - offset
+            else:
+                views += (log[offset:], )
+            index += self.max_rows - offset
+
+        if index < end:
+            views += (self.data[index-first:self.current,:], )
+
+        return (views, end, dropped)
+
+    def grow(self):
+
+        (rows, columns) = self.data.shape
+
+        if self.max_rows is None or rows < self.max_rows:
+            # double capacity
+            rows = 2 * rows
+            if self.max_rows is not None:
+                rows = min(rows, self.max_rows)
+            # extending the file keeps existing maps valid
+            with open(self.filename, 'r+b') as file:
+                file.truncate(HEADER_SIZE + self.data.dtype.itemsize * rows * columns)
+            self.data = numpy.memmap(self.filename, dtype = self.dtype, mode = 'r+',
+                                     offset = HEADER_SIZE,
+                                     shape = (rows, columns))
+
+        else:
+            # roll over
+            with open(self.filename, 'r+b') as file:
+                write_npy_header(file, (self.current, columns), self.dtype)
+            os.replace(self.filename, self.get_segment(self.page))
+            if self.spare is None:
+                create_npy(self.get_segment('next'), (self.max_rows, columns), self.dtype)
+            else:
+                self.spare.join()
+            os.replace(self.get_segment('next'), self.filename)
+            self.data = numpy.memmap(self.filename, dtype = self.dtype, mode = 'r+',
+                                     offset = HEADER_SIZE,
+                                     shape = (self.max_rows, columns))
+            self.page += 1
+            self.current = 0
+            self.prepare(columns)
+
+    def write(self, *values):
+
+        # stack first
+        values = numpy.hstack(values)
+
+        # reshape?
+        if self.data.shape[1] != len(values):
+            # reshape log
+            self.reshape(self.number_of_rows, len(values))
+
+        # Log data
+        self.data[self.current, :] = values
+        self.current += 1
+
+        # grow or roll over
+        if self.current == self.data.shape[0]:
+            self.grow()
+
+# backpressure policies of AsyncLogger
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+
+class AsyncLogger(block.Block):
+    """
+    :py:class:`ctrl.block.logger.AsyncLogger` decouples logging from
+    the control loop.
+
+    :py:meth:`write` only copies its values into a preallocated ring
+    buffer with a single producer and a single consumer. The ring has
+    the dtype of :py:attr:`logger`, or the dtypes of its columns if
+    :py:attr:`logger` is a :py:class:`ctrl.block.Logger` with a list
+    of dtypes or `infer`, see :py:func:`ctrl.block.infer_dtypes`. A
+    background
+    thread drains the ring every :py:attr:`interval` seconds and
+    writes the rows to :py:attr:`logger`, which can be any sink block,
+    for example a :py:class:`ctrl.block.Logger` or a
+    :py:class:`ctrl.block.logger.MemmapLogger`. :py:meth:`read`
+    drains the ring before reading from :py:attr:`logger`.
+
+    When the ring is full the :py:attr:`policy` decides what happens:
+
+    1. `drop-oldest`: the oldest rows are overwritten;
+    2. `drop-newest`: the new row is discarded;
+    3. `block`: :py:meth:`write` waits for the ring to be drained.
+
+    Dropped rows are counted in :py:attr:`dropped` and writes that
+    had to wait in :py:attr:`blocked`.
+
+    :param logger: the block rows are written to (default :py:class:`ctrl.block.Logger`)
+    :param int ring_size: number of rows in the ring (default 1024)
+    :param str policy: `drop-oldest`, `drop-newest` or `block` (default `drop-oldest`)
+    :param float interval: interval in seconds between drains (default 0.01)
+    :param kwargs kwargs: other keyword arguments
+    :raise: :py:class:`ctrl.block.BlockException` if :py:attr:`policy` is not valid
+    """
+
+    def __init__(self, **kwargs):
+
+        self.logger = kwargs.pop('logger', None)
+        if self.logger is None:
+            self.logger = block.Logger()
+
+        self.ring_size = kwargs.pop('ring_size', 1024)
+        if not isinstance(self.ring_size, int) or self.ring_size <= 0:
+            raise block.BlockException('ring_size must be positive int')
+
+        self.policy = kwargs.pop('policy', DROP_OLDEST)
+        if self.policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise block.BlockException("Unknown policy '{}'".format(self.policy))
+
+        self.interval = kwargs.pop('interval', 0.01)
+
+        super().__init__(**kwargs)
+
+        self.__setstate__(self.__dict__)
+
+    def __getstate__(self):
+        # locks and threads cannot be pickled
+        state = self.__dict__.copy()
+        for key in ('ring', 'lock', 'condition', 'thread'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.ring = None
+        self.lock = threading.RLock()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.number_of_values = 0
+        self.scalar = True
+        self.structured = False
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+        self.blocked = 0
+
+    def get(self, *keys, exclude = ()):
+
+        # call super
+        return super().get(*keys, exclude = exclude + ('ring', 'lock', 'condition', 'thread'))
+
+    def set(self, exclude = (), **kwargs):
+        """
+        Set properties of :py:class:`ctrl.block.logger.AsyncLogger`.
+
+        :param tuple exclude: attributes to exclude
+        :param kwargs kwargs: other keyword arguments
+        :raise: `BlockException` if any of the :py:data:`kwargs` is left unprocessed
+        """
+
+        # call super
+        return super().set(exclude + ('ring', 'lock', 'condition', 'thread'), **kwargs)
+
+    def reset(self):
+
+        with self.lock:
+            self.tail = self.head
+            self.dropped = 0
+            self.blocked = 0
+            self.logger.reset()
+
+    def allocate(self, values):
+
+        row = numpy.hstack(values)
+
+        # dtype of the logger
+        dtype = getattr(self.logger, 'dtype', float)
+        if isinstance(dtype, str) and dtype == 'infer':
+            dtype = block.infer_dtypes(values)
+
+        with self.lock:
+            # drain rows with the previous shape
+            self.drain()
+            if isinstance(dtype, (list, tuple)) and len(dtype) == len(row):
+                # one field for each column
+                self.ring = numpy.zeros(self.ring_size,
+                                        [('f{}'.format(k), column)
+                                         for (k, column) in enumerate(dtype)])
+            elif isinstance(dtype, (list, tuple)):
+                # the logger raises on write
+                self.ring = numpy.zeros((self.ring_size, len(row)), float)
+            else:
+                self.ring = numpy.zeros((self.ring_size, len(row)), dtype)
+            self.number_of_values = len(values)
+            self.scalar = len(row) == len(values)
+            self.structured = self.ring.dtype.names is not None
+            self.head = self.tail = 0
+
+        # start consumer
+        if self.thread is None:
+            self.thread = threading.Thread(target = self.run, daemon = True)
+            self.thread.start()
+
+    def run(self):
+
+        while self.thread is threading.current_thread():
+            time.sleep(self.interval)
+            self.drain()
+
+    def drain(self):
+        """
+        Write all rows in the ring to :py:attr:`logger`.
+
+        :return: the number of rows written
+        :rtype: int
+        """
+        with self.lock:
+
+            ring = self.ring
+            if ring is None:
+                return 0
+            size = self.ring_size
+
+            head = self.head
+            tail = self.tail
+            if head - tail > size:
+                # oldest rows have been overwritten
+                self.dropped += head - size - tail
+                tail = head - size
+            if head == tail:
+                return 0
+
+            (i, j) = (tail % size, head % size)
+            if i < j:
+                rows = ring[i:j].copy()
+            else:
+                rows = numpy.concatenate((ring[i:], ring[:j]))
+
+            if self.policy == DROP_OLDEST:
+                # discard rows that may have been overwritten while copying
+                lost = self.head + 1 - size - tail
+                if lost > 0:
+                    self.dropped += lost
+                    rows = rows[lost:]
+
+            self.tail = head
+
+            if self.policy == BLOCK:
+                with self.condition:
+                    self.condition.notify()
+
+            if self.structured:
+                for row in rows:
+                    self.logger.write(*row.item())
+            else:
+                for row in rows:
+                    self.logger.write(row)
+
+            return len(rows)
+
+    def close(self):
+        """
+        Stop the background thread, drain the ring and close :py:attr:`logger`.
+
+        The background thread is started again by the next :py:meth:`write`.
+        """
+        thread = self.thread
+        self.thread = None
+        if thread is not None:
+            thread.join()
+        self.drain()
+        # allocate the ring and start the thread on the next write
+        self.number_of_values = 0
+        self.logger.close()
+
+    def get_log(self):
+
+        self.drain()
+        return self.logger.read()
+
+    read = get_log
+
+    def write(self, *values):
+        """
+        Copy values into the ring.
+
+        :param vararg values: list of values
+        """
+
+        # allocate ring?
+        if len(values) != self.number_of_values:
+            self.allocate(values)
+
+        size = self.ring_size
+        head = self.head
+        if head - self.tail >= size:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return
+            elif self.policy == BLOCK:
+                self.blocked += 1
+                with self.condition:
+                    while self.head - self.tail >= size:
+                        self.condition.wait(self.interval)
+
+        if self.scalar:
+            self.ring[head % size] = values
+        elif self.structured:
+            self.ring[head % size] = tuple(numpy.hstack(values))
+        else:
+            self.ring[head % size] = numpy.hstack(values)
+        self.head = head + 1
+
+class MultiResolutionLogger(block.Logger):
+    """
+    :py:class:`ctrl.block.logger.MultiResolutionLogger` stores
+    signals at full rate and at decimated rates.
+
+    Besides the full rate ring of :py:class:`ctrl.block.Logger`, one
+    tier is kept for each decimation factor in :py:attr:`factors`.
+    Each row of a tier summarizes a bucket of consecutive rows by
+    their mean, minimum and maximum. Buckets are accumulated
+    incrementally, so that each write costs O(1), and coarser tiers
+    are accumulated from the buckets of finer tiers.
+
+    Tiers are selected by time with :py:meth:`read_range`. The first
+    column is assumed to be the time, as when `clock` is the first
+    logged signal.
+
+    :param tuple factors: increasing decimation factors, each dividing the next (default (10, 100))
+    :param int number_of_buckets: number of rows of each tier (default :py:attr:`number_of_rows`)
+    :param dtype: dtype of all columns of the full rate log (default float)
+    :param kwargs kwargs: other keyword arguments
+    :raise: :py:class:`ctrl.block.BlockException` if :py:attr:`factors` is not valid
+    """
+
+    def __init__(self, **kwargs):
+
+        check_single_dtype(kwargs)
+
+        self.factors = tuple(kwargs.pop('factors', (10, 100)))
+        previous = 1
+        for factor in self.factors:
+            if not isinstance(factor, int) or factor <= previous or factor % previous:
+                raise block.BlockException('factors must be increasing int, each dividing the next')
+            previous = factor
+
+        self.number_of_buckets = kwargs.pop('number_of_buckets',
+                                            kwargs.get('number_of_rows', 12000))
+
+        super().__init__(**kwargs)
+
+    def get(self, *keys, exclude = ()):
+
+        # call super
+        return super().get(*keys, exclude = exclude + ('tiers', 'buckets'))
+
+    def set(self, exclude = (), **kwargs):
+        """
+        Set properties of :py:class:`ctrl.block.logger.MultiResolutionLogger`.
+
+        :param tuple exclude: attributes to exclude
+        :param kwargs kwargs: other keyword arguments
+        :raise: `BlockException` if any of the :py:data:`kwargs` is left unprocessed
+        """
+
+        # call super
+        return super().set(exclude + ('tiers', 'buckets'), **kwargs)
+
+    def reshape(self, number_of_rows, number_of_columns):
+
+        # tiers store mean, min and max
+        self.tiers = [block.Logger(number_of_rows = self.number_of_buckets,
+                                   number_of_columns = 3 * number_of_columns)
+                      for factor in self.factors]
+
+        # buckets being accumulated: count, sum, min and max
+        self.buckets = [[0, numpy.zeros((3, number_of_columns), float)]
+                        for factor in self.factors]
+
+        super().reshape(number_of_rows, number_of_columns)
+
+    def reset(self):
+
+        super().reset()
+
+        for tier in self.tiers:
+            tier.reset()
+        for bucket in self.buckets:
+            self.clear(bucket)
+
+    def clear(self, bucket):
+
+        bucket[0] = 0
+        bucket[1][0] = 0
+        bucket[1][1] = numpy.inf
+        bucket[1][2] = -numpy.inf
+
+    def accumulate(self, level, count, total, low, high):
+
+        bucket = self.buckets[level]
+        (_, stats) = bucket
+        bucket[0] += count
+        stats[0] += total
+        numpy.minimum(stats[1], low, out = stats[1])
+        numpy.maximum(stats[2], high, out = stats[2])
+
+        # close bucket?
+        if bucket[0] == self.factors[level]:
+            self.tiers[level].write(stats[0] / bucket[0], stats[1], stats[2])
+            if level + 1 < len(self.factors):
+                self.accumulate(level + 1, bucket[0], stats[0], stats[1], stats[2])
+            self.clear(bucket)
+
+    def get_tier(self, level):
+        """
+        Return the rows of a tier in the order they were written.
+
+        Level 0 is the full rate log and level `k > 0` is the tier
+        decimated by `factors[k-1]`.
+
+        :param int level: the tier level
+        :return: tuple with the mean, minimum and maximum of each row
+        :rtype: tuple
+        """
+        tier = self.tiers[level - 1] if level else self
+        if tier.page == 0:
+            log = tier.data[:tier.current,:]
+        else:
+            log = numpy.vstack((tier.data[tier.current:,:],
+                                tier.data[:tier.current,:]))
+        if level == 0:
+            return (log, log, log)
+
+        columns = self.data.shape[1]
+        return (log[:,:columns], log[:,columns:2*columns], log[:,2*columns:])
+
+    def read_range(self, start = None, end = None, points = None):
+        """
+        Read rows with time between :py:data:`start` and :py:data:`end`.
+
+        Rows are read from the finest tier that still holds
+        :py:data:`start` and has at most :py:data:`points` rows in the
+        range, or from the coarsest tier.
+
+        :param float start: the start time, from the beginning if `None` (default `None`)
+        :param float end: the end time, to the end if `None` (default `None`)
+        :param int points: the maximum number of rows, unlimited if `None` (default `None`)
+        :return: tuple with the level, and the mean, minimum and maximum of each row
+        :rtype: tuple
+        """
+        levels = len(self.factors) + 1
+        for level in range(levels):
+
+            (mean, low, high) = self.get_tier(level)
+
+            # holds start?
+            tier = self.tiers[level - 1] if level else self
+            complete = tier.get_current_index() <= tier.data.shape[0]
+            if not complete and level < levels - 1:
+                if start is None or not len(low) or low[0,0] > start:
+                    continue
+
+            mask = numpy.ones(len(mean), bool)
+            if start is not None:
+                mask &= high[:,0] >= start
+            if end is not None:
+                mask &= low[:,0] <= end
+
+            if points is None or numpy.count_nonzero(mask) <= points or level == levels - 1:
+                return (level, mean[mask], low[mask], high[mask])
+
+    def write(self, *values):
+
+        # call super
+        super().write(*values)
+
+        # accumulate last row
+        row = self.data[self.current - 1]
+        if self.factors:
+            self.accumulate(0, 1, row, row, row)
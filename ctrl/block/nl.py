@@ -141,6 +141,9 @@ class DeadZone(block.BufferBlock):
 
     When :math:`X = 0` then :math:`c` is :py:data:`NaN`.
 
+    `X` and `Y` can also be numpy arrays, in which case a batch of
+    dead-zones is applied entry-wise to inputs of the same shape.
+
     :param float X: parameter :math:`X` (default `1`)
     :param float Y: parameter :math:`Y` (default `0`)
     """
@@ -148,13 +151,13 @@ class DeadZone(block.BufferBlock):
     def __init__(self, **kwargs):
 
         Y = kwargs.pop('Y', 0)
-        if not isinstance(Y, (int, float)):
-            raise block.BlockException('Y must be int or float')
+        if not isinstance(Y, (int, float, numpy.ndarray)):
+            raise block.BlockException('Y must be int, float or numpy array')
         self.Y = Y
 
         X = kwargs.pop('X', 1)
-        if not isinstance(X, (int, float)):
-            raise block.BlockException('X must be int or float')
+        if not isinstance(X, (int, float, numpy.ndarray)):
+            raise block.BlockException('X must be int, float or numpy array')
         self.X = X
 
         super().__init__(**kwargs)
@@ -162,6 +165,18 @@ class DeadZone(block.BufferBlock):
         self._calculate_pars()
 
     def _calculate_pars(self):
+
+        if isinstance(self.X, numpy.ndarray) or isinstance(self.Y, numpy.ndarray):
+            # batch
+            (X, Y) = numpy.broadcast_arrays(numpy.asarray(self.X, dtype=float),
+                                            numpy.asarray(self.Y, dtype=float))
+            a = (100 - Y) / (100 - X)
+            b = 100 * (Y - X) / (100 - X)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                c = numpy.where(X != 0, Y / X,
+                                numpy.where(X == Y, 1, numpy.nan))
+            self._pars = (a,b,c)
+            return
       
         a = (100 - self.Y) / (100 - self.X)
         b = 100 * (self.Y - self.X) / (100 - self.X)
@@ -191,15 +206,15 @@ class DeadZone(block.BufferBlock):
         
         if 'Y' in kwargs:
             Y = kwargs.pop('Y')
-            if not isinstance(Y, (int, float)):
-                raise block.BlockException('Y must be int or float')
+            if not isinstance(Y, (int, float, numpy.ndarray)):
+                raise block.BlockException('Y must be int, float or numpy array')
             self.Y = Y
             changes = True
 
         if 'X' in kwargs:
             X = kwargs.pop('X')
-            if not isinstance(X, (int, float)):
-                raise block.BlockException('X must be int or float')
+            if not isinstance(X, (int, float, numpy.ndarray)):
+                raise block.BlockException('X must be int, float or numpy array')
             self.X = X
             changes = True
 
@@ -209,6 +224,9 @@ class DeadZone(block.BufferBlock):
         super().set(exclude + ('_pars',), **kwargs)
 
     def _deadzone(self, a, b, c, x):
+        if isinstance(x, numpy.ndarray) or isinstance(self.X, numpy.ndarray):
+            return numpy.where(x > self.X, a*x+b,
+                               numpy.where(x < -self.X, a*x-b, c*x))
         if x > self.X:
             return a*x+b
         elif x < -self.X:
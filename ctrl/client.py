@@ -1,29 +1,113 @@
 import warnings
 import socket
+import select
+import contextlib
+import numpy
 
 from . import packet
 import ctrl
 
-class WrapSocket:
+# codes of the commands that can safely be executed twice, such as
+# getting or listing, see ctrl.client.Controller.exchange
+READ_ONLY_COMMANDS = frozenset(b'ABEenFhliKoQuWgw1q34')
 
-    def __init__(self, socket):
-        self.socket = socket
+class Subscription:
+    """
+    :py:class:`ctrl.client.Subscription` receives samples of signals
+    streamed by a server, see :py:meth:`ctrl.client.Controller.subscribe`.
+
+    Frames are received on a dedicated connection, for example::
+
+        with client.subscribe(['clock', 'encoder1'], rate = 10) as subscription:
+            for (frame, dropped) in subscription:
+                (clock, encoder1) = frame[:,1:].T
+
+    :param str host: host name or ip address
+    :param int port: port number
+    :param list labels: the signal labels
+    :param int decimation: sample signals every decimation iterations (default 1)
+    :param float rate: the rate of frames in Hz, or 0 to receive a frame after each sample (default 0)
+    :param int size: the maximum number of samples held by the server (default 1000)
+    :param str name: the name of the remote controller, see :py:meth:`ctrl.client.Controller.select` (default `None`)
+    """
+
+    def __init__(self, host, port, labels,
+                 decimation = 1, rate = 0, size = 1000, name = None):
+
+        self.labels = list(labels)
+
+        self.socket = socket.create_connection((host, port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = packet.SocketReader(self.socket)
+
+        # select the remote controller first
+        if name is not None:
+            self.socket.sendall(packet.pack('C', '3') +
+                                packet.pack('S', name))
+            self.receive()
+
+        self.socket.sendall(packet.pack('C', 'a') +
+                            packet.pack('P', self.labels) +
+                            packet.pack('I', decimation) +
+                            packet.pack('D', rate) +
+                            packet.pack('I', size))
+        self.receive()
+
+    def receive(self):
+        # receive acknowledgment, raise and close if error
+        (type, value) = packet.unpack_stream(self.reader)
+        if type == 'E':
+            packet.unpack_stream(self.reader)
+            self.socket.close()
+            self.socket = None
+            raise value
+
+    def __enter__(self):
+        return self
 
-    def read(self, bufsize = 1):
-        buffer = b''
-        while bufsize:
-            temp = self.socket.recv(bufsize)
-            bufsize -= len(temp)
-            buffer += temp
-        return buffer
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __iter__(self):
+        while True:
+            yield self.read()
+
+    def read(self):
+        """
+        Wait for the next frame.
+
+        :return: tuple (frame, dropped) with a matrix whose rows are the samples, the first column being the time of the sample and the others the values of the signals, and the number of samples dropped by the server since the previous frame
+        :rtype: tuple
+        """
+        (type, frame) = packet.unpack_stream(self.reader)
+        (type, dropped) = packet.unpack_stream(self.reader)
+        return (frame, dropped)
+
+    def close(self):
+        """
+        Unsubscribe and close the connection.
+        """
+        if self.socket is None:
+            return
+        self.socket.sendall(packet.pack('C', 'b'))
+        # discard frames sent before the acknowledgment
+        while packet.unpack_stream(self.reader) != ('A', 'b'):
+            pass
+        self.socket.close()
+        self.socket = None
 
 class Controller(ctrl.Controller):
     """
     :py:class:`ctrl.client.Controller` provides a controller that can
     remotely interact with a server.
 
+    The connection to the server is opened on the first request and
+    kept open; it is reopened automatically if it is closed by the
+    server. Many requests can be pipelined using :py:meth:`batch`.
+
     :param host: host name or id address (default: 'localhost')
     :param port: port numer (default: 9999)
+    :param name: name of the remote controller, see :py:meth:`select` (default: `None`)
     """
     
     def __init__(self, **kwargs):
@@ -33,6 +117,15 @@ class Controller(ctrl.Controller):
         self.port = kwargs.pop('port', 9999)
 
         self.socket = None
+        self.reader = None
+        self.requests = None
+        self.results = None
+        self.slots = {}
+        self.generation = 0
+
+        # name of the remote controller
+        name = kwargs.pop('name', None)
+        self.name = None
         self.shutdown_request = False
 
         # parameters for remote controller initialization
@@ -53,12 +146,19 @@ class Controller(ctrl.Controller):
 
         # initialize remote controller
         if ctrl_kwargs:
+            if name is not None:
+                ctrl_kwargs['name'] = name
             self.reset(**ctrl_kwargs)
 
+        # select remote controller
+        if name is not None:
+            self.select(name)
+
     def __enter__(self):
         if self.debug > 0:
             print('> Opening socket')
-        self.open()
+        if self.socket is None:
+            self.open()
         super().__enter__()
         return self
 
@@ -73,6 +173,18 @@ class Controller(ctrl.Controller):
         if self.socket is None:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
+            # send small requests immediately
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.reader = packet.SocketReader(self.socket)
+            # slots are negotiated again on every connection
+            self.slots = {}
+            # and the remote controller selected again
+            if self.name is not None:
+                self.socket.sendall(self.pack('3', 'S', self.name))
+                (type, value) = self.receive()
+                if type == 'E':
+                    self.close()
+                    raise value
         else:
             warnings.warn("Socket already open")
 
@@ -82,36 +194,44 @@ class Controller(ctrl.Controller):
         else:
             self.socket.close()
             self.socket = None
+            self.reader = None
             
-    def send(self, command, *vargs):
-
+    def pack(self, command, *vargs):
+        """
+        Pack command and arguments as a request.
+
+        :param str command: the command code
+        :param vargs vargs: pairs of argument type and value
+        :return: the request
+        :rtype: bytes
+        """
         # Make sure vargs is in pairs
         n = len(vargs)
         assert n % 2 == 0
 
-        # Open socket if closed
-        auto_close = False
-        if self.socket is None:
-            self.open()
-            auto_close = True
-
-        # Send command to server
         if self.debug > 0:
             print("> Will request command '{}'"
                   .format(command))
-        self.socket.send(packet.pack('C', command))
+        buffer = [packet.pack('C', command)]
 
-        # Send arguments to server
         for (argtype, argvalue) in (vargs[i:i+2] for i in range(0, n, 2)):
             if self.debug > 0:
                 print("> Will send argument '{}({})'"
                       .format(argtype, argvalue))
-            self.socket.send(packet.pack(argtype, argvalue))
+            buffer.append(packet.pack(argtype, argvalue))
+
+        return b''.join(buffer)
 
-        # Wait for output
+    def receive(self):
+        """
+        Receive the reply to a request and its acknowledgment.
+
+        :return: tuple (type, value) with the reply, value is `None` if there is no reply
+        :rtype: tuple
+        """
         if self.debug > 0:
             print("> Waiting for stream...")
-        (type, value) = packet.unpack_stream(WrapSocket(self.socket))
+        (type, value) = packet.unpack_stream(self.reader)
 
         if type == 'A':
 
@@ -127,7 +247,7 @@ class Controller(ctrl.Controller):
 
             if self.debug > 0:
                 print("> Waiting for acknowledgment...")
-            (type_, value_) = packet.unpack_stream(WrapSocket(self.socket))
+            (type_, value_) = packet.unpack_stream(self.reader)
 
             if type_ == 'A':
 
@@ -138,9 +258,76 @@ class Controller(ctrl.Controller):
 
                 warnings.warn('Failed to receive acknowledgment')
 
-        # Close socket
-        if auto_close:
-            self.close()
+        return (type, value)
+
+    def is_closed_by_server(self):
+        """
+        Return `True` if the server has closed the connection.
+
+        :rtype: bool
+        """
+        try:
+            (readable, _, _) = select.select([self.socket], [], [], 0)
+            return bool(readable) and not self.socket.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+
+    def exchange(self, requests):
+        """
+        Send requests in a single write and receive their replies in
+        order.
+
+        The connection is opened if needed and kept open, and it is
+        reopened before sending if the server has closed it. If any
+        error occurs after the requests were sent, for example a lost
+        connection, a timeout or a reply that cannot be decoded, the
+        connection is closed since unread replies would otherwise be
+        taken for the replies of later requests. The server may have
+        executed the requests already, so they are sent once more on
+        a new connection only if the connection was lost and they are
+        all read-only, see :py:data:`READ_ONLY_COMMANDS`; otherwise
+        the error is raised.
+
+        :param list requests: the requests, see :py:meth:`pack`
+        :return: list of (type, value) tuples, see :py:meth:`receive`
+        :rtype: list
+        """
+        buffer = b''.join(requests)
+        if self.socket is not None and self.is_closed_by_server():
+            # nothing was sent yet, reconnect
+            self.socket.close()
+            self.socket = None
+            self.reader = None
+        for retry in (False, True):
+            if self.socket is None:
+                self.open()
+            try:
+                self.socket.sendall(buffer)
+                return [self.receive() for request in requests]
+            except BaseException as inst:
+                # unread replies would be taken for the replies of
+                # later requests, drop the connection
+                self.socket.close()
+                self.socket = None
+                self.reader = None
+                # requests may have been executed
+                if (retry or not isinstance(inst, (OSError, NameError))
+                    or not all(request[1] in READ_ONLY_COMMANDS
+                               for request in requests)):
+                    raise
+                if self.debug > 0:
+                    print('> Connection lost, reconnecting...')
+
+    def send(self, command, *vargs):
+
+        request = self.pack(command, *vargs)
+
+        # Queue request if batching
+        if self.requests is not None:
+            self.requests.append(request)
+            return None
+
+        ((type, value),) = self.exchange([request])
 
         # If error, raise exception
         if type == 'E':
@@ -148,6 +335,53 @@ class Controller(ctrl.Controller):
 
         return value
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Pipeline requests.
+
+        Requests issued inside the context are not sent immediately
+        but all together in a single write when the context exits,
+        and their replies are then collected in order, for example::
+
+            with client.batch() as replies:
+                client.set_signal('motor1', 100)
+                client.get_signal('clock')
+                client.get_signal('encoder1')
+            (_, clock, encoder1) = replies
+
+        Methods called inside the context return `None`. If the
+        context exits with an exception the queued requests are not
+        sent. Methods
+        that must look up the slots of signals first, such as
+        :py:meth:`set_signals`, send the requests queued so far
+        before the lookup, so that requests are always executed in
+        order.
+
+        :return: list that receives the reply values when the context exits, `None` for requests without a reply
+        :raise: the exception returned by the first failed request, after all replies are received
+        """
+        if self.requests is not None:
+            raise ctrl.ControllerException('Batches cannot be nested')
+
+        replies = []
+        self.requests = []
+        self.results = []
+        try:
+            yield replies
+            (requests, results) = (self.requests, self.results)
+        finally:
+            self.requests = None
+            self.results = None
+
+        if requests:
+            results.extend(self.exchange(requests))
+        if results:
+            replies.extend(value for (type, value) in results)
+            for (type, value) in results:
+                if type == 'E':
+                    raise value
+
     # Controller methods
     def help(self, value = ''):
         return self.send('A', 'S', value)
@@ -156,8 +390,30 @@ class Controller(ctrl.Controller):
         return self.send('B', 'R', options)
 
     def reset(self, **kwargs):
+        self.slots = {}
         return self.send('Z', 'K', kwargs)
 
+    def select(self, name):
+        """
+        Select the remote controller that executes the requests.
+
+        The server can host multiple named controllers; requests are
+        executed by the controller named `default` until another one
+        is selected. The selection is restored if the connection is
+        reopened. Use :py:meth:`reset` with the parameter `name` and
+        the parameters `module` or `ctrl_class` to create a named
+        controller.
+
+        :param str name: name of the controller
+        :raise: :py:class:`ctrl.ControllerException` if there is no controller named name
+        """
+        self.send('3', 'S', name)
+        self.name = name
+        self.slots = {}
+
+    def list_controllers(self):
+        return self.send('4')
+
     # signals
     def add_signal(self, label):
         self.send('C', 'S', label)
@@ -171,10 +427,80 @@ class Controller(ctrl.Controller):
     def get_signals(self, *labels):
         return self.send('e', 'R', labels)
 
+    def get_snapshot(self, *labels):
+        return self.send('n', 'R', labels)
+
+    def lookup_signal_slots(self, *labels):
+        return self.send('h', 'R', labels)
+
+    def set_slots(self, slots, values, generation = 0):
+        self.send('k', 'V', numpy.asarray(slots, dtype = numpy.int32),
+                  'V', numpy.asarray(values, dtype = float),
+                  'I', generation)
+
+    def get_slots(self, slots, generation = 0):
+        return self.send('l', 'V', numpy.asarray(slots, dtype = numpy.int32),
+                         'I', generation)
+
+    def lookup_slots(self, labels):
+        """
+        Return the slots of signals, negotiating the slots that are
+        not known yet with the server.
+
+        Slots are kept with their generation, see
+        :py:meth:`ctrl.Controller.lookup_signal_slots`, so that later
+        requests carry only slot indices and values. The server
+        rejects requests with stale slots, for example after another
+        client resets the controller or removes a signal;
+        :py:meth:`set_signals` and :py:meth:`get_signals_array` then
+        negotiate the slots again.
+
+        :param labels: the signal labels
+        :return: the signal slots
+        :rtype: numpy.ndarray
+        """
+        if any(label not in self.slots for label in labels):
+            if self.requests:
+                # send the requests queued before, in order
+                self.results.extend(self.exchange(self.requests))
+                self.requests = []
+            # negotiate now, even when batching
+            ((type, value),) = self.exchange([self.pack('h', 'R', labels)])
+            if type == 'E':
+                raise value
+            (generation, slots) = value
+            if generation != self.generation:
+                # slots negotiated before are stale
+                self.slots = {}
+                self.generation = generation
+            self.slots.update(zip(labels, slots))
+        return numpy.array([self.slots[label] for label in labels],
+                           dtype = numpy.int32)
+
+    def set_signals(self, mapping):
+        (labels, values) = (list(mapping.keys()), list(mapping.values()))
+        slots = self.lookup_slots(labels)
+        try:
+            self.set_slots(slots, values, self.generation)
+        except ctrl.ControllerException:
+            # negotiate stale slots again
+            self.slots = {}
+            self.set_slots(self.lookup_slots(labels), values, self.generation)
+
+    def get_signals_array(self, *labels):
+        slots = self.lookup_slots(labels)
+        try:
+            return self.get_slots(slots, self.generation)
+        except ctrl.ControllerException:
+            # negotiate stale slots again
+            self.slots = {}
+            return self.get_slots(self.lookup_slots(labels), self.generation)
+
     def list_signals(self):
         return self.send('F')
 
     def remove_signal(self, label):
+        self.slots.pop(label, None)
         self.send('G', 'S', label)
 
     # sources
@@ -219,9 +545,82 @@ class Controller(ctrl.Controller):
     def write_sink(self, label, *values):
         self.send('R', 'S', label, 'R', values)
 
+    def download_sink(self, label, index = 0, rows = 4096, level = 0):
+        """
+        Download the rows written to a sink since a global row index
+        in chunks, see :py:meth:`ctrl.Controller.read_sink_since`.
+
+        Chunks are streamed by the server and read one at a time. If
+        the connection is lost, the download is resumed from the
+        first row not yet received, so that a log can be downloaded
+        in full by concatenating the chunks::
+
+            log = numpy.concatenate([chunk for (index, chunk, dropped)
+                                     in client.download_sink('logger')])
+
+        A download that was interrupted otherwise can be resumed by
+        passing the index of the next row as :py:data:`index`.
+
+        :param str label: the sink label
+        :param int index: the global row index of the first row (default 0)
+        :param int rows: the maximum number of rows in a chunk (default 4096)
+        :param int level: the :py:mod:`zlib` compression level of the chunks, or 0 not to compress (default 0)
+        :return: iterator over tuples (index, chunk, dropped) with the global row index of the first row of the chunk, the rows and the number of rows overwritten before they could be read
+        :raise: :py:class:`ctrl.ControllerException` if called in a batch
+        """
+        if self.requests is not None:
+            raise ctrl.ControllerException('Downloads cannot be batched')
+
+        retry = True
+        while True:
+
+            error = None
+            complete = False
+            try:
+                if self.socket is None:
+                    self.open()
+                self.socket.sendall(self.pack('2', 'S', label, 'I', index,
+                                              'I', rows, 'I', level))
+                while True:
+                    (type, value) = packet.unpack_stream(self.reader)
+                    if type == 'A':
+                        complete = True
+                        break
+                    if type == 'E':
+                        error = value
+                        continue
+                    (start, dropped, data) = value
+                    chunk = packet.unpack_rows(data)
+                    index = start + len(chunk)
+                    retry = True
+                    yield (start, chunk, dropped)
+
+            except (OSError, NameError):
+                # connection was lost, resume once
+                if not retry:
+                    raise
+                retry = False
+                if self.debug > 0:
+                    print('> Connection lost, resuming download...')
+                continue
+
+            finally:
+                if not complete and self.socket is not None:
+                    # chunks left unread
+                    self.socket.close()
+                    self.socket = None
+                    self.reader = None
+
+            if error is not None:
+                raise error
+            return
+
     def read_sink(self, label):
         return self.send('S', 'S', label)
 
+    def read_sink_since(self, label, index):
+        return self.send('s', 'S', label, 'I', index)
+
 
     # filters
     def add_filter(self, label, filter_, 
@@ -249,6 +648,20 @@ class Controller(ctrl.Controller):
     def read_filter(self, label):
         return self.send('Y', 'S', label)
 
+    # schedule
+    def schedule(self, commands, iteration = None, time = None):
+        self.send('m', 'P', commands,
+                  'K', {'iteration': iteration, 'time': time})
+
+    def load_schedule(self, entries, time = False, clear = False):
+        self.send('r', 'P', entries, 'K', {'time': time, 'clear': clear})
+
+    def clear_schedule(self):
+        self.send('r', 'P', [], 'K', {'clear': True})
+
+    def list_schedule(self):
+        return self.send('1')
+
     # devices
     def add_device(self, label, device_module, device_class, **kwargs):
         self.send('z',
@@ -281,6 +694,28 @@ class Controller(ctrl.Controller):
     def read_timer(self, label):
         return self.send('y', 'S', label)
     
+    # subscriptions
+    def subscribe(self, labels, decimation = 1, rate = 0, size = 1000):
+        """
+        Subscribe to signals streamed by the server.
+
+        :param list labels: the signal labels
+        :param int decimation: sample signals every decimation iterations (default 1)
+        :param float rate: the rate of frames in Hz, or 0 to receive a frame after each sample (default 0)
+        :param int size: the maximum number of samples held by the server (default 1000)
+        :return: the subscription
+        :rtype: ctrl.client.Subscription
+        """
+        return Subscription(self.host, self.port, labels,
+                            decimation, rate, size, self.name)
+
+    # profiling
+    def set_profiling(self, enabled = True):
+        self.send('p', 'I', enabled)
+
+    def get_profile(self):
+        return self.send('q')
+    
     def start(self):
         self.send('c')
 
@@ -1,9 +1,543 @@
+import sys
+import math
 import struct
+import zlib
 import numpy
 import pickle
 
 debug_level = 0
 
+# whether objects that cannot be encoded can be received pickled,
+# unpickling data from the network is unsafe and must be enabled
+allow_pickle = False
+
+# version of the packet protocol; peers must use the same version
+#
+# 1: vectors (V) of int, float32 and float64 as I, F and D, integers
+#    of any size sent as int32; matrices (M) as the number of rows
+#    followed by a vector; objects (P, E, K, R) pickled
+#
+# 2: vectors of int64, int16, int8, uint8 and bool as L, H, B, U and
+#    ?, so that int64 arrays, such as numpy arrays of int, are sent
+#    as L instead of being truncated to I; arrays that are not 2-D or
+#    have no rows sent as N, with the number of dimensions and the
+#    shape followed by a vector, and received as M; objects encoded
+#    with the schema of :py:func:`encode`, pickled only if allowed
+PROTOCOL = 2
+
+# vector element types and their little-endian dtypes
+VECTOR_TYPES = {
+    b'I': numpy.dtype('<i4'),
+    b'F': numpy.dtype('<f4'),
+    b'D': numpy.dtype('<f8'),
+    b'L': numpy.dtype('<i8'),
+    b'H': numpy.dtype('<i2'),
+    b'B': numpy.dtype('<i1'),
+    b'U': numpy.dtype('<u1'),
+    b'?': numpy.dtype('?'),
+}
+
+# vector element types by dtype kind and size
+vector_types = { dtype.str[1:]: vtype
+                 for (vtype, dtype) in VECTOR_TYPES.items() }
+
+def vector_type(dtype):
+    """
+    Return the vector element type used to transfer dtype.
+
+    :param dtype: the dtype of the array
+    :return: the vector element type
+    :rtype: bytes
+    :raise: `NameError` if dtype cannot be transferred as a vector
+    """
+    dtype = numpy.dtype(dtype)
+    for (vtype, vdtype) in VECTOR_TYPES.items():
+        if dtype.kind == vdtype.kind and dtype.itemsize == vdtype.itemsize:
+            return vtype
+    raise NameError("Unsupported vector type '{}'".format(dtype))
+
+def read_into(stream, buffer):
+    """
+    Read from stream until buffer is full.
+
+    Uses `stream.readinto` when available so that data is read
+    directly into buffer without intermediate copies.
+
+    :param stream: the stream
+    :param buffer: a writable buffer, e.g. a numpy array
+    :raise: `NameError` if the stream ends before buffer is full
+    """
+    view = memoryview(buffer).cast('B')
+    if not hasattr(stream, 'readinto'):
+        data = stream.read(len(view))
+        if len(data) < len(view):
+            raise NameError('read failed')
+        view[:] = data
+        return
+    while len(view):
+        n = stream.readinto(view)
+        if not n:
+            raise NameError('read failed')
+        view = view[n:]
+
+# tags and formats of encoded values, see encode
+(TAG_NONE, TAG_TRUE, TAG_FALSE, TAG_INT8, TAG_INT32, TAG_INT64, TAG_BIGINT,
+ TAG_DOUBLE, TAG_STR, TAG_BYTES, TAG_LIST, TAG_TUPLE, TAG_DICT, TAG_ARRAY,
+ TAG_RECORDS, TAG_EXCEPTION, TAG_PICKLE) = b'ztfbiqjdsylumareo'
+
+INT8 = struct.Struct('<cb')
+INT32 = struct.Struct('<ci')
+INT64 = struct.Struct('<cq')
+DOUBLE = struct.Struct('<cd')
+
+INT8_VALUE = struct.Struct('<b')
+INT32_VALUE = struct.Struct('<i')
+INT64_VALUE = struct.Struct('<q')
+DOUBLE_VALUE = struct.Struct('<d')
+LENGTH = struct.Struct('<I')
+
+def pack_length(length):
+    """
+    Pack length as uint8 if smaller than 255, otherwise as 255
+    followed by uint32.
+
+    :param int length: the length
+    :rtype: bytes
+    """
+    if length < 255:
+        return bytes((length,))
+    return b'\xff' + LENGTH.pack(length)
+
+def unpack_length(buffer, offset):
+    """
+    Unpack length packed by :py:func:`pack_length`.
+
+    :param buffer: the buffer
+    :param int offset: the offset of the length
+    :return: tuple (length, offset) with the length and the offset of the data
+    :rtype: tuple
+    """
+    length = buffer[offset]
+    if length < 255:
+        return (length, offset + 1)
+    return (LENGTH.unpack_from(buffer, offset + 1)[0], offset + 5)
+
+def encode(value, buffer = None, pickle_objects = True):
+    """
+    Encode value with a compact self-describing binary encoding.
+
+    Each value is encoded with a one-byte tag followed by its data,
+    lengths being packed by :py:func:`pack_length`:
+
+    * `z`: `None`; `t`, `f`: `True`, `False`
+    * `b`, `i`, `q`: int as int8, int32 or int64; `j`: larger int as a decimal string
+    * `d`: float as float64
+    * `s`, `y`: length followed by utf-8 str or bytes
+    * `l`, `u`: list or tuple as a count followed by the items
+    * `m`: dict with str keys as a count followed by the keys, as
+      length and utf-8 str, and the values
+    * `a`: numpy array as its vector type, the number of dimensions,
+      the shape and the data, aligned to 8 bytes
+    * `r`: numpy array of any other dtype without objects, such as a
+      structured array, as its dtype descr, shape, length and data
+    * `e`: exception as its module, class name and arguments; only
+      exceptions of builtins and :py:mod:`ctrl` are decoded as such
+    * `o`: any other object, pickled
+
+    numpy scalars are encoded as the corresponding python values.
+
+    :param value: the value
+    :param bytearray buffer: the buffer to append to; a new buffer is created if `None` (default `None`)
+    :param bool pickle_objects: whether other objects are pickled (default `True`)
+    :return: the buffer
+    :rtype: bytearray
+    :raise: `pickle.PicklingError` if value contains an object that must be pickled and pickle_objects is `False`
+    """
+    if buffer is None:
+        buffer = bytearray()
+
+    # test the most common types first
+    vtype = type(value)
+
+    if vtype is str:
+        bvalue = bytes(value, 'utf-8')
+        buffer += b's' + pack_length(len(bvalue))
+        buffer += bvalue
+
+    elif vtype is float:
+        buffer += DOUBLE.pack(b'd', value)
+
+    elif vtype is bool:
+        buffer += b't' if value else b'f'
+
+    elif vtype is int:
+        if -2**7 <= value < 2**7:
+            buffer += INT8.pack(b'b', value)
+        elif -2**31 <= value < 2**31:
+            buffer += INT32.pack(b'i', value)
+        elif -2**63 <= value < 2**63:
+            buffer += INT64.pack(b'q', value)
+        else:
+            bvalue = bytes(str(value), 'utf-8')
+            buffer += b'j' + pack_length(len(bvalue))
+            buffer += bvalue
+
+    elif value is None:
+        buffer += b'z'
+
+    elif vtype is list or vtype is tuple:
+        buffer += b'l' if vtype is list else b'u'
+        buffer += pack_length(len(value))
+        for item in value:
+            encode(item, buffer, pickle_objects)
+
+    elif vtype is dict and all(type(key) is str for key in value):
+        buffer += b'm' + pack_length(len(value))
+        for (key, item) in value.items():
+            bkey = bytes(key, 'utf-8')
+            buffer += pack_length(len(bkey))
+            buffer += bkey
+            encode(item, buffer, pickle_objects)
+
+    elif vtype is numpy.ndarray and value.dtype.str[1:] in vector_types:
+        vtype = vector_types[value.dtype.str[1:]]
+        buffer += struct.pack('<ccB%dI' % (value.ndim,),
+                              b'a', vtype, value.ndim, *value.shape)
+        # align data to 8 bytes
+        padding = -(len(buffer) + 1) % 8
+        buffer += struct.pack('<B', padding)
+        buffer += bytes(padding)
+        buffer += numpy.ascontiguousarray(value, VECTOR_TYPES[vtype]).tobytes()
+
+    elif vtype is numpy.ndarray and not value.dtype.hasobject:
+        buffer += b'r'
+        encode(numpy.lib.format.dtype_to_descr(value.dtype), buffer)
+        encode(value.shape, buffer)
+        bvalue = numpy.ascontiguousarray(value).tobytes()
+        buffer += pack_length(len(bvalue))
+        buffer += bvalue
+
+    elif isinstance(value, (numpy.bool_, numpy.integer, numpy.floating)):
+        encode(value.item(), buffer)
+
+    elif isinstance(value, bytes):
+        buffer += b'y' + pack_length(len(value))
+        buffer += value
+
+    elif isinstance(value, BaseException):
+        buffer += b'e'
+        encode(type(value).__module__, buffer)
+        encode(type(value).__qualname__, buffer)
+        encode(list(value.args), buffer, pickle_objects)
+
+    elif not pickle_objects:
+        raise pickle.PicklingError("Objects of type '{}' can only be sent pickled"
+                                   .format(vtype.__name__))
+
+    else:
+        bvalue = pickle.dumps(value)
+        buffer += b'o' + pack_length(len(bvalue))
+        buffer += bvalue
+
+    return buffer
+
+def decode(buffer, offset = 0):
+    """
+    Decode a value encoded by :py:func:`encode`.
+
+    Arrays are returned as views of buffer, which is not copied.
+
+    :param bytearray buffer: the buffer
+    :param int offset: the offset of the value in buffer (default 0)
+    :return: tuple (value, offset) with the value and the offset of the next value
+    :rtype: tuple
+    :raise: `pickle.UnpicklingError` if the value is pickled and :py:data:`allow_pickle` is `False`
+    """
+    tag = buffer[offset]
+    offset += 1
+
+    # test the most common tags first
+    if tag == TAG_STR:
+        (length, offset) = unpack_length(buffer, offset)
+        return (str(buffer[offset:offset+length], 'utf-8'), offset + length)
+
+    elif tag == TAG_DOUBLE:
+        return (DOUBLE_VALUE.unpack_from(buffer, offset)[0], offset + 8)
+
+    elif tag == TAG_INT8:
+        return (INT8_VALUE.unpack_from(buffer, offset)[0], offset + 1)
+
+    elif tag == TAG_DICT:
+        (length, offset) = unpack_length(buffer, offset)
+        value = {}
+        for k in range(length):
+            (klength, offset) = unpack_length(buffer, offset)
+            key = str(buffer[offset:offset+klength], 'utf-8')
+            (value[key], offset) = decode(buffer, offset + klength)
+        return (value, offset)
+
+    elif tag == TAG_LIST or tag == TAG_TUPLE:
+        (length, offset) = unpack_length(buffer, offset)
+        value = []
+        for k in range(length):
+            (item, offset) = decode(buffer, offset)
+            value.append(item)
+        return (value if tag == TAG_LIST else tuple(value), offset)
+
+    elif tag == TAG_TRUE:
+        return (True, offset)
+
+    elif tag == TAG_FALSE:
+        return (False, offset)
+
+    elif tag == TAG_NONE:
+        return (None, offset)
+
+    elif tag == TAG_INT32:
+        return (INT32_VALUE.unpack_from(buffer, offset)[0], offset + 4)
+
+    elif tag == TAG_INT64:
+        return (INT64_VALUE.unpack_from(buffer, offset)[0], offset + 8)
+
+    elif tag == TAG_ARRAY:
+        (vtype, ndim) = struct.unpack_from('<cB', buffer, offset)
+        offset += 2
+        shape = struct.unpack_from('<%dI' % (ndim,), buffer, offset)
+        offset += 4 * ndim
+        offset += 1 + buffer[offset]
+        if vtype not in VECTOR_TYPES:
+            raise NameError('Unknown vector type')
+        dtype = VECTOR_TYPES[vtype]
+        count = math.prod(shape)
+        value = numpy.frombuffer(buffer, dtype, count, offset).reshape(shape)
+        return (value, offset + count * dtype.itemsize)
+
+    elif tag == TAG_RECORDS:
+        (descr, offset) = decode(buffer, offset)
+        (shape, offset) = decode(buffer, offset)
+        (length, offset) = unpack_length(buffer, offset)
+        dtype = numpy.lib.format.descr_to_dtype(descr)
+        value = numpy.frombuffer(buffer, dtype, math.prod(shape), offset).reshape(shape)
+        return (value, offset + length)
+
+    elif tag in (TAG_BYTES, TAG_BIGINT, TAG_PICKLE):
+        (length, offset) = unpack_length(buffer, offset)
+        value = bytes(buffer[offset:offset+length])
+        offset += length
+        if tag == TAG_BYTES:
+            return (value, offset)
+        elif tag == TAG_BIGINT:
+            return (int(value), offset)
+        # tag == TAG_PICKLE
+        if not allow_pickle:
+            raise pickle.UnpicklingError('Pickled objects are not allowed')
+        return (pickle.loads(value), offset)
+
+    elif tag == TAG_EXCEPTION:
+        (module, offset) = decode(buffer, offset)
+        (name, offset) = decode(buffer, offset)
+        (args, offset) = decode(buffer, offset)
+        # only exceptions of builtins and ctrl are recreated, other
+        # exceptions are received as a generic exception with a message
+        cls = None
+        if module == 'builtins' or module == 'ctrl' or module.startswith('ctrl.'):
+            cls = sys.modules.get(module)
+            for attribute in name.split('.'):
+                cls = getattr(cls, attribute, None)
+        if isinstance(cls, type) and issubclass(cls, Exception):
+            try:
+                return (cls(*args), offset)
+            except Exception:
+                pass
+        message = '{}.{}: {}'.format(module, name, ', '.join(str(arg) for arg in args))
+        return (Exception(message), offset)
+
+    else:
+        raise NameError('Unknown tag')
+
+class SocketReader:
+    """
+    Buffered reader for packets received from a socket.
+
+    Data is received with `socket.recv_into` into a reusable buffer
+    and :py:meth:`read` and :py:meth:`readinto` are served from it,
+    so that reading the small fields of a packet does not cost one
+    system call per field.
+
+    :param socket: the socket
+    :param int size: the size of the buffer in bytes (default 65536)
+    """
+
+    def __init__(self, socket, size = 65536):
+        self.socket = socket
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def fill(self):
+        """
+        Receive more data from the socket.
+
+        :return: the number of bytes received, 0 if the socket was closed
+        :rtype: int
+        """
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buffer):
+            # move unread data to the beginning of the buffer
+            length = self.end - self.start
+            self.view[:length] = self.view[self.start:self.end]
+            (self.start, self.end) = (0, length)
+        n = self.socket.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def read(self, size = 1):
+        """
+        Read up to size bytes; fewer bytes are returned only if the
+        socket was closed.
+
+        :param int size: the number of bytes
+        :return: the data
+        :rtype: bytes
+        """
+        if size > len(self.buffer):
+            # too large for the buffer
+            data = bytearray(size)
+            view = memoryview(data)
+            while len(view):
+                n = self.readinto(view)
+                if not n:
+                    break
+                view = view[n:]
+            return bytes(data[:size - len(view)])
+        while self.end - self.start < size:
+            if self.start + size > len(self.buffer):
+                # make room at the end of the buffer
+                length = self.end - self.start
+                self.view[:length] = self.view[self.start:self.end]
+                (self.start, self.end) = (0, length)
+            if not self.fill():
+                size = self.end - self.start
+                break
+        data = bytes(self.view[self.start:self.start + size])
+        self.start += size
+        return data
+
+    def readinto(self, buffer):
+        """
+        Read up to len(buffer) bytes into buffer.
+
+        :param buffer: a writable buffer
+        :return: the number of bytes read, 0 if the socket was closed
+        :rtype: int
+        """
+        view = memoryview(buffer).cast('B')
+        if self.start == self.end:
+            if len(view) >= len(self.buffer):
+                # bypass the buffer
+                return self.socket.recv_into(view)
+            if not self.fill():
+                return 0
+        n = min(len(view), self.end - self.start)
+        view[:n] = self.view[self.start:self.start + n]
+        self.start += n
+        return n
+
+    def close(self):
+        """
+        Discard buffered data; the socket is not closed.
+        """
+        self.start = self.end = 0
+
+class IncompleteFrame(Exception):
+    """
+    Raised by :py:class:`ctrl.packet.Parser` when a frame is not
+    complete.
+    """
+    pass
+
+class BufferReader:
+    """
+    Reader over a buffer that raises
+    :py:class:`ctrl.packet.IncompleteFrame` instead of returning
+    fewer bytes than requested.
+
+    :param buffer: the buffer
+    """
+
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+        self.required = 0
+
+    def read(self, size = 1):
+        if self.position + size > len(self.view):
+            self.required = self.position + size
+            raise IncompleteFrame()
+        data = bytes(self.view[self.position:self.position + size])
+        self.position += size
+        return data
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        if self.position + len(view) > len(self.view):
+            self.required = self.position + len(view)
+            raise IncompleteFrame()
+        view[:] = self.view[self.position:self.position + len(view)]
+        self.position += len(view)
+        return len(view)
+
+class Parser:
+    """
+    Parser for packets received in chunks of arbitrary sizes.
+
+    Chunks are passed to :py:meth:`feed`, which returns the packets
+    completed so far, for example::
+
+        parser = Parser()
+        for chunk in chunks:
+            for (type, value) in parser.feed(chunk):
+                ...
+
+    Packets with objects that are refused because
+    :py:data:`allow_pickle` is `False` are returned as exceptions
+    ('E'). Incomplete packets are kept until the remaining data is fed and
+    are not parsed again before enough data is available to complete
+    the field that was missing.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.required = 0
+
+    def feed(self, data):
+        """
+        Append data and return the completed packets.
+
+        :param data: the received data
+        :return: list of (type, value) tuples
+        :rtype: list
+        """
+        self.buffer += data
+        if len(self.buffer) < self.required:
+            return []
+        packets = []
+        reader = BufferReader(self.buffer)
+        position = 0
+        self.required = 0
+        try:
+            while position < len(self.buffer):
+                packets.append(unpack_stream(reader))
+                position = reader.position
+        except IncompleteFrame:
+            self.required = reader.required - position
+        # view must be released before the buffer is resized
+        reader.view.release()
+        del self.buffer[:position]
+        return packets
+
 def unpack_stream(stream):
 
     if debug_level > 0:
@@ -59,24 +593,10 @@ def unpack_stream(stream):
         # Read data (blen*)
         if debug_level > 0:
             print("> packet::vector: '{}[{}]'".format(vtype, vlen))
-        if vtype == b'I':
-            vector = numpy.zeros(vlen, int)
-            buffer = stream.read(4 * vlen)
-            for k in range(vlen):
-                (vector[k],) = struct.unpack('<i', buffer[k*4:(k+1)*4])
-        elif vtype == b'F':
-            vector = numpy.zeros(vlen, float)
-            buffer = stream.read(4 * vlen)
-            for k in range(vlen):
-                (vector[k],) = struct.unpack('<f', buffer[k*4:(k+1)*4])
-        elif vtype == b'D':
-            vector = numpy.zeros(vlen, float)
-            buffer = stream.read(8 * vlen)
-            for k in range(vlen):
-                (vector[k],) = struct.unpack('<d', buffer[k*8:(k+1)*8])
-        else:
-            # error
-            pass
+        if vtype not in VECTOR_TYPES:
+            raise NameError('Unknown vector type')
+        vector = numpy.empty(vlen, VECTOR_TYPES[vtype])
+        read_into(stream, vector)
 
         # return vector
         return ('V', vector)
@@ -87,47 +607,83 @@ def unpack_stream(stream):
         (rsize,) = struct.unpack('<I', buffer)
         # read vector
         (vtype, vector) = unpack_stream(stream)
-        # resize vector as matrix
-        vector = numpy.resize(vector, (rsize, int(vector.size/rsize)))
+        # reshape vector as matrix
+        vector = vector.reshape((rsize, -1) if rsize else (0, 0))
         # return vector
         return ('M', vector)
 
+    elif btype == b'N':
+        # Read number of dimensions (int) and shape (ndim*int)
+        buffer = stream.read(4)
+        (ndim,) = struct.unpack('<I', buffer)
+        buffer = stream.read(4 * ndim)
+        shape = struct.unpack('<%dI' % (ndim,), buffer)
+        # read vector
+        (vtype, vector) = unpack_stream(stream)
+        # return array with shape
+        return ('M', vector.reshape(shape))
+
     elif btype == b'P' or btype == b'E' or btype == b'K' or btype == b'R':
         # Read object size (int)
         buffer = stream.read(4)
         (bsize,) = struct.unpack('<I', buffer)
         # read object
-        buffer = stream.read(bsize)
-        # unpickle
-        object = pickle.loads(buffer)
+        buffer = bytearray(bsize)
+        read_into(stream, buffer)
+        try:
+            if buffer[:1] == b'\x80':
+                # pickled by older versions
+                if not allow_pickle:
+                    raise pickle.UnpicklingError('Pickled objects are not allowed')
+                object = pickle.loads(buffer)
+            else:
+                (object, offset) = decode(buffer)
+        except pickle.UnpicklingError as inst:
+            # the packet was read entirely, return the refusal as an error
+            return ('E', inst)
         # return object
-        if btype == b'P':
-            return ('P', object)
-        elif btype == b'E':
-            return ('E', object)
-        elif btype == b'K':
-            return ('K', object)
-        else: # btype == b'R':
-            return ('R', object)
+        return (str(btype, 'utf-8'), object)
 
     else:
         raise NameError('Unknown type')
 
-def pack_vector(type, content):
-    buffer = b''
-    type = '<' + type
-    if len(content.shape) > 1:
-        # matrix
-        for k in range(content.shape[0]):
-            for value in content[k,:]:
-                buffer += struct.pack(type, value)
-    else:
-        # vector
-        for value in content:
-            buffer += struct.pack(type, value)
-    return buffer
+def pack_rows(rows, level = 0):
+    """
+    Prepare an array of rows to be packed, optionally compressed.
+
+    :param numpy.ndarray rows: the rows
+    :param int level: the :py:mod:`zlib` compression level, or 0 not to compress (default 0)
+    :return: the rows, or the tuple (descr, shape, bytes) if compressed
+    """
+    if level:
+        return (numpy.lib.format.dtype_to_descr(rows.dtype), rows.shape,
+                zlib.compress(numpy.ascontiguousarray(rows).tobytes(), level))
+    return rows
 
-def pack(type, content):
+def unpack_rows(data):
+    """
+    Recover an array of rows prepared by :py:func:`pack_rows`.
+
+    :param data: the rows, or the tuple (descr, shape, bytes) if compressed
+    :return: the rows
+    :rtype: numpy.ndarray
+    """
+    if isinstance(data, tuple):
+        (descr, shape, buffer) = data
+        dtype = numpy.lib.format.descr_to_dtype(descr)
+        return numpy.frombuffer(zlib.decompress(buffer), dtype).reshape(shape)
+    return data
+
+def pack(type, content, pickle_objects = True):
+    """
+    Pack content as a packet of type.
+
+    :param str type: the packet type
+    :param content: the content
+    :param bool pickle_objects: whether objects are pickled, see :py:func:`encode` (default `True`)
+    :return: the packet
+    :rtype: bytes
+    """
 
     # command
     if type == 'A':
@@ -161,50 +717,27 @@ def pack(type, content):
 
     #vector
     elif type == 'V':
-        vlen = content.size
-        if numpy.issubsctype(content, numpy.int):
-            return ( struct.pack('<ccI', b'V', b'I', vlen) +
-                     pack_vector('i', content) )
-        elif numpy.issubsctype(content, numpy.float32):
-            return ( struct.pack('<ccI', b'V', b'F', vlen) +
-                     pack_vector('f', content) )
-        elif numpy.issubsctype(content, numpy.float):
-            return ( struct.pack('<ccI', b'V', b'D', vlen) +
-                     pack_vector('d', content) )
-        else:
-            # error
-            pass
+        vtype = vector_type(content.dtype)
+        return ( struct.pack('<ccI', b'V', vtype, content.size) +
+                 numpy.ascontiguousarray(content,
+                                         VECTOR_TYPES[vtype]).tobytes() )
 
     #matrix
     elif type == 'M':
-        rsize = content.shape[0]
-        return ( struct.pack('<cI', b'M', rsize) +
-                 pack('V', content) )
+        if content.ndim == 2 and content.shape[0] > 0:
+            rsize = content.shape[0]
+            return ( struct.pack('<cI', b'M', rsize) +
+                     pack('V', content) )
+        else:
+            # shape cannot be recovered from the number of rows
+            return ( struct.pack('<cI%dI' % (content.ndim,),
+                                 b'N', content.ndim, *content.shape) +
+                     pack('V', content) )
 
-    # pickle
-    elif type == 'P':
-        #print('content = {}'.format(content))
-        try:
-            bmessage = pickle.dumps(content)
-        except pickle.PicklingError:
-            # try wrapping in list
-            bmessage = pickle.dumps(list(content))
-        return struct.pack('<cI', b'P', len(bmessage)) + bmessage
-
-    # pickle (Exception)
-    elif type == 'E':
-        bmessage = pickle.dumps(content)
-        return struct.pack('<cI', b'E', len(bmessage)) + bmessage
-
-    # pickle (kwargs)
-    elif type == 'K':
-        bmessage = pickle.dumps(content)
-        return struct.pack('<cI', b'K', len(bmessage)) + bmessage
-
-    # pickle (vargs)
-    elif type == 'R':
-        bmessage = pickle.dumps(content)
-        return struct.pack('<cI', b'R', len(bmessage)) + bmessage
+    # object (P), exception (E), kwargs (K) and vargs (R)
+    elif type in ('P', 'E', 'K', 'R'):
+        bmessage = encode(content, pickle_objects = pickle_objects)
+        return struct.pack('<cI', bytes(type, 'utf-8'), len(bmessage)) + bmessage
 
     else:
         raise NameError('Unknown type')
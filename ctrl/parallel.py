@@ -0,0 +1,98 @@
+"""
+This module provides the parallel execution of independent filter
+branches used by :py:class:`ctrl.Controller`.
+"""
+
+def partition(entries, inputs, outputs):
+    """
+    Partition filters into independent branches.
+
+    Two filters belong to the same branch if one reads a signal that
+    the other writes or if both write to the same signal. Filters that
+    only read the same signals are independent. The order of the
+    filters is preserved inside each branch.
+
+    :param list entries: the filters in execution order
+    :param list inputs: the input signals of each filter
+    :param list outputs: the output signals of each filter
+    :return: list of branches, each a list of entries
+    :rtype: list
+    """
+    n = len(entries)
+    parent = list(range(n))
+
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    def union(j, k):
+        parent[find(j)] = find(k)
+
+    # join writers of each signal
+    writers = { }
+    for k in range(n):
+        for s in outputs[k]:
+            if s in writers:
+                union(k, writers[s])
+            else:
+                writers[s] = k
+
+    # join readers with writers
+    for k in range(n):
+        for s in inputs[k]:
+            if s in writers:
+                union(k, writers[s])
+
+    branches = { }
+    for k in range(n):
+        branches.setdefault(find(k), []).append(entries[k])
+
+    return list(branches.values())
+
+class ParallelFilters:
+    """
+    :py:class:`ctrl.parallel.ParallelFilters` executes independent
+    branches of filters concurrently.
+
+    It behaves as a single filter in the execution plan of a
+    :py:class:`ctrl.Controller`: :py:meth:`write` runs the first branch
+    in the calling thread and all other branches on `executor`, and
+    returns only after all branches have completed. Branches only
+    benefit from parallel execution if their blocks release the GIL,
+    as NumPy does on large arrays.
+
+    :param tuple branches: tuples of `(block, input slots, output slots)`
+    :param list values: the signal values of the Controller
+    :param executor: a :py:class:`concurrent.futures.Executor`
+    """
+
+    def __init__(self, branches, values, executor):
+        self.branches = branches
+        self.values = values
+        self.executor = executor
+
+    def is_enabled(self):
+        return True
+
+    def run_branch(self, branch):
+        values = self.values
+        for (fltr, inputs, outputs) in branch:
+            if fltr.is_enabled():
+                # write signals to inputs
+                fltr.write(*[values[slot] for slot in inputs])
+                # retrieve outputs
+                for (slot, value) in zip(outputs, fltr.read()):
+                    values[slot] = value
+
+    def write(self, *values):
+        futures = [self.executor.submit(self.run_branch, branch)
+                   for branch in self.branches[1:]]
+        self.run_branch(self.branches[0])
+        # wait for all branches, raise their exceptions
+        for future in futures:
+            future.result()
+
+    def read(self):
+        return ()
@@ -0,0 +1,364 @@
+"""
+This module provides :py:class:`ctrl.process.ProcessController`, which
+hosts the loop of a :py:class:`ctrl.Controller` in a dedicated process
+so that supervisory code running in the parent process does not
+compete with the loop for the GIL.
+
+Signals are published by the loop on a :py:class:`ctrl.process.SignalBus`
+in shared memory and can be read by the parent without any
+communication with the child process.
+"""
+
+import time
+import hashlib
+import numpy
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+
+import ctrl
+from . import block
+
+class SignalBus:
+    """
+    :py:class:`ctrl.process.SignalBus` stores signal values in shared
+    memory.
+
+    Values are stored as float64 in a flat array, each signal
+    occupying :py:data:`size` consecutive entries. The single writer
+    alternates between two records, each holding a sequence number,
+    a digest of the sequence number and the data, and the data.
+    Readers copy both records and keep the most recent one whose
+    digest matches its content. No lock is taken, so readers never
+    block the writer, and since copies are checked against their
+    digest rather than relying on the order of stores to the shared
+    memory, readers on processors that reorder stores, such as ARM,
+    also see values from a single update.
+
+    Values that cannot be stored, such as the value of a signal whose
+    size changed, are stored as NaN.
+
+    :param list labels: the signal labels
+    :param list sizes: the number of entries of each signal
+    :param str name: the name of an existing bus to attach to; a new bus is created if `None` (default `None`)
+    """
+
+    def __init__(self, labels, sizes, name = None):
+
+        self.labels = tuple(labels)
+        self.sizes = tuple(int(size) for size in sizes)
+
+        offsets = numpy.cumsum((0,) + self.sizes)
+        self.slices = { label: slice(offsets[k], offsets[k+1])
+                        for (k, label) in enumerate(self.labels) }
+        self.slices_order = tuple(self.slices[label] for label in self.labels)
+
+        # two records with sequence number, digest and data
+        shape = (2, 2 + int(offsets[-1]))
+        nbytes = 8 * shape[0] * shape[1]
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create = True, size = nbytes)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name = name)
+            self.owner = False
+        self.name = self.shm.name
+
+        self.records = numpy.ndarray(shape, dtype = numpy.float64,
+                                     buffer = self.shm.buf)
+        if self.owner:
+            self.records[:] = 0
+            self.sequence = -1
+            self.write(*(numpy.zeros(size) for size in self.sizes))
+        else:
+            self.sequence = int(self.records.view(numpy.int64)[:,0].max())
+
+    def __contains__(self, label):
+        return label in self.slices
+
+    @staticmethod
+    def digest(sequence, data):
+        # digest of the sequence number and the data as an int64
+        digest = hashlib.blake2b(digest_size = 8)
+        digest.update(int(sequence).to_bytes(8, 'little', signed = True))
+        digest.update(data)
+        return int.from_bytes(digest.digest(), 'little', signed = True)
+
+    def write(self, *values):
+        """
+        Write the values of all signals, in the order of :py:attr:`labels`.
+
+        Must be called by a single writer.
+
+        :param vararg values: the signal values
+        """
+        self.sequence += 1
+        record = self.records[self.sequence % 2]
+        header = record.view(numpy.int64)
+        data = record[2:]
+        for (s, value) in zip(self.slices_order, values):
+            try:
+                data[s] = value
+            except (ValueError, TypeError):
+                data[s] = numpy.nan
+        header[0] = self.sequence
+        header[1] = self.digest(self.sequence, data)
+
+    def snapshot(self):
+        """
+        Return a consistent copy of the values of all signals.
+
+        :return: copy of the data array
+        :rtype: numpy.ndarray
+        """
+        while True:
+            records = self.records.copy()
+            headers = records.view(numpy.int64)
+            # most recent record first
+            for k in numpy.argsort(-headers[:,0]):
+                if headers[k,1] == self.digest(headers[k,0], records[k,2:]):
+                    return records[k,2:]
+            # both records were being written
+            time.sleep(0)
+
+    def get(self, *labels):
+        """
+        Get the values of signals from a single update.
+
+        Signals with one entry are returned as scalars.
+
+        :param vararg labels: the signal labels
+        :return: the signal values
+        :rtype: list
+        """
+        data = self.snapshot()
+        values = []
+        for label in labels:
+            value = data[self.slices[label]]
+            values.append(value[0] if value.size == 1 else value)
+        return values
+
+    def close(self):
+        """
+        Close the bus; it is destroyed if it was created by this instance.
+        """
+        # views must be released before the shared memory is closed
+        self.records = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class BusWriter(block.Block):
+    """
+    :py:class:`ctrl.process.BusWriter` is a sink that publishes its
+    inputs on a :py:class:`ctrl.process.SignalBus`.
+
+    :param ctrl.process.SignalBus bus: the bus
+    :param kwargs kwargs: other keyword arguments
+    """
+
+    def __init__(self, **kwargs):
+
+        self.bus = kwargs.pop('bus')
+
+        super().__init__(**kwargs)
+
+    def write(self, *values):
+        """
+        Write values to :py:attr:`bus`.
+
+        :param vararg values: list of values
+        """
+        self.bus.write(*values)
+
+def serve(connection, factory, kwargs):
+    """
+    Create a controller and execute the commands received from
+    :py:data:`connection` until the command `close` is received.
+
+    This function runs in the child process of a
+    :py:class:`ctrl.process.ProcessController`.
+
+    :param connection: a :py:class:`multiprocessing.connection.Connection`
+    :param factory: callable that returns a :py:class:`ctrl.Controller`
+    :param dict kwargs: keyword arguments passed to :py:data:`factory`
+    """
+    controller = factory(**kwargs)
+    bus = None
+
+    while True:
+
+        (method, vargs, kwargs) = connection.recv()
+
+        try:
+            result = None
+            if method == 'start':
+                # attach to bus and publish all signals at the end of each iteration
+                bus = SignalBus(*vargs)
+                controller.add_sink('_bus_', BusWriter(bus = bus), list(bus.labels))
+                controller.start()
+
+            elif method in ('stop', 'close'):
+                if bus is not None:
+                    controller.stop()
+                    controller.remove_sink('_bus_')
+                    bus.close()
+                    bus = None
+
+            else:
+                result = getattr(controller, method)(*vargs, **kwargs)
+
+            connection.send((True, result))
+
+        except Exception as e:
+            connection.send((False, e))
+
+        if method == 'close':
+            break
+
+    connection.close()
+
+class ProcessController:
+    """
+    :py:class:`ctrl.process.ProcessController` runs a
+    :py:class:`ctrl.Controller` in a child process.
+
+    Methods of the controller are proxied to the child process, for
+    example::
+
+        controller = ProcessController(ctrl.sim.Controller, period = 0.01)
+        controller.add_sink('printer', Printer(), ['clock', 'encoder1'])
+        controller.set_signal('motor1', 100)
+        controller.start()
+        (clock, encoder1) = controller.get_signals('clock', 'encoder1')
+        controller.stop()
+        controller.close()
+
+    Blocks passed to the controller and values returned by it must
+    therefore be picklable. While the loop is running,
+    :py:meth:`get_signal` and :py:meth:`get_signals` read the values
+    from a :py:class:`ctrl.process.SignalBus` published at the end of
+    each iteration, without communicating with the child process.
+    Only numeric scalar and vector signals are stored on the bus, as
+    float64, and their sizes are fixed when the loop is started; other
+    signals are read from the child process.
+
+    :param factory: callable that returns a :py:class:`ctrl.Controller` (default :py:class:`ctrl.Controller`)
+    :param str start_method: the :py:mod:`multiprocessing` start method (default `None`)
+    :param kwargs kwargs: keyword arguments passed to :py:data:`factory`
+    """
+
+    def __init__(self, factory = None, start_method = None, **kwargs):
+
+        if factory is None:
+            factory = ctrl.Controller
+
+        # share the resource tracker with the child process so that
+        # the bus is only unlinked by its owner
+        resource_tracker.ensure_running()
+
+        context = multiprocessing.get_context(start_method)
+        (self.connection, connection) = context.Pipe()
+        self.process = context.Process(target = serve,
+                                       args = (connection, factory, kwargs),
+                                       daemon = True)
+        self.process.start()
+        connection.close()
+
+        self.bus = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *vargs, **kwargs: self.call(name, *vargs, **kwargs)
+
+    def call(self, method, *vargs, **kwargs):
+        """
+        Call method of the controller in the child process.
+
+        :param str method: the method name
+        :param vargs vargs: positional arguments
+        :param kwargs kwargs: keyword arguments
+        :return: the value returned by the method
+        :raise: the exception raised by the method
+        """
+        self.connection.send((method, vargs, kwargs))
+        (success, result) = self.connection.recv()
+        if not success:
+            raise result
+        return result
+
+    def get_signal(self, label):
+        """
+        Get the value of signal.
+
+        :param str label: the signal label
+        :return: the signal value
+        """
+        if self.bus is not None and label in self.bus:
+            return self.bus.get(label)[0]
+        return self.call('get_signal', label)
+
+    def get_signals(self, *labels):
+        """
+        Get the value of signals.
+
+        If the loop is running the values are from the same iteration.
+
+        :param vargs labels: the signal labels
+        :return: the signal values
+        :rtype: list
+        """
+        if self.bus is not None and all(label in self.bus for label in labels):
+            return self.bus.get(*labels)
+        return self.call('get_signals', *labels)
+
+    def start(self):
+        """
+        Create the signal bus and start the loop in the child process.
+        """
+        if self.bus is not None:
+            self.stop()
+
+        labels = self.call('list_signals')
+        values = self.call('get_signals', *labels)
+        # only numeric scalars and vectors are published on the bus
+        signals = [(label, value) for (label, value) in zip(labels, values)
+                   if numpy.asarray(value).dtype.kind in 'biuf'
+                   and numpy.ndim(value) <= 1]
+        bus = SignalBus([label for (label, value) in signals],
+                        [numpy.size(value) for (label, value) in signals])
+        bus.write(*(value for (label, value) in signals))
+
+        try:
+            self.call('start', bus.labels, bus.sizes, bus.name)
+        except:
+            bus.close()
+            raise
+        self.bus = bus
+
+    def stop(self):
+        """
+        Stop the loop in the child process and destroy the signal bus.
+        """
+        self.call('stop')
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
+
+    def close(self):
+        """
+        Stop the loop and terminate the child process.
+        """
+        if self.process.is_alive():
+            self.call('close')
+            self.process.join()
+        self.connection.close()
+        if self.bus is not None:
+            self.bus.close()
+            self.bus = None
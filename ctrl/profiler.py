@@ -0,0 +1,214 @@
+"""
+This module provides the instrumentation used by
+:py:class:`ctrl.Controller` to profile the execution of its blocks.
+"""
+
+import math
+import numpy
+
+from time import perf_counter
+
+class Histogram:
+    """
+    :py:class:`ctrl.profiler.Histogram` accumulates durations into
+    logarithmically spaced bins.
+
+    The bins are allocated once so that :py:meth:`add` does not
+    allocate memory. Minimum, maximum, mean and an estimate of the
+    99th percentile are available from :py:meth:`stats`.
+
+    :param float low: lower edge of the first bin in seconds (default 1e-6)
+    :param int decades: number of decades covered by the bins (default 7)
+    :param int bins_per_decade: number of bins per decade (default 20)
+    """
+
+    def __init__(self, low = 1e-6, decades = 7, bins_per_decade = 20):
+
+        self.log_low = math.log10(low)
+        self.bins_per_decade = bins_per_decade
+
+        # one extra bin at each end for underflow and overflow
+        self.counts = numpy.zeros(decades * bins_per_decade + 2, int)
+
+        self.reset()
+
+    def reset(self):
+        """
+        Reset all counters.
+        """
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = 0.
+
+    def add(self, value):
+        """
+        Add value to histogram.
+
+        :param float value: the value to be added
+        """
+        if value > 0:
+            k = int((math.log10(value) - self.log_low)
+                    * self.bins_per_decade) + 1
+            if k < 0:
+                k = 0
+            elif k >= len(self.counts):
+                k = len(self.counts) - 1
+        else:
+            k = 0
+        self.counts[k] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Estimate percentile from the histogram bins.
+
+        :param float p: percentile, between 0 and 100
+        :return: upper edge of the bin containing the percentile
+        :rtype: float
+        """
+        if not self.count:
+            return 0.
+        k = int(numpy.searchsorted(numpy.cumsum(self.counts),
+                                   p / 100 * self.count))
+        edge = 10 ** (self.log_low + k / self.bins_per_decade)
+        return min(edge, self.max)
+
+    def stats(self):
+        """
+        Return statistics.
+
+        :return: dictionary with `count`, `min`, `mean`, `max` and `p99`
+        :rtype: dict
+        """
+        if not self.count:
+            return { 'count': 0, 'min': 0., 'mean': 0.,
+                     'max': 0., 'p99': 0. }
+        return { 'count': self.count,
+                 'min': self.min,
+                 'mean': self.total / self.count,
+                 'max': self.max,
+                 'p99': self.percentile(99) }
+
+class ProfiledBlock:
+    """
+    :py:class:`ctrl.profiler.ProfiledBlock` wraps a block and records
+    the duration of its calls to :py:meth:`ctrl.block.Block.read` and
+    :py:meth:`ctrl.block.Block.write`.
+
+    :param block: the block to profile
+    :param ctrl.profiler.Histogram read: histogram for read
+    :param ctrl.profiler.Histogram write: histogram for write
+    """
+
+    def __init__(self, block, read, write):
+        self.block = block
+        self.read_histogram = read
+        self.write_histogram = write
+        self.is_enabled = block.is_enabled
+
+    def read(self):
+        t0 = perf_counter()
+        values = self.block.read()
+        self.read_histogram.add(perf_counter() - t0)
+        return values
+
+    def write(self, *values):
+        t0 = perf_counter()
+        self.block.write(*values)
+        self.write_histogram.add(perf_counter() - t0)
+
+class Profiler:
+    """
+    :py:class:`ctrl.profiler.Profiler` holds the histograms of the
+    blocks of a :py:class:`ctrl.Controller` and of its loop period,
+    jitter and duty.
+
+    Histograms are identified by keys of the form `sources.label.read`,
+    `filters.label.write`, `loop.period`, etc.
+    """
+
+    def __init__(self):
+        self.histograms = { }
+        self.reset()
+
+    def reset(self):
+        """
+        Reset all histograms.
+        """
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.last_time = None
+        self.last_period = None
+
+    def histogram(self, key):
+        """
+        Get histogram, create it if it does not exist.
+
+        :param str key: the histogram key
+        :return: the histogram
+        :rtype: ctrl.profiler.Histogram
+        """
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        return self.histograms[key]
+
+    def wrap(self, kind, label, block):
+        """
+        Wrap block for profiling.
+
+        :param str kind: `sources`, `filters` or `sinks`
+        :param str label: the block label
+        :param block: the block
+        :return: the wrapped block
+        :rtype: ctrl.profiler.ProfiledBlock
+        """
+        return ProfiledBlock(block,
+                             self.histogram('{}.{}.read'.format(kind, label)),
+                             self.histogram('{}.{}.write'.format(kind, label)))
+
+    def tick(self, time, duty):
+        """
+        Record loop period, jitter and duty.
+
+        The jitter is the absolute difference between consecutive
+        periods.
+
+        :param float time: the time at the beginning of the loop
+        :param float duty: the loop duty
+        """
+        if self.last_time is not None:
+            period = time - self.last_time
+            self.histogram('loop.period').add(period)
+            if self.last_period is not None:
+                self.histogram('loop.jitter').add(abs(period - self.last_period))
+            self.last_period = period
+        self.last_time = time
+        self.histogram('loop.duty').add(duty)
+
+    def stats(self):
+        """
+        Return statistics of all histograms that have data.
+
+        :return: dictionary of statistics indexed by histogram key
+        :rtype: dict
+        """
+        return { key: histogram.stats()
+                 for (key, histogram) in self.histograms.items()
+                 if histogram.count }
+
+    def __str__(self):
+        result = '  {:<32} {:>8} {:>10} {:>10} {:>10} {:>10}\n' \
+            .format('(us)', 'count', 'min', 'mean', 'max', 'p99')
+        for (key, stats) in sorted(self.stats().items()):
+            result += '  {:<32} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}\n' \
+                .format(key, stats['count'],
+                        1e6 * stats['min'], 1e6 * stats['mean'],
+                        1e6 * stats['max'], 1e6 * stats['p99'])
+        return result
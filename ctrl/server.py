@@ -1,16 +1,25 @@
 import warnings
+import functools
 import socketserver
 import threading
 import time
 import importlib
+import collections
+import pickle
+import numpy
 
 from . import packet
+from . import block
 import ctrl
 
 verbose_level = 0
 controller = ctrl.Controller()
 commands = {}
 
+# controllers and their commands by name
+DEFAULT = 'default'
+controllers = {}
+
 def verbose(value = 1):
     """
     Set verbose level
@@ -52,9 +61,9 @@ def help(key):
                            for (k,v) in 
                            zip(commands.keys(), commands.values())])
     help_str = """
-Controller Server, version {}
+Controller Server, version {}, protocol {}
 Available commands:
-""".format(version()) + help_str
+""".format(version(), packet.PROTOCOL) + help_str
 
     return help_str
 
@@ -67,19 +76,23 @@ def log(message, func):
     return func_wrapper
 
 # reset controller
-def reset(**kwargs):
+def reset(name = DEFAULT, **kwargs):
     """
     Reset controller
 
+    If :py:data:`module` or :py:data:`ctrl_class` are given, or if
+    there is no controller named :py:data:`name`, a new controller is
+    created and installed as :py:data:`name`, replacing and stopping
+    the previous one, otherwise the controller is reset.
+
+    :param str name: name of the controller (default = 'default')
     :param str module: name of the controller module (default = 'ctrl')
     :param str ctrl_class: name of the controller class (default = 'Controller')
     :param kwargs kwargs: other key-value pairs of attributes
     """
     
-    global controller
-    
     # Create new controller
-    if 'module' in kwargs or 'ctrl_class' in kwargs:
+    if 'module' in kwargs or 'ctrl_class' in kwargs or name not in controllers:
 
         module = kwargs.pop('module', 'ctrl')
         ctrl_class = kwargs.pop('ctrl_class', 'Controller')
@@ -87,7 +100,7 @@ def reset(**kwargs):
         try:
 
             if verbose_level > 0:
-                warnings.warn("> Installing new instance of '{}.{}({})' as controller".format(module, ctrl_class, kwargs))
+                warnings.warn("> Installing new instance of '{}.{}({})' as controller '{}'".format(module, ctrl_class, kwargs, name))
                 
             obj_class = getattr(importlib.import_module(module),
                                 ctrl_class)
@@ -100,131 +113,381 @@ def reset(**kwargs):
             if not isinstance(_controller, ctrl.Controller):
                 raise Exception("Object '{}.{}' is not and instance of ctrl.Controller".format(module, ctrl_class))
 
-            controller = _controller
-            set_controller(controller)
-
         except Exception as e:
 
             raise Exception("Error resetting controller: {}".format(e))
 
+        # stop replaced controller
+        if name in controllers:
+            controllers[name][0].stop()
+        set_controller(_controller, name)
+
     else:
         
         # reset controller
-        return controller.reset()
+        return controllers[name][0].reset()
+
+def get_controller(name = DEFAULT):
+    """
+    Return a controller and its commands
+
+    :param str name: name of the controller (default = 'default')
+    :return: tuple (controller, commands)
+    :rtype: tuple
+    :raise: :py:class:`ctrl.ControllerException` if there is no controller named name
+    """
+    if name not in controllers:
+        raise ctrl.ControllerException("Controller '{}' does not exist".format(name))
+    return controllers[name]
+
+def list_controllers():
+    """
+    List the names of the controllers
+
+    :return: the controller names
+    :rtype: list
+    """
+    return list(controllers.keys())
 
-def set_controller(_controller = ctrl.Controller(noclock = True)):
+def set_controller(_controller = ctrl.Controller(noclock = True),
+                   name = DEFAULT):
     """
     Set controller commands
+
+    The controller is installed as :py:data:`name`. The default
+    controller is also available as :py:data:`controller`.
     
     :param _controller: an instance of :py:class:`ctrl.Controller`
+    :param str name: name of the controller (default = 'default')
     """
 
     # initialize controller
     global controller, commands
-    controller = _controller
         
     # TODO: Complete public controller methods
-    commands = { 
+    _commands = { 
         'A': ('S',  'S', help,
               'Help'),
 
-        'B': ('R', 'S', controller.info,
+        'B': ('R', 'S', _controller.info,
               'Controller info'),
         'Z': ('K',  '', reset,
               'Reset controller'),
 
-        'C': ('S', '', controller.add_signal,
+        'C': ('S', '', _controller.add_signal,
               'Add signal'),
-        'D': ('SD', '', controller.set_signal,
+        'D': ('SD', '', _controller.set_signal,
               'Set signal'),
-        'E': ('S', 'D', controller.get_signal,
+        'E': ('S', 'D', _controller.get_signal,
               'Get signal'),
-        'e': ('R', 'R', controller.get_signals,
+        'e': ('R', 'R', _controller.get_signals,
               'Get signal'),
-        'F': ('', 'P', controller.list_signals,
+        'n': ('R', 'R', _controller.get_snapshot,
+              'Get signals snapshot'),
+        'F': ('', 'P', _controller.list_signals,
               'List signals'),
-        'G': ('S', '', controller.remove_signal,
+        'G': ('S', '', _controller.remove_signal,
               'Remove signal'),
-
-        'H': ('SPPI', '', controller.add_source,
+        'h': ('R', 'P', _controller.lookup_signal_slots,
+              'Get signal slots'),
+        'k': ('VVI', '', _controller.set_slots,
+              'Set signals by slot'),
+        'l': ('VI', 'V', _controller.get_slots,
+              'Get signals by slot'),
+
+        'H': ('SPPI', '', _controller.add_source,
               'Add source'),
-        'I': ('SK', '', controller.set_source,
+        'I': ('SK', '', _controller.set_source,
               'Set source'),
-        'i': ('SR', 'K', controller.get_source,
+        'i': ('SR', 'K', _controller.get_source,
               'Get source'),
-        'J': ('S', '', controller.remove_source,
+        'J': ('S', '', _controller.remove_source,
               'Remove source'),
-        'K': ('', 'P', controller.list_sources,
+        'K': ('', 'P', _controller.list_sources,
               'List sources'),
-        'L': ('SP', '', controller.write_source,
+        'L': ('SP', '', _controller.write_source,
               'Write source'),
-        'M': ('S', 'P', controller.read_source,
+        'M': ('S', 'P', _controller.read_source,
               'Read source'),
 
-        'N': ('SPPI', '', controller.add_sink,
+        'N': ('SPPI', '', _controller.add_sink,
               'Add sink'),
-        'O': ('SK', '', controller.set_sink,
+        'O': ('SK', '', _controller.set_sink,
               'Set sink'),
-        'o': ('SR', 'K', controller.get_sink,
+        'o': ('SR', 'K', _controller.get_sink,
               'Get sink'),
-        'P': ('S', '', controller.remove_sink,
+        'P': ('S', '', _controller.remove_sink,
               'Remove sink'),
-        'Q': ('', 'P', controller.list_sinks,
+        'Q': ('', 'P', _controller.list_sinks,
               'List sinks'),
-        'R': ('SP', '', controller.write_sink,
+        'R': ('SP', '', _controller.write_sink,
               'Write sink'),
-        'S': ('S', 'P', controller.read_sink,
+        'S': ('S', 'P', _controller.read_sink,
               'Read sink'),
+        's': ('SI', 'P', _controller.read_sink_since,
+              'Read sink since'),
 
-        'T': ('SPPPI', '', controller.add_filter,
+        'T': ('SPPPI', '', _controller.add_filter,
               'Add filter'),
-        'U': ('SK', '', controller.set_filter,
+        'U': ('SK', '', _controller.set_filter,
               'Set filter'),
-        'u': ('SR', 'K', controller.get_filter,
+        'u': ('SR', 'K', _controller.get_filter,
               'Get filter'),
-        'V': ('S', '', controller.remove_filter,
+        'V': ('S', '', _controller.remove_filter,
               'Remove filter'),
-        'W': ('', 'P', controller.list_filters,
+        'W': ('', 'P', _controller.list_filters,
               'List filters'),
-        'X': ('SP', '', controller.write_filter,
+        'X': ('SP', '', _controller.write_filter,
               'Write filter'),
-        'Y': ('S', 'P', controller.read_filter,
+        'Y': ('S', 'P', _controller.read_filter,
               'Read filter'),
 
-        'z': ('SSSK', '', controller.add_device,
+        'z': ('SSSK', '', _controller.add_device,
               'Add device'),
 
-        't': ('SPPPDI', '', controller.add_timer,
+        't': ('SPPPDI', '', _controller.add_timer,
               'Add timer'),
-        'f': ('SK', '', controller.set_timer,
+        'f': ('SK', '', _controller.set_timer,
               'Set timer'),
-        'g': ('SR', 'K', controller.get_timer,
+        'g': ('SR', 'K', _controller.get_timer,
               'Get timer'),
-        'v': ('S', '', controller.remove_timer,
+        'v': ('S', '', _controller.remove_timer,
               'Remove timer'),
-        'w': ('', 'P', controller.list_timers,
+        'w': ('', 'P', _controller.list_timers,
               'List timers'),
-        'x': ('SP', '', controller.write_timer,
+        'x': ('SP', '', _controller.write_timer,
               'Write timer'),
-        'y': ('S', 'P', controller.read_timer,
+        'y': ('S', 'P', _controller.read_timer,
               'Read timer'),
         
-        'c': ('',  '',  log('*> Starting loop', controller.start),
+        'm': ('PK', '', _controller.schedule,
+              'Schedule commands'),
+        'r': ('PK', '', _controller.load_schedule,
+              'Load schedule'),
+        '1': ('', 'P', _controller.list_schedule,
+              'List schedule'),
+        
+        'p': ('I', '', _controller.set_profiling,
+              'Set profiling'),
+        'q': ('', 'P', _controller.get_profile,
+              'Get profile'),
+        
+        'c': ('',  '',  log('*> Starting loop', _controller.start),
               'Start control loop'),
 
-        'd': ('',  '',  log('*< Stoping loop', controller.stop),
+        'd': ('',  '',  log('*< Stoping loop', _controller.stop),
               'Stop control loop'),
 
-        'j': ('',  '',  controller.join,
+        'j': ('',  '',  _controller.join,
               'Waif for control loop'),
+
+        '4': ('', 'P', list_controllers,
+              'List controllers'),
+
+        # selection is handled by Handler
+        '3': ('S', '', None,
+              'Select controller'),
+
+        # subscriptions are handled by Handler
+        'a': ('PIDI', '', None,
+              'Subscribe to signals'),
+        'b': ('', '', None,
+              'Unsubscribe from signals'),
+
+        # downloads are handled by Handler
+        '2': ('SIII', '', None,
+              'Download sink'),
         
         # '0': ('', '', server_shutdown, 'Shutdown server')
         
     }
 
+    controllers[name] = (_controller, _commands)
+    if name == DEFAULT:
+        (controller, commands) = (_controller, _commands)
+
 # Initialize default controller
 set_controller(controller)
 
+class Publisher(block.Block):
+    """
+    :py:class:`ctrl.server.Publisher` is a sink that collects samples
+    of its inputs for a subscription.
+
+    Samples are stored as rows with the time followed by the values
+    of the inputs. At most :py:attr:`size` rows are kept; the oldest
+    rows are dropped if the rows are not read fast enough, so that
+    the loop never waits for a slow client.
+
+    Instead of waiting in :py:meth:`read`, a reader can set
+    :py:attr:`listener` to a function that is called, from the loop
+    thread, when a sample is collected while no rows are pending and
+    when the publisher is closed.
+
+    :param int decimation: keep one sample every decimation iterations (default 1)
+    :param int size: the maximum number of rows (default 1000)
+    :param kwargs kwargs: other keyword arguments
+    :raise: :py:class:`ctrl.block.BlockException` if decimation or size are not positive
+    """
+
+    def __init__(self, **kwargs):
+
+        self.decimation = kwargs.pop('decimation', 1)
+        self.size = kwargs.pop('size', 1000)
+
+        if self.decimation < 1:
+            raise block.BlockException('decimation must be positive')
+        if self.size < 1:
+            raise block.BlockException('size must be positive')
+
+        super().__init__(**kwargs)
+
+        self.rows = collections.deque(maxlen = self.size)
+        self.count = 0
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.listener = None
+
+    def write(self, *values):
+        """
+        Collect a sample of values.
+
+        :param vararg values: list of values
+        """
+        self.count += 1
+        if self.count % self.decimation:
+            return
+        with self.condition:
+            if len(self.rows) == self.size:
+                self.dropped += 1
+            pending = bool(self.rows)
+            self.rows.append((time.time(),) + values)
+            self.condition.notify()
+        if not pending and self.listener is not None:
+            self.listener()
+
+    def read(self, period = None):
+        """
+        Read the collected samples.
+
+        If :py:data:`period` is `None`, wait until a sample is
+        collected, otherwise wait for period.
+
+        :param float period: the waiting period in seconds (default `None`)
+        :return: tuple (rows, dropped) with the samples and the number of samples dropped since the last read
+        :rtype: tuple
+        """
+        with self.condition:
+            if period is None:
+                self.condition.wait_for(lambda: self.rows or self.closed)
+            else:
+                self.condition.wait_for(lambda: self.closed, period)
+            rows = list(self.rows)
+            self.rows.clear()
+            dropped = self.dropped
+            self.dropped = 0
+        return (rows, dropped)
+
+    def close(self):
+        """
+        Wake up readers waiting for samples.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.listener is not None:
+            self.listener()
+
+def pack_reply(type, content):
+    """
+    Pack the reply to a request.
+
+    Objects are only pickled if :py:data:`ctrl.packet.allow_pickle` is
+    `True`, since clients refuse them otherwise; the reply is then
+    replaced by an error.
+
+    :param str type: the packet type
+    :param content: the content
+    :return: the packet
+    :rtype: bytes
+    """
+    try:
+        return packet.pack(type, content, packet.allow_pickle)
+    except pickle.PicklingError as inst:
+        return packet.pack('E', ctrl.ControllerException(
+            '{}; start the server with --allow-pickle to send it'.format(inst)))
+
+def pack_frame(rows, dropped):
+    """
+    Pack samples collected by a :py:class:`ctrl.server.Publisher` as
+    a frame.
+
+    :param list rows: the samples
+    :param int dropped: the number of samples dropped
+    :return: the frame
+    :rtype: bytes
+    """
+    frame = numpy.array([numpy.hstack(row) for row in rows])
+    return packet.pack('M', frame) + packet.pack('I', dropped)
+
+def pack_chunks(controller, label, index = 0, rows = 4096, level = 0):
+    """
+    Pack the rows written to a sink since a global row index in
+    chunks, see :py:meth:`ctrl.Controller.read_sink_since`.
+
+    Rows are read from the sink as each chunk is packed, so that only
+    one chunk is held in memory at a time. Rows written after the
+    first chunk is packed are not included. Each chunk is copied from
+    the sink, which may be written to by the control loop, and the
+    sink is read again after copying: rows that were overwritten while
+    copying, and the row being overwritten next, are removed from the
+    chunk and counted as dropped. Each chunk is an object
+    ('P') with the tuple (index, dropped, data), where index is the
+    global row index of the first row, dropped is the number of rows
+    overwritten before they could be read and data is the array of
+    rows or, if compressed, the tuple (descr, shape, bytes), see
+    :py:func:`ctrl.packet.pack_rows`.
+
+    :param ctrl.Controller controller: the controller
+    :param str label: the sink label
+    :param int index: the global row index of the first row (default 0)
+    :param int rows: the maximum number of rows in a chunk (default 4096)
+    :param int level: the :py:mod:`zlib` compression level, or 0 not to compress (default 0)
+    :return: iterator over the packed chunks
+    :raise: :py:class:`ctrl.ControllerException` if rows is not positive
+    """
+    if rows < 1:
+        raise ctrl.ControllerException('rows must be positive')
+
+    end = None
+    while True:
+
+        (views, current, dropped) = controller.read_sink_since(label, index)
+        if end is None:
+            end = current
+        if not views:
+            break
+
+        # global index of the first row available
+        start = current - sum(len(view) for view in views)
+        if start >= end:
+            break
+
+        count = min(rows, end - start)
+        chunk = numpy.concatenate([view[:count] for view in views])[:count]
+
+        # rows overwritten while copying
+        (_, _, lost) = controller.read_sink_since(label, start)
+        if lost:
+            lost = min(count, lost + 1)
+            chunk = chunk[lost:]
+            dropped += lost
+
+        yield packet.pack('P', (start + lost, dropped, packet.pack_rows(chunk, level)))
+
+        index = start + count
+
 # exit flag
 exiting = False
 
@@ -236,16 +499,124 @@ class Handler(socketserver.StreamRequestHandler):
 
     #def __init__(self, request, client_address, server):
         #super().__init__(request, client_address, server)
+
+    # send small replies immediately
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # read packets with the same buffered reader as the client
+        self.rfile.close()
+        self.rfile = packet.SocketReader(self.connection)
+        # replies and frames are written by different threads
+        self.lock = threading.Lock()
+        self.subscription = None
+        # commands are executed by the selected controller
+        self.name = DEFAULT
+
+    def finish(self):
+        self.unsubscribe()
+        super().finish()
+
+    def write(self, buffer):
+        with self.lock:
+            self.wfile.write(buffer)
+
+    def select(self, name):
+        """
+        Select the controller that executes the commands received on
+        the connection.
+
+        :param str name: name of the controller
+        :raise: :py:class:`ctrl.ControllerException` if there is no controller named name
+        """
+        get_controller(name)
+        self.name = name
+
+    def subscribe(self, labels, decimation = 1, rate = 0, size = 1000):
+        """
+        Subscribe to signals.
+
+        After acknowledging the subscription, the server streams
+        frames on the connection until :py:meth:`unsubscribe`. Each
+        frame is a matrix ('M') whose rows are the samples, the first
+        column being the time of the sample and the others the values
+        of the signals, followed by the number ('I') of samples
+        dropped since the previous frame because the client was
+        slow. A frame is sent after each collected sample, or at
+        the given rate.
+
+        :param list labels: the signal labels
+        :param int decimation: sample signals every decimation iterations (default 1)
+        :param float rate: the rate of frames in Hz, or 0 to send a frame after each sample (default 0)
+        :param int size: the maximum number of samples held for the client (default 1000)
+        """
+        self.unsubscribe()
+
+        label = '_subscription_{}_'.format(id(self))
+        publisher = Publisher(decimation = decimation, size = size)
+        (controller, commands) = get_controller(self.name)
+        controller.add_sink(label, publisher, list(labels))
+
+        # start publishing after the subscription is acknowledged
+        self.subscription = (controller, label, publisher,
+                             threading.Thread(target = self.publish,
+                                              args = (publisher, rate),
+                                              daemon = True))
+
+    def unsubscribe(self):
+        """
+        Cancel the subscription.
+        """
+        if self.subscription is None:
+            return
+
+        (_controller, label, publisher, thread) = self.subscription
+        self.subscription = None
+        publisher.close()
+        if thread.ident is not None:
+            thread.join()
+        _controller.remove_sink(label)
+
+    def download(self, label, index = 0, rows = 4096, level = 0):
+        """
+        Download the rows written to a sink since a global row index.
+
+        The rows are streamed in chunks before the acknowledgment,
+        see :py:func:`pack_chunks`.
+
+        :param str label: the sink label
+        :param int index: the global row index of the first row (default 0)
+        :param int rows: the maximum number of rows in a chunk (default 4096)
+        :param int level: the :py:mod:`zlib` compression level, or 0 not to compress (default 0)
+        """
+        (controller, commands) = get_controller(self.name)
+        for buffer in pack_chunks(controller, label, index, rows, level):
+            self.write(buffer)
+
+    def publish(self, publisher, rate):
+        period = 1 / rate if rate > 0 else None
+        while not publisher.closed:
+            (rows, dropped) = publisher.read(period)
+            if rows:
+                try:
+                    self.write(pack_frame(rows, dropped))
+                except OSError:
+                    break
     
     def handle(self):
         
-        global verbose_level, controller, commands, exiting
+        global verbose_level, exiting
 
         if verbose_level > 1:
             print('> Connected to {}'.format(self.client_address))
 
         # Read command
-        while controller.get_state() != ctrl.EXITING:
+        while True:
+
+            (controller, commands) = get_controller(self.name)
+            if controller.get_state() == ctrl.EXITING:
+                break
             
             if verbose_level > 4:
                 print('>>> server::Handler::handle loop')
@@ -275,9 +646,13 @@ class Handler(socketserver.StreamRequestHandler):
                 # Handle input arguments
                 vargs = []
                 kwargs = {}
+                error = None
                 for letter in argument_type:
                     (type, arg) = packet.unpack_stream(self.rfile)
-                    if type == 'K':
+                    if type == 'E':
+                        # argument was refused
+                        error = arg
+                    elif type == 'K':
                         kwargs = arg
                     elif type == 'R':
                         vargs.extend(arg)
@@ -292,7 +667,8 @@ class Handler(socketserver.StreamRequestHandler):
                 if code == '0':
                     print('> Be patient, shutting down server...')
                     # set exit flag
-                    controller.set_state(ctrl.EXITING)
+                    for (_controller, _commands) in controllers.values():
+                        _controller.set_state(ctrl.EXITING)
                     # clear message
                     message = None
                     # start thread to shutdown server
@@ -305,8 +681,24 @@ class Handler(socketserver.StreamRequestHandler):
                     
                 else:
                     
+                    # subscriptions are bound to the connection
+                    if code == 'a':
+                        function = self.subscribe
+                    elif code == 'b':
+                        function = self.unsubscribe
+                    elif code == '2':
+                        function = self.download
+                    elif code == '3':
+                        function = self.select
+                    elif code == 'Z':
+                        # reset the selected controller by default
+                        kwargs.setdefault('name', self.name)
+
                     try:
 
+                        if error is not None:
+                            raise error
+
                         # Call function
                         message = function(*vargs, **kwargs)
 
@@ -337,12 +729,19 @@ class Handler(socketserver.StreamRequestHandler):
                     print('>>> Sending message = ', *message)
                     if verbose_level > 4:
                         print('>>>> Message content = ', packet.pack(*message))
-                self.wfile.write(packet.pack(*message))
+                buffer = pack_reply(*message)
+            else:
+                buffer = b''
 
             message = ('A', code)
             if verbose_level > 3:
                 print(">>> Acknowledge '{}'\n".format(code))
-            self.wfile.write(packet.pack(*message))
+            # send reply and acknowledgment at once
+            self.write(buffer + packet.pack(*message))
+
+            # start publishing
+            if self.subscription is not None and self.subscription[3].ident is None:
+                self.subscription[3].start()
 
         if verbose_level > 4:
             print('>>> Exiting server::handle loop')
@@ -29,6 +29,15 @@ class Controller(ctrl.Controller):
       x = cycles
       w = cycles/s (Hz)
 
+    If `virtual` is True then the clock is a
+    :py:class:`ctrl.block.clock.VirtualClock` and the controller can
+    be simulated as fast as possible using :py:meth:`simulate`.
+
+    If `a`, `k` or `X` are arrays with N entries then the controller
+    simulates a batch of N motors at once, e.g. for Monte Carlo
+    analysis: *motor1* can be set to a scalar or to an array with N
+    entries, and *input1* and *encoder1* are arrays with N entries.
+
     Default parameters are:
 
       a = 1/tau = 17 (1/s)
@@ -77,10 +86,15 @@ class Controller(ctrl.Controller):
         # period
         self.period = kwargs.pop('period', 0.01) # deadzone
 
+        # virtual time
+        self.virtual = kwargs.pop('virtual', False)
+
         # Model parameters
         self.a = kwargs.pop('a', 17)   # 1/s
         self.k = kwargs.pop('k', 0.11) # cycles/s duty
         self.X = kwargs.pop('X', 10)   # deadzone
+        if isinstance(self.X, (list, tuple)):
+            self.X = numpy.array(self.X)
 
         # Initialize controller
         super().__init__(*vargs, **kwargs)
@@ -99,12 +113,13 @@ class Controller(ctrl.Controller):
         # self.signals['clock'] = self.clock.time
         # self.time_origin = self.clock.time_origin
         self.clock = self.add_device('clock',
-                                     'ctrl.block.clock', 'TimerClock',
+                                     'ctrl.block.clock',
+                                     'VirtualClock' if self.virtual else 'TimerClock',
                                      type = 'source', 
                                      outputs = ['clock'],
                                      enable = True,
                                      period = self.period)
-        self.signals['clock'] = self.clock.time
+        self.set_signal('clock', self.clock.time)
         self.time_origin = self.clock.time_origin
 
         # add signals
@@ -116,11 +131,20 @@ class Controller(ctrl.Controller):
 
         # add filter: model
         Ts = self.period
-        c = math.exp(-self.a * Ts)
-        self.model3 = system.System(model = \
-            tf.DTTF(
-                numpy.array((0, (self.k*Ts)*(1-c)/2, (self.k*Ts)*(1-c)/2)), 
-                numpy.array((1, -(1 + c), c))))
+        if numpy.ndim(self.a) or numpy.ndim(self.k):
+            # batch of models, one per column
+            (kTs, c) = numpy.broadcast_arrays(numpy.multiply(self.k, Ts),
+                                              numpy.exp(-numpy.multiply(self.a, Ts)))
+            self.model3 = system.System(model = \
+                tf.DTTF(
+                    numpy.array((0*c, kTs*(1-c)/2, kTs*(1-c)/2)),
+                    numpy.array((1+0*c, -(1 + c), c))))
+        else:
+            c = math.exp(-self.a * Ts)
+            self.model3 = system.System(model = \
+                tf.DTTF(
+                    numpy.array((0, (self.k*Ts)*(1-c)/2, (self.k*Ts)*(1-c)/2)), 
+                    numpy.array((1, -(1 + c), c))))
         self.add_filter('model1', self.model3, 
                         ['input1'], ['encoder1'])
 
@@ -132,6 +156,20 @@ class Controller(ctrl.Controller):
         super().stop()
         self.clock.set_enabled(False)
 
+    def simulate(self, duration):
+        """
+        Simulate controller for `duration` seconds of clock time
+        using :py:meth:`ctrl.Controller.run_for`.
+
+        If the controller was created with `virtual = True` then time
+        advances by `period` every iteration without waiting.
+
+        :param float duration: duration in seconds
+        :return: number of iterations executed
+        :rtype: int
+        """
+        return self.run_for(int(round(duration / self.period)))
+    
     # period
     def set_period(self, value):
         self.period = value
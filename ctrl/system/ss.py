@@ -11,6 +11,13 @@ class DTSS(system.System):
       x_{k+1} &= A x_k + B u_k \\
           y_k &= C x_k + D u_k
 
+    A batch of :math:`N` models sharing the matrices `A`, `B`, `C` and
+    `D` is simulated when :py:meth:`update` is called with :math:`N`
+    entries per input: `uk` is then the concatenation of the :math:`N`
+    values of each input, `yk` is the concatenation of the :math:`N`
+    values of each output, and the state is expanded to shape
+    :math:`(n, N)`.
+
     :param A:
     :param B:
     :param C:
@@ -74,6 +81,14 @@ class DTSS(system.System):
     def update(self, uk):
         # yk = C xk + D uk
         # xk+1 = A xk + B uk
+        m = self.B.shape[1]
+        batch = numpy.size(uk) > m
+        if batch:
+            # inputs as rows, batch as columns
+            uk = numpy.reshape(uk, (m, -1))
+            if self.state.ndim == 1:
+                self.state = numpy.repeat(self.state[:,numpy.newaxis],
+                                          uk.shape[1], axis=1)
         if self.state.size > 0:
             #print('> x = {}'.format(self.state))
             yk = self.C.dot(self.state) + self.D.dot(uk)
@@ -84,5 +99,7 @@ class DTSS(system.System):
             #print('< x = {}'.format(self.state))
         else:
             yk = self.D.dot(uk)
-            
+
+        if batch:
+            return yk.reshape(-1)
         return yk
@@ -33,9 +33,18 @@ class DTTF(system.System):
 
         y_k = num[0] z_k + num[1] z_{k-1} + \cdots + den[n] z_{k-n}
 
-    :param num: numpy m-dimensional 1D-vector numerator (default [1])
-    :param den: numpy n-dimensional 1D-vector denominator (default [1])
-    :param state: numpy n-dimensional 1D-vector representing vector z (default `None`)
+    *DTTF* can also simulate a batch of :math:`N` transfer-functions at
+    once. The coefficients of each transfer-function are then stored
+    in the columns of 2D arrays :py:attr:`num` and :py:attr:`den` with
+    :math:`N` columns, :py:attr:`state` has shape :math:`(n, N)`, and
+    :py:meth:`update` takes and returns 1D-vectors with :math:`N`
+    entries. A single transfer-function whose :py:meth:`update` is
+    called with a 1D-vector of :math:`N > 1` entries is applied to each
+    entry and its state is expanded accordingly.
+
+    :param num: numpy m-dimensional 1D-vector numerator, or (m, N) 2D-array for a batch (default [1])
+    :param den: numpy n-dimensional 1D-vector denominator, or (n, N) 2D-array for a batch (default [1])
+    :param state: numpy n-dimensional 1D-vector representing vector z, or (n, N) 2D-array for a batch (default `None`)
     """
     
     def __init__(self,
@@ -48,15 +57,24 @@ class DTTF(system.System):
         den = numpy.array(den)
 
         # must be proper
-        n = num.size - 1
-        m = den.size - 1
+        n = num.shape[0] - 1
+        m = den.shape[0] - 1
         
         #print('n = {}\nm = {}'.format(n, m))
         
         # Make vectors same size
         self.den = den.astype(float)
         self.num = num.astype(float)
-        if m < n:
+        if self.num.ndim > 1 or self.den.ndim > 1:
+            # batch: pad with zeros and broadcast columns
+            batch = numpy.broadcast(self.num[0], self.den[0]).shape
+            order = max(n, m)
+            self.num = numpy.vstack((numpy.broadcast_to(self.num.T, batch + (n+1,)).T,
+                                     numpy.zeros((order - n,) + batch)))
+            self.den = numpy.vstack((numpy.broadcast_to(self.den.T, batch + (m+1,)).T,
+                                     numpy.zeros((order - m,) + batch)))
+            n = m = order
+        elif m < n:
             self.den.resize(num.shape)
             m = n
         elif m > n:
@@ -64,7 +82,7 @@ class DTTF(system.System):
             n = m
 
         # inproper?
-        if not self.den[0]:
+        if numpy.any(self.den[0] == 0):
             raise system.SystemException('Order of numerator cannot be greater than order of the denominator')
 
         # normalize denominator
@@ -72,8 +90,8 @@ class DTTF(system.System):
         self.den = self.den / self.den[0]
         
         if state is None:
-            self.state = numpy.zeros((n,), dtype=float)
-        elif state.size == n:
+            self.state = numpy.zeros((n,) + self.den.shape[1:], dtype=float)
+        elif state.shape[0] == n:
             self.state = state.astype(float)
         else:
             raise system.SystemException('Order of state must match order of denominator')
@@ -107,8 +125,17 @@ class DTTF(system.System):
 
         TODO: if :math:`num[1] \neq num[0] den[1]` then choose next nonzero coefficient.
 
-        :param yk: scalar desired `yk`
+        :param yk: scalar desired `yk`, or 1D-vector for a batch
         """
+        if self.state.ndim > 1:
+            # batch: with z_{k-i} = 0, i > 1, yk depends only on z_{k-1}
+            self.state[1:] = 0
+            if self.state.shape[0] > 0:
+                self.state[0] = numpy.where(yk != 0,
+                                            yk / (self.num[1] - self.num[0] * self.den[1]),
+                                            0)
+            return
+        
         self.state[1:] = 0
         if yk != 0:
             self.state[0] = (yk - self.state[1:].dot(self.num[2:]) + self.num[0] * self.state[1:].dot(self.den[2:]) ) / (self.num[1] - self.num[0] * self.den[1])
@@ -128,6 +155,9 @@ class DTTF(system.System):
             z_k + den[1] z_{k-1} + \cdots + den[n] z_{k-n} &= u_k \\
             y_k &= num[0] z_k + num[1] z_{k-1} + \cdots + den[n] z_{k-n}
         """
+        if self.state.ndim > 1 or numpy.size(uk) > 1:
+            return self.update_batch(uk)
+
         #print('uk = {}, state = {}'.format(uk, self.state))
         zk = uk - self.state.dot(self.den[1:])
         yk = self.num[0] * zk + self.state.dot(self.num[1:])
@@ -139,6 +169,31 @@ class DTTF(system.System):
             
         return yk
 
+    def update_batch(self, uk):
+        """
+        Update a batch of *DTTF* models with the same recursion as
+        :py:meth:`update`.
+
+        :param uk: 1D-vector with the inputs of the batch
+        :return: 1D-vector with the outputs of the batch
+        """
+        uk = numpy.reshape(uk, -1)
+        
+        # expand state to batch size
+        if self.state.ndim == 1:
+            self.state = numpy.repeat(self.state[:,numpy.newaxis],
+                                      uk.size, axis=1)
+            
+        zk = uk - numpy.einsum('i...,i...->...', self.den[1:], self.state)
+        yk = self.num[0] * zk + \
+             numpy.einsum('i...,i...->...', self.num[1:], self.state)
+        if self.state.shape[0] > 0:
+            if self.state.shape[0] > 1:
+                self.state[1:] = self.state[:-1]
+            self.state[0] = zk
+            
+        return yk
+        
     def as_DTSS(self):
         """
         :returns: a state-space representation (*DTSS*) of the *DTTF*.
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+def main():
+
+    # import python's standard modules and numpy
+    import io, struct, timeit, numpy
+
+    # import packet codec
+    import ctrl.packet as packet
+
+    # previous codec, packing and unpacking one element at a time
+    def pack_matrix_old(content):
+        buffer = b''
+        for k in range(content.shape[0]):
+            for value in content[k,:]:
+                buffer += struct.pack('<d', value)
+        return ( struct.pack('<cI', b'M', content.shape[0]) +
+                 struct.pack('<ccI', b'V', b'D', content.size) + buffer )
+
+    def unpack_matrix_old(stream):
+        (btype, rsize) = struct.unpack('<cI', stream.read(5))
+        (btype, vtype, vlen) = struct.unpack('<ccI', stream.read(6))
+        vector = numpy.zeros(vlen, float)
+        buffer = stream.read(8 * vlen)
+        for k in range(vlen):
+            (vector[k],) = struct.unpack('<d', buffer[k*8:(k+1)*8])
+        return numpy.resize(vector, (rsize, int(vector.size/rsize)))
+
+    # a Logger sized matrix
+    matrix = numpy.random.rand(12000, 5)
+
+    # both codecs produce the same stream
+    assert pack_matrix_old(matrix) == packet.pack('M', matrix)
+    stream = packet.pack('M', matrix)
+
+    # time codecs
+    number = 3
+    results = [
+        ('pack',
+         timeit.timeit(lambda: pack_matrix_old(matrix), number = number),
+         timeit.timeit(lambda: packet.pack('M', matrix), number = number)),
+        ('unpack',
+         timeit.timeit(lambda: unpack_matrix_old(io.BytesIO(stream)), number = number),
+         timeit.timeit(lambda: packet.unpack_stream(io.BytesIO(stream)), number = number))
+    ]
+
+    print('> Codec for {}x{} matrix (ms per call)'.format(*matrix.shape))
+    print('  {:<8} {:>12} {:>12} {:>10}'.format('', 'old', 'new', 'speedup'))
+    for (label, old, new) in results:
+        print('  {:<8} {:>12.3f} {:>12.3f} {:>9.0f}x'
+              .format(label, 1e3 * old / number, 1e3 * new / number, old / new))
+
+if __name__ == "__main__":
+    main()
@@ -47,7 +47,7 @@ Hello World!
 If you have not started a ctrl_server yet open a new terminal
 and start a server by typing:
 
-    ctrl_start_server
+    ctrl_start_server -P
 """)
     input('and hit <ENTER>')
 
@@ -0,0 +1,163 @@
+import pytest
+import time
+import asyncio
+import concurrent.futures
+import threading
+import numpy
+
+import ctrl
+import ctrl.packet
+import ctrl.server
+import ctrl.client
+import ctrl.aioserver
+import ctrl.aioclient
+
+HOST, PORT = "localhost", 9191
+
+def test_aio():
+
+    # serve a local controller
+    ctrl.server.set_controller(ctrl.Controller())
+    server = ctrl.aioserver.Server(HOST, PORT)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target = loop.run_until_complete,
+                              args = (server.serve_forever(),))
+    thread.start()
+
+    async def run():
+
+        client = ctrl.aioclient.Controller(host = HOST, port = PORT)
+
+        # concurrent first requests share a single connection
+        assert await asyncio.gather(*[client.get_signal('is_running')
+                                      for k in range(20)]) == 20 * [0]
+        await client.close()
+
+        # concurrent requests are pipelined
+        await client.add_signal('_test_')
+        await asyncio.gather(*[client.set_signal('_test_', k)
+                               for k in range(10)])
+        assert await client.get_signal('_test_') == 9
+        assert await asyncio.gather(client.get_signal('_test_'),
+                                    client.list_signals(),
+                                    client.get_signals('_test_', 'is_running')) \
+            == [9, ['is_running', 'duty', 'clock', '_test_'], [9, 0]]
+
+        with pytest.raises(Exception):
+            await client.get_signal('_undefined_')
+        assert await client.get_signal('_test_') == 9
+
+        # bulk signals
+        await client.add_signal('_bulk_')
+        await client.set_signals({'_test_': 3, '_bulk_': 4})
+        assert list(await client.get_signals_array('_bulk_', '_test_')) == [4, 3]
+        await client.set_signal('_test_', 9)
+
+        # download
+        await client.add_sink('_log_', ctrl.block.Logger(number_of_rows = 100),
+                              ['clock', '_test_'])
+        await asyncio.gather(*[client.write_sink('_log_', k, -k)
+                               for k in range(30)])
+        log = await client.read_sink('_log_')
+        assert len(log) == 30
+        chunks = [chunk async for (index, chunk, dropped)
+                  in client.download_sink('_log_', rows = 3, level = 1)]
+        assert numpy.array_equal(numpy.concatenate(chunks), log)
+        async for (index, chunk, dropped) in client.download_sink('_log_', rows = 1):
+            break
+        assert await client.get_signal('_test_') == 9
+        await client.remove_sink('_log_')
+
+        # subscription
+        subscription = await client.subscribe(['clock', 'is_running'])
+        async with client:
+            (frame, dropped) = await subscription.read()
+            assert frame.shape[1] == 3 and numpy.all(frame[:,2] == 1)
+        await subscription.close()
+        assert await client.list_sinks() == []
+
+        # named controllers
+        await client.reset(name = '_rig_', module = 'ctrl', ctrl_class = 'Controller')
+        assert await client.list_controllers() == ['default', '_rig_']
+        await client.select('_rig_')
+        assert '_test_' not in await client.list_signals()
+        await client.add_signal('_rig_signal_')
+        subscription = await client.subscribe(['_rig_signal_'])
+        assert len(await client.list_sinks()) == 1
+        await subscription.close()
+        assert await client.list_sinks() == []
+        await client.close()
+        assert '_test_' not in await client.list_signals()
+        await client.select('default')
+
+        # reconnection
+        await client.close()
+        assert await client.get_signal('_test_') == 9
+        await client.close()
+
+    # blocking clients are served at once
+    first = ctrl.client.Controller(host = HOST, port = PORT)
+    second = ctrl.client.Controller(host = HOST, port = PORT)
+    # the logger is installed pickled
+    ctrl.packet.allow_pickle = True
+    try:
+        asyncio.run(run())
+
+        first.set_signal('_test_', 1)
+        assert second.get_signal('_test_') == 1
+        second.set_signal('_test_', 2)
+        assert first.get_signal('_test_') == 2
+
+        first.shutdown()
+        thread.join()
+
+    finally:
+        ctrl.packet.allow_pickle = False
+        first.close()
+        second.close()
+        server.close()
+        thread.join()
+        loop.close()
+        ctrl.server.controllers.pop('_rig_', None)
+        ctrl.server.set_controller(ctrl.Controller(noclock = True))
+
+def test_subscribe():
+
+    # a single thread executes the commands
+    ctrl.server.set_controller(ctrl.Controller())
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers = 1)
+    server = ctrl.aioserver.Server(HOST, PORT + 1, executor)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target = loop.run_until_complete,
+                              args = (server.serve_forever(),))
+    thread.start()
+
+    async def run():
+
+        client = ctrl.aioclient.Controller(host = HOST, port = PORT + 1)
+
+        # waiting for samples does not hold the executor
+        subscriptions = [await client.subscribe(['clock']) for k in range(3)]
+        assert await client.get_signal('is_running') == 0
+
+        await client.start()
+        for subscription in subscriptions:
+            (frame, dropped) = await subscription.read()
+            assert len(frame) > 0
+            await subscription.close()
+        await client.stop()
+        await client.shutdown()
+        await client.close()
+
+    try:
+        asyncio.run(run())
+        thread.join()
+
+    finally:
+        server.close()
+        thread.join()
+        loop.close()
+        executor.shutdown()
+        ctrl.server.set_controller(ctrl.Controller(noclock = True))
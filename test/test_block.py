@@ -186,6 +186,96 @@ def test_logger():
 
     assert _logger.get() == { 'auto_reset': False, 'enabled': True, 'current': 1, 'page': 0 }
 
+def test_logger_read_since():
+
+    import ctrl.block as logger
+    import numpy as np
+
+    _logger = logger.Logger(number_of_rows = 4)
+    assert _logger.read_since(0) == ((), 0, 0)
+
+    _logger.write(0, 0)
+    _logger.write(1, 1)
+    (views, index, dropped) = _logger.read_since(0)
+    assert len(views) == 1 and index == 2 and dropped == 0
+    assert np.all(views[0][:,0] == [0, 1])
+    assert views[0].base is _logger.data
+
+    # wraps around
+    for k in range(2, 6):
+        _logger.write(k, k)
+    (views, index, dropped) = _logger.read_since(index)
+    assert len(views) == 2 and index == 6 and dropped == 0
+    assert np.all(np.vstack(views)[:,0] == [2, 3, 4, 5])
+
+    # reader fell behind
+    for k in range(6, 12):
+        _logger.write(k, k)
+    (views, index, dropped) = _logger.read_since(index)
+    assert index == 12 and dropped == 2
+    assert np.all(np.vstack(views)[:,0] == [8, 9, 10, 11])
+
+    # nothing new
+    assert _logger.read_since(index) == ((), 12, 0)
+
+    # logger was reset
+    _logger.reset()
+    _logger.write(0, 0)
+    (views, index, dropped) = _logger.read_since(12)
+    assert index == 1 and np.all(views[0][:,0] == [0])
+    
+def test_logger_dtype():
+
+    import ctrl.block as logger
+    import numpy as np
+    import pickle
+
+    # single dtype
+    _logger = logger.Logger(dtype = np.float32)
+    _logger.write(1, 2.5)
+    log = _logger.read()
+    assert log.dtype == np.float32
+    assert np.all(log == [[1, 2.5]])
+    assert 'dtype' not in _logger.get()
+
+    # inferred dtypes
+    _logger = logger.Logger(number_of_rows = 3, dtype = 'infer')
+    for k in range(4):
+        _logger.write(k + 0.5, k > 1, k, [k / 2, 2.0 * k])
+    log = _logger.read()
+    assert log.dtype.names == ('f0', 'f1', 'f2', 'f3', 'f4')
+    assert [log.dtype[k] for k in range(5)] == \
+        [np.float64, np.bool_, np.int64, np.float32, np.float32]
+    assert log.dtype.itemsize == 8 + 1 + 8 + 4 + 4
+    assert np.all(log['f0'] == [1.5, 2.5, 3.5])
+    assert np.all(log['f1'] == [False, True, True])
+    assert np.all(log['f4'] == [2, 4, 6])
+    (views, index, dropped) = _logger.read_since(2)
+    assert np.all(np.concatenate(views)['f2'] == [2, 3])
+
+    # integers are not truncated, floats out of the range of float32
+    # and small numpy integers keep their dtype
+    assert block.infer_dtypes([0.5, 2**40, 1e40, np.int16(3), np.uint8(4)]) == \
+        [np.float64, np.int64, np.float64, np.int16, np.uint8]
+    _logger = logger.Logger(dtype = 'infer')
+    _logger.write(0.5, 2**40)
+    assert _logger.read()['f1'][0] == 2**40
+
+    # dtype is preserved when pickled
+    assert pickle.loads(pickle.dumps(log)).dtype == log.dtype
+    
+    # dtype of each column
+    _logger = logger.Logger(dtype = [np.float64, np.int16])
+    _logger.write(0.5, 3)
+    log = _logger.read()
+    assert log['f1'].dtype == np.int16
+    with pytest.raises(logger.BlockException):
+        _logger.write(1, 2, 3)
+
+    # set dtype
+    _logger.set(dtype = float)
+    assert _logger.read().shape == (0, 2)
+    
 def test_Signal():
 
     import numpy as np
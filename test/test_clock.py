@@ -1,5 +1,6 @@
 import pytest
 import math
+import time
 
 import ctrl.block as block
 import ctrl.block.clock as clk
@@ -91,8 +92,74 @@ def test_reset():
 
     clock.set_enabled(False)
     
+def test_absolute():
+
+    N = 100
+    Ts = 0.01
+
+    clock = clk.TimerClock(period = Ts, absolute = True)
+    assert clock.get('absolute') == True
+    assert clock.get('missed_deadlines') == 0
+
+    clock.reset()
+    k = 0
+    while k < N:
+        (t,) = clock.read()
+        k += 1
+
+    # ticks happen at absolute deadlines and do not drift
+    average = clock.calculate_average_period()
+    assert abs(average - Ts)/Ts < 1e-1
+    assert abs(t - N * Ts) < 2 * Ts
+
+    clock.set_enabled(False)
+    assert not clock.thread.is_alive()
+    
+    # missed deadlines are skipped and counted
+    clock = clk.TimerClock(period = Ts, absolute = True)
+    clock.read()
+    
+    # hold the lock so that the clock cannot tick
+    clock.condition.acquire()
+    time.sleep(10 * Ts)
+    clock.condition.release()
+
+    clock.read()
+    clock.read()
+    assert clock.get('missed_deadlines') >= 5
+    
+    clock.reset()
+    assert clock.get('missed_deadlines') == 0
+    
+    clock.set_enabled(False)
+
+def test_overrun():
+
+    N = 50
+    Ts = 0.01
+
+    for absolute in (False, True):
+
+        # reader takes longer than a period
+        clock = clk.TimerClock(period = Ts, absolute = absolute)
+        clock.read()
+        t0 = time.perf_counter()
+        for k in range(N):
+            clock.read()
+            time.sleep(1.2 * Ts)
+        elapsed = time.perf_counter() - t0
+
+        # pending ticks are read at once and missed ticks are counted
+        assert elapsed < 1.6 * N * Ts
+        assert clock.get('missed_deadlines') >= N / 10
+        assert clock.count - clock.get('missed_deadlines') <= N + 2
+
+        clock.set_enabled(False)
+    
 if __name__ == "__main__":
 
     test()
     test_calibrate()
     test_reset()
+    test_absolute()
+    test_overrun()
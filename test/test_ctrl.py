@@ -1,5 +1,6 @@
 import pytest
 import time
+import numpy
 
 HOST, PORT = "localhost", 9998
 start_server = True
@@ -154,6 +155,11 @@ def run(controller):
     assert log.shape[0] > 1
     assert log.shape[1] == 1
 
+    (views, index, dropped) = controller.read_sink_since('_logger_', 0)
+    assert numpy.array_equal(numpy.vstack(views), log)
+    assert index == log.shape[0] + dropped
+    assert controller.read_sink_since('_logger_', index) == ((), index, 0)
+
     controller.set_sink('_logger_', reset = True)
     log = controller.read_sink('_logger_')
     assert isinstance(log, numpy.ndarray)
@@ -367,8 +373,402 @@ def test_run():
 
     controller.remove_source('clock')
 
+def test_plan():
+
+    from ctrl import Controller
+    import ctrl.block as block
+    import ctrl.block.system as system
+
+    controller = Controller()
+
+    controller.add_signals('_input_', '_output_')
+    controller.add_filter('_gain_', system.Gain(gain = 2),
+                          ['_input_'], ['_output_'])
+    controller.add_sink('_logger_', block.Logger(), ['_input_', '_output_'])
+
+    (sources, filters, sinks) = controller.compile_plan()
+    slots = controller.signal_slots
+    assert len(sources) == 1
+    assert filters[0][1] == (slots['_input_'],)
+    assert filters[0][2] == (slots['_output_'],)
+    assert sinks[0][1] == (slots['_input_'], slots['_output_'])
+
+    # plan is invalidated by changes
+    controller.set_filter('_gain_', outputs = ['_input_'])
+    assert controller.plan is None
+    controller.set_filter('_gain_', outputs = ['_output_'])
+
+    # slots are preserved after signals are removed
+    controller.add_signal('_temp_')
+    controller.remove_signal('_temp_')
+    controller.set_signal('_input_', 3)
+    assert controller.get_signal('_input_') == 3
+    assert controller.get_signals('_input_', '_output_') == [3, 0]
+
+    # blocks can be changed by other threads while the plan is compiled
+    import threading
+    def change():
+        for k in range(1000):
+            controller.add_sink('_temp_', block.Logger(), ['_input_'])
+            controller.remove_sink('_temp_')
+    thread = threading.Thread(target = change)
+    thread.start()
+    while thread.is_alive():
+        controller.plan or controller.compile_plan()
+    thread.join()
+    (sources, filters, sinks) = controller.plan or controller.compile_plan()
+    assert len(sinks) == 1
+
+    # stop after 10 iterations
+    controller.add_filter('_count_',
+                          block.Map(function = lambda x: x + 1),
+                          ['_input_'], ['_input_'], order = 0)
+    controller.add_filter('_stop_',
+                          block.Map(function = lambda x: x < 10),
+                          ['_input_'], ['is_running'])
+    controller.set_signal('_input_', 0)
+    controller.run()
+
+    assert controller.get_signal('_input_') == 10
+    log = controller.read_sink('_logger_')
+    assert numpy.all(log[:,1] == 2 * log[:,0])
+
+def test_timers():
+
+    import threading
+    from ctrl import Controller
+    import ctrl.block as block
+
+    controller = Controller()
+
+    # many repeating timers and one one-shot timer
+    N = 10
+    for k in range(N):
+        label = '_count{}_'.format(k)
+        controller.add_signal(label)
+        controller.add_timer(label,
+                             block.Map(function = lambda x: x + 1),
+                             [label], [label], 0.1, True)
+    controller.add_signal('_once_')
+    controller.add_timer('_once_',
+                         block.Constant(value = 1),
+                         None, ['_once_'], 0.05, False)
+
+    nthreads = threading.active_count()
+    with controller:
+        # a single thread runs all timers
+        assert threading.active_count() <= nthreads + 2
+        time.sleep(0.55)
+
+    for k in range(N):
+        assert controller.get_signal('_count{}_'.format(k)) == 5
+    assert controller.get_signal('_once_') == 1
+    assert not controller.timer_thread.is_alive()
+    
+def test_profile():
+
+    from ctrl import Controller
+    from ctrl.profiler import Histogram
+    import ctrl.block as block
+    import ctrl.block.system as system
+
+    # histogram
+    histogram = Histogram()
+    for k in range(100):
+        histogram.add(1e-3)
+    histogram.add(1e-1)
+    stats = histogram.stats()
+    assert stats['count'] == 101
+    assert stats['min'] == 1e-3
+    assert stats['max'] == 1e-1
+    assert abs(stats['p99'] - 1e-3) / 1e-3 < 0.2
+    
+    controller = Controller()
+    assert controller.get_profile() == {}
+    assert 'disabled' in controller.info('profile')
+
+    controller.add_signals('_input_', '_output_')
+    controller.add_filter('_gain_', system.Gain(gain = 2),
+                          ['clock'], ['_output_'])
+    controller.add_sink('_logger_', block.Logger(), ['clock', '_output_'])
+    controller.add_filter('_stop_',
+                          block.Map(function = lambda x: x < 0.1),
+                          ['clock'], ['is_running'])
+
+    controller.set_profiling(True)
+    controller.set_source('clock', reset = True)
+    controller.run()
+
+    profile = controller.get_profile()
+    assert profile['filters._gain_.write']['count'] > 1
+    assert profile['filters._gain_.read']['count'] > 1
+    assert profile['sinks._logger_.write']['count'] > 1
+    assert profile['sources.clock.read']['count'] > 1
+    assert profile['loop.period']['count'] == profile['loop.duty']['count'] - 1
+    assert 'loop.jitter' in profile
+    assert 'filters._gain_.write' in controller.info('profile')
+    
+    # logger still works through profiled block
+    log = controller.read_sink('_logger_')
+    assert numpy.all(log[:,1] == 2 * log[:,0])
+    
+    controller.set_profiling(False)
+    assert controller.get_profile() == {}
+    
+def test_auto_order():
+
+    import warnings
+    import ctrl
+    from ctrl import Controller
+    import ctrl.block as block
+    import ctrl.block.system as system
+
+    controller = Controller(auto_order = True)
+
+    # filters added in reverse order
+    controller.add_signals('_x_', '_y_', '_z_')
+    controller.add_filter('_second_', system.Gain(gain = 3),
+                          ['_y_'], ['_z_'])
+    controller.add_filter('_first_', system.Gain(gain = 2),
+                          ['_x_'], ['_y_'])
+    controller.add_filter('_other_', system.Gain(gain = 1),
+                          ['_x_'], ['is_running'])
+    assert controller.sort_filters() == ['_first_', '_second_', '_other_']
+    assert controller.algebraic_loops == []
+
+    # no delay between filters
+    controller.set_signal('_x_', 1)
+    controller.set_signal('is_running', False)
+    controller.set_filter('_other_', gain = 0)
+    controller.run()
+    assert controller.get_signal('_z_') == 6
+
+    # algebraic loop
+    controller.set_filter('_first_', inputs = ['_x_', '_z_'])
+    with pytest.warns(ctrl.ControllerWarning):
+        order = controller.sort_filters()
+    assert order == ['_other_', '_second_', '_first_']
+    assert controller.algebraic_loops == ['_second_']
+
+    # manual order
+    controller = Controller()
+    controller.add_filter('_second_', system.Gain(gain = 3),
+                          ['_y_'], ['_z_'])
+    controller.add_filter('_first_', system.Gain(gain = 2),
+                          ['_x_'], ['_y_'])
+    controller.set_signal('_x_', 1)
+    controller.add_filter('_stop_', system.Gain(gain = 0),
+                          ['_x_'], ['is_running'])
+    controller.run()
+    assert controller.get_signal('_z_') == 0
+    
+def test_parallel():
+
+    import threading
+    from ctrl import Controller
+    from ctrl.parallel import partition
+    import ctrl.block as block
+    import ctrl.block.system as system
+
+    # partition
+    branches = partition(['a', 'b', 'c', 'd', 'e'],
+                         [['x'], ['y'], ['x'], ['z'], ['w']],
+                         [['y'], ['u'], ['v'], ['v'], []])
+    assert branches == [['a', 'b'], ['c', 'd'], ['e']]
+
+    controller = Controller(workers = 2)
+
+    threads = set()
+    def count(x):
+        threads.add(threading.current_thread())
+        time.sleep(0.001)
+        return x + 1
+    
+    # two independent branches reading the same signal
+    controller.add_signals('_x_', '_k_', '_y1_', '_z1_', '_y2_', '_z2_')
+    controller.add_filter('_gain1_', system.Gain(gain = 2),
+                          ['_x_'], ['_y1_'])
+    controller.add_filter('_count1_', block.Map(function = count),
+                          ['_y1_'], ['_z1_'])
+    controller.add_filter('_gain2_', system.Gain(gain = 3),
+                          ['_x_'], ['_y2_'])
+    controller.add_filter('_count2_', block.Map(function = count),
+                          ['_y2_'], ['_z2_'])
+    controller.add_filter('_count_', block.Map(function = count),
+                          ['_k_'], ['_k_'])
+    controller.add_filter('_stop_', block.Map(function = lambda x: x < 10),
+                          ['_k_'], ['is_running'])
+    
+    controller.set_signal('_x_', 1)
+    controller.run()
+    controller.stop()
+
+    assert controller.get_signal('_k_') == 10
+    assert controller.get_signal('_z1_') == 3
+    assert controller.get_signal('_z2_') == 4
+    assert len(threads) > 1
+    assert controller.executor is None
+    
+def test_snapshot():
+
+    import threading
+    from ctrl import Controller
+    import ctrl.block as block
+
+    controller = Controller()
+
+    # two filters copy the clock in sequence
+    controller.add_signals('_first_', '_second_', '_timer_')
+    controller.add_filter('_first_', block.ShortCircuit(),
+                          ['clock'], ['_first_'])
+    controller.add_filter('_second_', block.ShortCircuit(),
+                          ['_first_'], ['_second_'])
+
+    # timer copies _second_
+    controller.add_timer('_timer_', block.ShortCircuit(),
+                         ['_second_'], ['_timer_'], 0.01, True)
+
+    assert controller.get_snapshot('_first_', '_second_') == [0, 0]
+    
+    mismatches = []
+    def read():
+        while controller.is_running:
+            (first, second) = controller.get_snapshot('_first_', '_second_')
+            if first != second:
+                mismatches.append((first, second))
+
+    with controller:
+        thread = threading.Thread(target = read)
+        thread.start()
+        time.sleep(0.5)
+    thread.join()
+
+    assert not mismatches
+
+    # timer outputs are values from a completed iteration
+    (clock, second, timer) = controller.get_snapshot('clock', '_second_', '_timer_')
+    assert second == clock
+    assert 0 < timer <= second
+    assert not controller.timer_updates
+
+def test_signals_array():
+
+    import threading
+    import ctrl
+    from ctrl import Controller
+
+    controller = Controller()
+    controller.add_signals('_first_', '_second_')
+
+    slots = controller.get_signal_slots('_first_', '_second_')
+    assert slots == [controller.signal_slots['_first_'],
+                     controller.signal_slots['_second_']]
+    with pytest.raises(ctrl.ControllerException):
+        controller.get_signal_slots('_first_', '_undefined_')
+    with pytest.raises(ctrl.ControllerException):
+        controller.get_slots([len(controller.signal_values)])
+
+    controller.set_signals({'_first_': 1, '_second_': 2})
+    assert controller.get_signals('_first_', '_second_') == [1, 2]
+    values = controller.get_signals_array('_second_', '_first_')
+    assert values.dtype == numpy.float64
+    assert numpy.all(values == [2, 1])
+
+    controller.set_slots(numpy.array(slots), numpy.array([3., 4.]))
+    assert numpy.all(controller.get_slots(slots) == [3, 4])
+
+    # stale slots are rejected
+    (generation, slots) = controller.lookup_signal_slots('_first_', '_second_')
+    controller.set_slots(slots, [5, 6], generation)
+    assert numpy.all(controller.get_slots(slots, generation) == [5, 6])
+    controller.add_signal('_third_')
+    controller.remove_signal('_third_')
+    with pytest.raises(ctrl.ControllerException):
+        controller.set_slots(slots, [7, 8], generation)
+    with pytest.raises(ctrl.ControllerException):
+        controller.get_slots(slots, generation)
+    assert controller.get_signals('_first_', '_second_') == [5, 6]
+    (generation, slots) = controller.lookup_signal_slots('_first_', '_second_')
+    assert numpy.all(controller.get_slots(slots, generation) == [5, 6])
+    controller.set_signals({'_first_': 3, '_second_': 4})
+
+    # signals are updated in the same iteration
+    mismatches = []
+    def read():
+        while controller.is_running:
+            (first, second) = controller.get_signals_array('_first_', '_second_')
+            if first != second:
+                mismatches.append((first, second))
+
+    controller.set_signals({'_first_': 0, '_second_': 0})
+    with controller:
+        thread = threading.Thread(target = read)
+        thread.start()
+        for k in range(200):
+            controller.set_signals({'_first_': k, '_second_': k})
+            time.sleep(0.001)
+    thread.join()
+
+    assert not mismatches
+    assert controller.get_signals('_first_', '_second_') == [199, 199]
+    
+def test_schedule():
+
+    import ctrl
+    from ctrl import Controller
+    from ctrl.block.clock import VirtualClock
+    from ctrl.block.system import Gain
+    from ctrl.block import Logger
+
+    controller = Controller(noclock = True)
+    controller.add_signals('clock', '_reference_', '_output_')
+    controller.add_source('clock', VirtualClock(period = 0.1), ['clock'])
+    controller.add_filter('_gain_', Gain(), ['_reference_'], ['_output_'])
+    controller.add_sink('_logger_', Logger(),
+                        ['clock', '_reference_', '_output_'])
+
+    with pytest.raises(ctrl.ControllerException):
+        controller.schedule([('set_signal', '_reference_', 1)])
+    with pytest.raises(ctrl.ControllerException):
+        controller.schedule([('set_signal', '_undefined_', 1)], iteration = 1)
+    with pytest.raises(ctrl.ControllerException):
+        controller.schedule([('set_sink', '_logger_', {})], iteration = 1)
+
+    # commands are executed atomically at the given iteration or time
+    controller.schedule([('set_signal', '_reference_', 1)], iteration = 3)
+    controller.load_schedule([(0.75, [('set_filter', '_gain_', {'gain': 2}),
+                                      ('set_signal', '_reference_', 2)]),
+                              (0.25, [('set_signal', '_reference_', -1)])],
+                             time = True)
+    schedule = controller.list_schedule()
+    assert [when for (when, commands) in schedule['iteration']] == [3]
+    assert [when for (when, commands) in schedule['time']] == [0.25, 0.75]
+
+    assert controller.run_for(10) == 10
+    log = controller.read_sink('_logger_')
+    assert list(log[:,1]) == [0, 0, -1, 1, 1, 1, 1, 2, 2, 2]
+    assert list(log[:,2]) == [0, 0, -1, 1, 1, 1, 1, 4, 4, 4]
+    assert controller.list_schedule() == {'iteration': [], 'time': []}
+
+    # iterations are counted from the start of the loop
+    controller.load_schedule([(k, [('set_signal', '_reference_', k)])
+                              for k in range(5)])
+    controller.clear_schedule()
+    controller.load_schedule([(k, [('set_signal', '_reference_', k)])
+                              for k in range(5)], clear = True)
+    assert len(controller.list_schedule()['iteration']) == 5
+    controller.run_for(2)
+    assert controller.get_signal('_output_') == 2
+    assert len(controller.list_schedule()['iteration']) == 3
+    controller.run_for(3)
+    assert controller.get_signal('_output_') == 4
+    assert len(controller.list_schedule()['iteration']) == 2
+    controller.clear_schedule()
+    assert controller.list_schedule() == {'iteration': [], 'time': []}
+
 def test_client_server():
 
+    import pickle
     import ctrl.client
 
     if start_server:
@@ -379,7 +779,8 @@ def test_client_server():
         import subprocess
         server = subprocess.Popen(["ctrl_start_server",
                                    "-H{}".format(HOST),
-                                   "-p{}".format(PORT)],
+                                   "-p{}".format(PORT),
+                                   "-P"],
                                   stdout = subprocess.PIPE)
 
         time.sleep(1)
@@ -391,6 +792,159 @@ def test_client_server():
         # test client
         run(client)
 
+        # test profile
+        client.set_profiling(True)
+        assert client.get_profile() == {}
+        with client:
+            time.sleep(.1)
+        assert client.get_profile()['loop.duty']['count'] > 1
+        assert 'loop.duty' in client.info('profile')
+        client.set_profiling(False)
+
+        # test snapshot
+        assert client.get_snapshot('is_running') == [0]
+
+        # test batch
+        client.add_signal('_batch_')
+        with client.batch() as replies:
+            for k in range(12):
+                client.set_signal('_batch_', k)
+                client.get_signal('_batch_')
+            assert client.get_signal('_batch_') is None
+        assert replies[0:24:2] == 12 * [None]
+        assert replies[1:24:2] == list(range(12))
+        assert replies[24] == 11
+
+        with pytest.raises(Exception):
+            with client.batch() as replies:
+                client.get_signal('_batch_')
+                client.get_signal('_undefined_')
+                client.set_signal('_batch_', 1)
+        assert replies[0] == 11 and replies[2] is None
+
+        # slots are looked up after the requests queued before
+        with client.batch() as replies:
+            client.add_signal('_ordered_')
+            client.set_signals({'_ordered_': 5})
+            client.get_signal('_ordered_')
+        assert replies == [None, None, 5]
+        assert client.get_signal('_batch_') == 1
+
+        # test bulk signals
+        client.add_signals('_bulk1_', '_bulk2_')
+        client.set_signals({'_bulk1_': 1, '_bulk2_': 2})
+        assert client.get_signals('_bulk1_', '_bulk2_') == [1, 2]
+        assert list(client.get_signals_array('_bulk2_', '_bulk1_')) == [2, 1]
+        assert {'_bulk1_', '_bulk2_'} <= set(client.slots)
+        # slots made stale by another client are negotiated again
+        other = ctrl.client.Controller(host = HOST, port = PORT)
+        other.add_signal('_bulk0_')
+        other.remove_signal('_bulk0_')
+        other.close()
+        generation = client.generation
+        client.set_signals({'_bulk1_': 2, '_bulk2_': 1})
+        assert client.generation != generation
+        assert list(client.get_signals_array('_bulk1_', '_bulk2_')) == [2, 1]
+        with client.batch() as replies:
+            client.set_signals({'_bulk1_': 3, '_batch_': 4})
+            client.get_signals_array('_bulk1_', '_batch_')
+        assert list(replies[1]) == [3, 4]
+        with pytest.raises(Exception):
+            client.set_signals({'_undefined_': 1})
+
+        # test schedule
+        client.schedule([('set_signal', '_bulk1_', 5)], iteration = 0)
+        client.load_schedule([(1, [('set_signal', '_bulk2_', 6)])])
+        assert [when for (when, commands)
+                in client.list_schedule()['iteration']] == [0, 1]
+        with client:
+            time.sleep(.1)
+        assert client.get_signals('_bulk1_', '_bulk2_') == [5, 6]
+        client.schedule([('set_signal', '_bulk1_', 5)], time = 100)
+        client.clear_schedule()
+        assert client.list_schedule() == {'iteration': [], 'time': []}
+        with pytest.raises(Exception):
+            client.schedule([('set_signal', '_undefined_', 1)], iteration = 0)
+
+        # test download
+        client.add_sink('_log_', ctrl.block.Logger(number_of_rows = 100),
+                        ['clock', '_bulk1_'])
+        with client.batch():
+            for k in range(30):
+                client.write_sink('_log_', k, -k)
+        log = client.read_sink('_log_')
+        assert len(log) == 30
+        chunks = list(client.download_sink('_log_', rows = 7))
+        assert [index for (index, chunk, dropped) in chunks] == \
+            list(range(0, len(log), 7))
+        assert numpy.array_equal(numpy.concatenate([chunk for (index, chunk, dropped)
+                                                    in chunks]), log)
+        chunks = list(client.download_sink('_log_', index = 5, level = 6))
+        assert len(chunks) == 1 and chunks[0][0] == 5
+        assert numpy.array_equal(chunks[0][1], log[5:])
+        with pytest.raises(Exception):
+            list(client.download_sink('_undefined_'))
+
+        # download is resumed after losing the connection
+        chunks = client.download_sink('_log_', rows = 4)
+        (index, chunk, dropped) = next(chunks)
+        client.socket.close()
+        # discard chunks already received
+        client.reader = ctrl.packet.SocketReader(client.socket)
+        rest = list(chunks)
+        assert rest[0][0] == 4
+        assert numpy.array_equal(numpy.concatenate([chunk] + [chunk for (index, chunk, dropped)
+                                                              in rest]), log)
+        # stopping early leaves the connection usable
+        for (index, chunk, dropped) in client.download_sink('_log_', rows = 1):
+            break
+        assert client.get_signal('_bulk1_') == 5
+        client.remove_sink('_log_')
+
+        # test named controllers
+        assert client.list_controllers() == ['default']
+        with pytest.raises(Exception):
+            client.select('_rig_')
+        rig = ctrl.client.Controller(host = HOST, port = PORT, name = '_rig_',
+                                     module = 'ctrl', ctrl_class = 'Controller')
+        assert client.list_controllers() == ['default', '_rig_']
+        rig.add_signal('_rig_signal_')
+        assert '_rig_signal_' in rig.list_signals()
+        assert '_rig_signal_' not in client.list_signals()
+        with rig.subscribe(['_rig_signal_']) as subscription:
+            assert [label for label in rig.list_sinks()
+                    if label.startswith('_subscription_')]
+            assert not [label for label in client.list_sinks()
+                        if label.startswith('_subscription_')]
+        assert '_rig_signal_' not in client.list_signals()
+        rig.socket.close()
+        assert '_rig_signal_' in rig.list_signals()
+        rig.reset(module = 'ctrl.timer', ctrl_class = 'Controller')
+        assert rig.info('class') == "<class 'ctrl.timer.Controller'>"
+        assert client.info('class') == "<class 'ctrl.Controller'>"
+        client.select('_rig_')
+        assert client.info('class') == "<class 'ctrl.timer.Controller'>"
+        client.select('default')
+        rig.close()
+
+        # test subscription
+        with client.subscribe(['clock', 'is_running'], decimation = 2) as subscription:
+            with client:
+                (frame, dropped) = subscription.read()
+                assert frame.shape[1] == 3 and dropped >= 0
+                assert numpy.all(frame[:,2] == 1)
+        with client.subscribe(['clock'], rate = 20, size = 2) as subscription:
+            with client:
+                time.sleep(.2)
+                (frame, dropped) = subscription.read()
+                assert frame.shape[0] <= 2
+        assert not [label for label in client.list_sinks()
+                    if label.startswith('_subscription_')]
+
+        # test reconnection
+        client.socket.close()
+        assert client.get_snapshot('is_running') == [0]
+
         assert client.info('class') == "<class 'ctrl.Controller'>"
         
         # other tests
@@ -424,6 +978,13 @@ def test_client_server():
         assert client.info('class') == "<class 'ctrl.timer.Controller'>"
         assert client.get_source('clock','period') == 2
 
+        # pickled replies are refused without losing track of replies
+        client.reset(module = 'ctrl.sim', ctrl_class = 'Controller')
+        with pytest.raises(pickle.UnpicklingError):
+            client.get_filter('model1')
+        assert client.list_filters() == ['dz1', 'model1']
+        assert client.get_signal('is_running') == 0
+
         client = ctrl.client.Controller(host = HOST, port = PORT,
                                         module = 'ctrl.timer',
                                         period = 1)
@@ -443,7 +1004,128 @@ def test_client_server():
             print('> Terminating server')
             server.terminate()
 
-            
+
+def test_no_pickle():
+
+    import subprocess
+    import pickle
+    import ctrl.client
+    from ctrl.block.system import Gain
+
+    # server that refuses pickled objects
+    port = PORT - 2
+    server = subprocess.Popen(["ctrl_start_server",
+                               "-H{}".format(HOST),
+                               "-p{}".format(port)],
+                              stdout = subprocess.PIPE)
+    time.sleep(1)
+
+    try:
+        client = ctrl.client.Controller(host = HOST, port = port,
+                                        module = 'ctrl.sim',
+                                        ctrl_class = 'Controller')
+        signals = client.list_signals()
+        assert client.list_filters() == ['dz1', 'model1']
+
+        # blocks are neither sent nor received pickled
+        with pytest.raises(ctrl.ControllerException):
+            client.get_filter('model1')
+        with pytest.raises(Exception, match = 'Pickled objects are not allowed'):
+            client.add_filter('_gain_', Gain(), ['clock'], ['_gain_'])
+
+        # and replies are still matched to their requests
+        assert client.list_signals() == signals
+        assert client.list_filters() == ['dz1', 'model1']
+        assert client.get_filter('model1', 'enabled') is True
+        with pytest.raises(ctrl.ControllerException):
+            with client.batch() as replies:
+                client.get_filter('model1')
+                client.list_filters()
+        assert replies[1] == ['dz1', 'model1']
+        client.close()
+
+    finally:
+        server.terminate()
+        server.wait()
+
+def test_retry():
+
+    import socket
+    import threading
+    import ctrl.client
+
+    # a server that closes three connections after receiving a request
+    # and replies garbage on the fourth
+    listener = socket.create_server((HOST, 0))
+    listener.settimeout(5)
+    port = listener.getsockname()[1]
+    received = []
+    def serve():
+        for k in range(4):
+            try:
+                (connection, address) = listener.accept()
+            except OSError:
+                break
+            received.append(connection.recv(1024))
+            if k == 3:
+                connection.sendall(b'X')
+                connection.recv(1024)
+            connection.close()
+    thread = threading.Thread(target = serve)
+    thread.start()
+
+    try:
+        client = ctrl.client.Controller(host = HOST, port = port)
+
+        # requests that change the controller are not sent twice
+        with pytest.raises(Exception):
+            client.set_signal('is_running', 0)
+        assert len(received) == 1
+
+        # read-only requests are
+        with pytest.raises(Exception):
+            client.get_signal('is_running')
+        assert len(received) == 3
+        assert received[1] == received[2]
+
+        # the connection is dropped after replies that cannot be read
+        with pytest.raises(NameError):
+            client.set_signal('is_running', 0)
+        assert client.socket is None
+
+    finally:
+        listener.close()
+        thread.join()
+
+def test_pack_chunks():
+
+    import io
+    import ctrl
+    import ctrl.block as block
+    import ctrl.packet as packet
+    from ctrl.server import pack_chunks
+
+    class Busy(block.Logger):
+        # the loop writes rows while rows are being read
+        def read_since(self, index):
+            retval = super().read_since(index)
+            for k in range(3):
+                self.write(self.get_current_index())
+            return retval
+
+    controller = ctrl.Controller()
+    controller.add_sink('_log_', Busy(number_of_rows = 5), ['clock'])
+    for k in range(5):
+        controller.write_sink('_log_', k)
+
+    # overwritten rows are dropped
+    chunks = [packet.unpack_stream(io.BytesIO(buffer))[1]
+              for buffer in pack_chunks(controller, '_log_', rows = 5)]
+    assert len(chunks) == 1
+    (index, dropped, chunk) = chunks[0]
+    assert index + len(chunk) == 5 and dropped == index
+    assert numpy.all(chunk[:,0] == numpy.arange(index, 5))
+
 if __name__ == "__main__":
 
     print('> Local')
@@ -455,3 +1137,12 @@ if __name__ == "__main__":
     print('> Clock')
     test_clock()
 
+
+    print('> No pickle')
+    test_no_pickle()
+
+    print('> Retry')
+    test_retry()
+
+    print('> Pack chunks')
+    test_pack_chunks()
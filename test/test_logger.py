@@ -0,0 +1,190 @@
+import pytest
+
+import os
+import numpy as np
+
+import ctrl.block as block
+import time
+import pickle
+from ctrl.block.logger import MemmapLogger, AsyncLogger
+
+def test_memmap(tmp_path):
+
+    filename = str(tmp_path / 'log.npy')
+
+    with pytest.raises(block.BlockException):
+        MemmapLogger()
+
+    # grow
+    _logger = MemmapLogger(filename = filename, number_of_rows = 4)
+    for k in range(10):
+        _logger.write(k, [2*k, 3*k])
+    log = _logger.get_log()
+    assert isinstance(log, np.memmap)
+    assert log.shape == (10, 3)
+    assert np.all(log[:,0] == np.arange(10))
+    assert np.all(log[:,2] == 3 * np.arange(10))
+    assert _logger.data.shape == (16, 3)
+    assert _logger.get_current_index() == 10
+
+    _logger.flush()
+    assert np.array_equal(np.load(filename), log)
+    
+    # roll over
+    _logger = MemmapLogger(filename = filename,
+                           number_of_rows = 2, max_rows = 4)
+    for k in range(10):
+        _logger.write(k, k)
+    assert _logger.page == 2
+    assert _logger.get_current_index() == 10
+    assert np.all(_logger.get_log()[:,0] == [8, 9])
+    assert np.all(np.load(_logger.get_segment(0))[:,0] == [0, 1, 2, 3])
+    assert np.all(np.load(_logger.get_segment(1))[:,0] == [4, 5, 6, 7])
+
+    assert 'data' not in _logger.get()
+
+    # single dtype
+    with pytest.raises(block.BlockException):
+        MemmapLogger(filename = filename, dtype = 'infer')
+    _compact = MemmapLogger(filename = str(tmp_path / 'compact.npy'),
+                            number_of_rows = 2, dtype = np.float32)
+    for k in range(3):
+        _compact.write(k, k)
+    _compact.flush()
+    assert np.load(_compact.filename).dtype == np.float32
+    assert np.all(np.load(_compact.filename)[:,0] == [0, 1, 2])
+    
+    # rows in previous files are read from these files
+    (views, index, dropped) = _logger.read_since(3)
+    assert index == 10 and dropped == 0
+    assert np.all(np.vstack(views)[:,0] == np.arange(3, 10))
+    assert _logger.read_since(index) == ((), 10, 0)
+
+    # rows in files that no longer exist are dropped
+    os.remove(_logger.get_segment(0))
+    (views, index, dropped) = _logger.read_since(1)
+    assert index == 10 and dropped == 3
+    assert np.all(np.vstack(views)[:,0] == np.arange(4, 10))
+
+    # views of the current file remain valid after it is replaced
+    log = _logger.get_log()
+    _logger.reshape(2, 2)
+    assert np.all(log[:,0] == [8, 9])
+
+def test_async():
+
+    with pytest.raises(block.BlockException):
+        AsyncLogger(policy = 'unknown')
+    
+    # drained by background thread
+    _logger = AsyncLogger(ring_size = 16, interval = 0.001)
+    for k in range(10):
+        _logger.write(k, [2*k, 3*k])
+    time.sleep(0.1)
+    log = _logger.logger.read()
+    assert log.shape == (10, 3)
+    assert np.all(log[:,1] == 2 * np.arange(10))
+    _logger.close()
+    assert _logger.thread is None
+    
+    # drop newest, drained on read
+    _logger = AsyncLogger(ring_size = 4, policy = 'drop-newest', interval = 10)
+    for k in range(10):
+        _logger.write(k, k)
+    assert _logger.dropped == 6
+    assert np.all(_logger.read()[:,0] == [0, 1, 2, 3])
+
+    # drop oldest
+    _logger = AsyncLogger(ring_size = 4, policy = 'drop-oldest', interval = 10)
+    for k in range(10):
+        _logger.write(k, k)
+    log = _logger.read()
+    assert _logger.dropped + len(log) == 10
+    assert np.all(log[:,0] == np.arange(10 - len(log), 10))
+    
+    # block
+    _logger = AsyncLogger(ring_size = 4, policy = 'block', interval = 0.001)
+    for k in range(100):
+        _logger.write(k)
+    assert _logger.blocked > 0
+    assert _logger.dropped == 0
+    assert np.all(_logger.read()[:,0] == np.arange(100))
+    _logger.close()
+
+    # can be pickled
+    _logger = pickle.loads(pickle.dumps(_logger))
+    _logger.write(1)
+    assert _logger.read().shape == (101, 1)
+    assert 'ring' not in _logger.get()
+
+    # dtypes of the logger are preserved
+    _logger = AsyncLogger(logger = block.Logger(dtype = np.int16), interval = 10)
+    _logger.write(1, [2, 3])
+    assert _logger.ring.dtype == np.int16
+    assert _logger.read().dtype == np.int16
+    _logger = AsyncLogger(logger = block.Logger(dtype = 'infer'), interval = 10)
+    _logger.write(0.5, 2**40, True)
+    log = _logger.read()
+    assert _logger.ring.dtype.names == log.dtype.names
+    assert log['f1'][0] == 2**40 and log['f2'].dtype == bool
+    _logger.write(1.5, 3, False)
+    assert np.all(_logger.read()['f0'] == [0.5, 1.5])
+
+    # closed when removed from the controller
+    import ctrl
+    controller = ctrl.Controller()
+    controller.add_signal('_x_')
+    _logger = AsyncLogger(interval = 0.001)
+    controller.add_sink('_async_', _logger, ['_x_'])
+    controller.write_sink('_async_', 1)
+    assert _logger.thread is not None
+    controller.remove_sink('_async_')
+    assert _logger.thread is None
+    assert _logger.logger.read().shape == (1, 1)
+    controller.add_sink('_async_', _logger, ['_x_'])
+    controller.write_sink('_async_', 2)
+    assert _logger.thread is not None
+    controller.reset()
+    assert _logger.thread is None
+
+def test_multiresolution():
+
+    from ctrl.block.logger import MultiResolutionLogger
+
+    with pytest.raises(block.BlockException):
+        MultiResolutionLogger(factors = (10, 15))
+
+    _logger = MultiResolutionLogger(number_of_rows = 100, factors = (10, 100))
+    for k in range(1000):
+        _logger.write(k * 0.001, k)
+
+    # full rate holds the last 100 rows
+    (mean, low, high) = _logger.get_tier(0)
+    assert np.all(mean[:,1] == np.arange(900, 1000))
+
+    # tiers hold mean, min and max of buckets
+    (mean, low, high) = _logger.get_tier(1)
+    assert mean.shape == (100, 2)
+    assert np.all(low[:,1] == np.arange(0, 1000, 10))
+    assert np.all(high[:,1] == np.arange(9, 1000, 10))
+    assert np.allclose(mean[:,1], np.arange(4.5, 1000, 10))
+
+    (mean, low, high) = _logger.get_tier(2)
+    assert mean.shape == (10, 2)
+    assert np.all(low[:,1] == np.arange(0, 1000, 100))
+    assert np.all(high[:,1] == np.arange(99, 1000, 100))
+    assert np.allclose(mean[:,1], np.arange(49.5, 1000, 100))
+
+    # select tier by time range and number of points
+    (level, mean, low, high) = _logger.read_range(points = 20)
+    assert level == 2 and len(mean) == 10
+    (level, mean, low, high) = _logger.read_range(points = 200)
+    assert level == 1 and len(mean) == 100
+    (level, mean, low, high) = _logger.read_range(start = 0.95)
+    assert level == 0 and np.all(mean[:,1] == np.arange(950, 1000))
+    (level, mean, low, high) = _logger.read_range(start = 0.5, end = 0.6, points = 20)
+    assert level == 1 and np.all(low[:,1] == np.arange(500, 601, 10))
+
+    _logger.reset()
+    assert _logger.get_tier(1)[0].shape == (0, 2)
+    assert 'tiers' not in _logger.get()
@@ -157,7 +157,33 @@ def test5():
 
     with pytest.raises(block.BlockException):
         blk.set(gain = 'sda', m = 1)
-        
+
+
+def test_batch():
+
+    X = np.array([0, 10, 20, 0])
+    Y = np.array([0, 0, 10, 5])
+    blk = nonlinear.DeadZone(X = X, Y = Y)
+
+    for u in (-50, -15, -5, 0, 5, 15, 50):
+        blk.write(u * np.ones(4))
+        (yk, ) = blk.read()
+        expected = []
+        for (x, y) in zip(X, Y):
+            blk_k = nonlinear.DeadZone(X = int(x), Y = int(y))
+            blk_k.write(u)
+            expected.append(blk_k.read()[0])
+        assert np.allclose(yk, expected, equal_nan = True)
+
+    blk.set(X = np.ones(4))
+    blk.write(np.array([-2, -0.5, 0.5, 2]))
+    (yk, ) = blk.read()
+    assert yk.shape == (4,)
+
+    with pytest.raises(block.BlockException):
+        nonlinear.DeadZone(X = 'x')
+
+
 if __name__ == "__main__":
 
     test1()
@@ -165,3 +191,4 @@ if __name__ == "__main__":
     test3()
     test4()
     test5()
+    test_batch()
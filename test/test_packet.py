@@ -2,6 +2,7 @@ import struct
 import numpy
 import io
 import pickle
+import pytest
 
 import ctrl.packet as packet
 
@@ -70,8 +71,9 @@ def testIFD():
 
 def testV():
 
-    # test VI
-    vector = numpy.array((1,2,3), int)
+    # test VI; since protocol 2 only int32 is sent as I
+    assert packet.PROTOCOL == 2
+    vector = numpy.array((1,2,3), numpy.int32)
     assert packet.pack('V',vector) == struct.pack('<ccIiii', b'V', b'I', 3, 1, 2, 3)
 
     (type, rvector) = packet.unpack_stream(
@@ -79,7 +81,7 @@ def testV():
     assert type == 'V'
     assert numpy.all(rvector == vector)
 
-    vector = numpy.array((1,-2,3), int)
+    vector = numpy.array((1,-2,3), numpy.int32)
     assert packet.pack('V',vector) == struct.pack('<ccIiii', b'V', b'I', 3, 1, -2, 3)
 
     (type, rvector) = packet.unpack_stream(
@@ -107,8 +109,8 @@ def testV():
 
 def testM():
 
-    # test MI
-    vector = numpy.array(((1,2,3), (3,4,5)), int)
+    # test MI; since protocol 2 only int32 is sent as I
+    vector = numpy.array(((1,2,3), (3,4,5)), numpy.int32)
     assert packet.pack('M',vector) == struct.pack('<cIccIiiiiii', b'M', 2, b'V', b'I', 6, 1, 2, 3, 3, 4, 5)
 
     (type, rvector) = packet.unpack_stream(
@@ -116,7 +118,7 @@ def testM():
     assert type == 'M'
     assert numpy.all(rvector == vector)
 
-    vector = numpy.array(((1,-2,3), (3,4,-5)), int)
+    vector = numpy.array(((1,-2,3), (3,4,-5)), numpy.int32)
     assert packet.pack('M',vector) == struct.pack('<cIccIiiiiii', b'M', 2, b'V', b'I', 6, 1, -2, 3, 3, 4, -5)
 
     (type, rvector) = packet.unpack_stream(
@@ -142,6 +144,46 @@ def testM():
     assert type == 'M'
     assert numpy.all(rvector == vector)
 
+def testVectorized():
+
+    # dtype is preserved
+    for dtype in (numpy.int8, numpy.uint8, numpy.int16, numpy.int32,
+                  numpy.int64, numpy.float32, numpy.float64, bool):
+        vector = numpy.arange(6).astype(dtype)
+        (type, rvector) = packet.unpack_stream(io.BytesIO(packet.pack('V', vector)))
+        assert type == 'V'
+        assert rvector.dtype == vector.dtype
+        assert numpy.array_equal(rvector, vector)
+
+    # int64 is not truncated
+    vector = numpy.array((1,2,3), numpy.int64)
+    assert packet.pack('V', vector) == struct.pack('<ccIqqq', b'V', b'L', 3, 1, 2, 3)
+    vector = numpy.array((1, -2**40), numpy.int64)
+    assert packet.pack('V', vector) == struct.pack('<ccIqq', b'V', b'L', 2, 1, -2**40)
+
+    # big-endian input is sent little-endian
+    vector = numpy.array((1.5, 2), '>f8')
+    assert packet.pack('V', vector) == struct.pack('<ccIdd', b'V', b'D', 2, 1.5, 2)
+    
+    # shape is preserved, including non-contiguous and multi-dimensional arrays
+    matrix = numpy.arange(24, dtype = numpy.float32).reshape((2, 3, 4))
+    for array in (matrix, matrix[:,1,:].T, matrix[0], numpy.zeros((0, 3)),
+                  numpy.zeros((3, 0)), numpy.float64(3)):
+        (type, rarray) = packet.unpack_stream(io.BytesIO(packet.pack('M', array)))
+        assert type == 'M'
+        assert rarray.shape == array.shape
+        assert rarray.dtype == array.dtype
+        assert numpy.array_equal(rarray, array)
+
+    # streams without readinto
+    class Stream:
+        def __init__(self, data):
+            self.stream = io.BytesIO(data)
+        def read(self, n):
+            return self.stream.read(n)
+    (type, rarray) = packet.unpack_stream(Stream(packet.pack('M', matrix)))
+    assert numpy.array_equal(rarray, matrix)
+    
 def testP():
 
     vector = numpy.array(((1.3,-2,3), (0,-1,2.5)), numpy.float)
@@ -164,6 +206,157 @@ def testKR():
     assert type == 'R'
     assert (args == rargs)
 
+def testReader():
+
+    import socket
+    import threading
+
+    vector = numpy.arange(40000, dtype = numpy.float64)
+    stream = ( packet.pack('S', 'abc') + packet.pack('I', 3) +
+               packet.pack('V', vector) + packet.pack('D', 1.5) +
+               packet.pack('M', vector.reshape(200, 200)) )
+
+    # buffered socket reader
+    (sender, receiver) = socket.socketpair()
+    try:
+        reader = packet.SocketReader(receiver, size = 64)
+        def send():
+            sender.sendall(stream)
+            sender.close()
+        thread = threading.Thread(target = send)
+        thread.start()
+        assert packet.unpack_stream(reader) == ('S', 'abc')
+        assert packet.unpack_stream(reader) == ('I', 3)
+        (type, value) = packet.unpack_stream(reader)
+        assert type == 'V' and numpy.all(value == vector)
+        assert packet.unpack_stream(reader) == ('D', 1.5)
+        (type, value) = packet.unpack_stream(reader)
+        assert type == 'M' and numpy.all(value == vector.reshape(200, 200))
+        assert reader.read(1) == b''
+        thread.join()
+    finally:
+        receiver.close()
+
+    # partial frames
+    for size in (1, 7, 1000, len(stream)):
+        parser = packet.Parser()
+        packets = []
+        for k in range(0, len(stream), size):
+            packets.extend(parser.feed(stream[k:k+size]))
+        assert len(packets) == 5
+        assert packets[0] == ('S', 'abc')
+        assert packets[1] == ('I', 3)
+        assert numpy.all(packets[2][1] == vector)
+        assert packets[3] == ('D', 1.5)
+        assert numpy.all(packets[4][1] == vector.reshape(200, 200))
+        assert len(parser.buffer) == 0
+
+def testSchema():
+
+    import ctrl
+
+    values = [None, True, False, 3, -2**40, 2**70, 1.5, 'abc', b'abc',
+              [1, 'a', (2.5, None)], { 'a': 1, 'b': [True] },
+              numpy.float64(2.5), numpy.int64(3), numpy.bool_(True)]
+    for value in values:
+        (type, rvalue) = packet.unpack_stream(io.BytesIO(packet.pack('P', value)))
+        assert type == 'P'
+        assert rvalue == value
+        assert builtins_type(rvalue) == builtins_type(value)
+
+    # kwargs and vargs are smaller than pickled
+    kwargs = { 'period': 0.01, 'enabled': True, 'gain': 2 }
+    assert len(packet.pack('K', kwargs)) < len(pickle.dumps(kwargs))
+    assert packet.unpack_stream(io.BytesIO(packet.pack('K', kwargs))) == ('K', kwargs)
+    assert packet.unpack_stream(io.BytesIO(packet.pack('R', ('a', 1)))) == ('R', ('a', 1))
+
+    # arrays are aligned writable views of the received buffer
+    arrays = [numpy.arange(5, dtype = numpy.float64),
+              numpy.arange(6, dtype = numpy.int16).reshape((2, 3)),
+              numpy.zeros((0, 3), bool)]
+    (type, rarrays) = packet.unpack_stream(io.BytesIO(packet.pack('P', arrays)))
+    for (array, rarray) in zip(arrays, rarrays):
+        assert rarray.dtype == array.dtype and rarray.shape == array.shape
+        assert numpy.array_equal(rarray, array)
+        assert rarray.flags.aligned and rarray.flags.writeable
+
+    # structured and other arrays are sent raw, not pickled
+    arrays = [numpy.zeros((4, ), [('clock', float), ('count', numpy.int32),
+                                  ('vector', numpy.float32, (2, ))]),
+              numpy.arange(3) * complex(1, 2),
+              numpy.array(['a', 'bc'])]
+    arrays[0]['count'] = numpy.arange(4)
+    (type, rarrays) = packet.unpack_stream(io.BytesIO(packet.pack('P', arrays)))
+    for (array, rarray) in zip(arrays, rarrays):
+        assert rarray.dtype == array.dtype and rarray.shape == array.shape
+        assert numpy.array_equal(rarray, array)
+
+    # exceptions
+    (type, exception) = packet.unpack_stream(
+        io.BytesIO(packet.pack('E', ctrl.ControllerException('error'))))
+    assert type == 'E'
+    assert isinstance(exception, ctrl.ControllerException)
+    assert exception.args == ('error',)
+    (type, exception) = packet.unpack_stream(io.BytesIO(packet.pack('E', KeyError('key'))))
+    assert builtins_type(exception) is KeyError and exception.args == ('key',)
+
+    # other exceptions are not recreated
+    for error in (SystemExit(1), KeyboardInterrupt(), pickle.UnpicklingError('error')):
+        (type, exception) = packet.unpack_stream(io.BytesIO(packet.pack('E', error)))
+        assert builtins_type(exception) is Exception
+        assert str(exception).endswith(error.__class__.__name__ + ': ' +
+                                       ', '.join(str(arg) for arg in error.args))
+
+    # other objects are pickled, and refused unless allowed
+    value = [1, complex(1, 2)]
+    stream = packet.pack('P', value)
+    try:
+        packet.allow_pickle = True
+        assert packet.unpack_stream(io.BytesIO(stream)) == ('P', value)
+    finally:
+        packet.allow_pickle = False
+    # the refused packet is read entirely and returned as an error
+    stream = io.BytesIO(stream + packet.pack('I', 1))
+    (type, error) = packet.unpack_stream(stream)
+    assert type == 'E' and isinstance(error, pickle.UnpicklingError)
+    assert packet.unpack_stream(stream) == ('I', 1)
+    ((type, error), rvalue) = packet.Parser().feed(stream.getvalue())
+    assert type == 'E' and isinstance(error, pickle.UnpicklingError)
+    assert rvalue == ('I', 1)
+    (type, error) = packet.unpack_stream(io.BytesIO(
+        struct.pack('<cI', b'P', len(pickle.dumps(value))) + pickle.dumps(value)))
+    assert type == 'E' and isinstance(error, pickle.UnpicklingError)
+
+    # or not pickled at all
+    with pytest.raises(pickle.PicklingError):
+        packet.pack('P', value, pickle_objects = False)
+    assert packet.pack('P', [1, 'a'], False) == packet.pack('P', [1, 'a'])
+
+def testRows():
+
+    rows = numpy.random.rand(100, 3)
+    assert packet.pack_rows(rows) is rows
+    assert packet.unpack_rows(rows) is rows
+
+    # compressed rows
+    data = packet.pack_rows(rows, 6)
+    (type, rdata) = packet.unpack_stream(io.BytesIO(packet.pack('P', data)))
+    rrows = packet.unpack_rows(rdata)
+    assert rrows.dtype == rows.dtype and numpy.array_equal(rrows, rows)
+
+    rows = numpy.zeros((1000, ), [('f0', float), ('f1', numpy.int32)])
+    data = packet.pack_rows(rows, 1)
+    assert len(data[2]) < rows.nbytes
+    (type, rdata) = packet.unpack_stream(io.BytesIO(packet.pack('P', data)))
+    rrows = packet.unpack_rows(rdata)
+    assert rrows.dtype == rows.dtype and numpy.array_equal(rrows, rows)
+
+def builtins_type(value):
+    if isinstance(value, numpy.generic):
+        return builtins_type(value.item())
+    return type(value)
+
+
 if __name__ == "__main__":
 
     testA()
@@ -174,4 +367,6 @@ if __name__ == "__main__":
     testM()
     testP()
     testKR()
-
+    testReader()
+    testSchema()
+    testRows()
@@ -0,0 +1,99 @@
+import pytest
+
+import time
+import threading
+import numpy as np
+
+import ctrl
+import ctrl.sim as sim
+from ctrl.process import SignalBus, ProcessController
+from ctrl.block import Logger
+
+def test_bus():
+
+    bus = SignalBus(['a', 'b'], [1, 3])
+    assert 'a' in bus and 'c' not in bus
+    assert bus.get('a', 'b')[0] == 0
+
+    bus.write(1, [2, 3, 4])
+    (a, b) = bus.get('a', 'b')
+    assert a == 1
+    assert np.array_equal(b, [2, 3, 4])
+    assert bus.sequence == 1
+
+    # attach to existing bus
+    other = SignalBus(bus.labels, bus.sizes, bus.name)
+    assert other.sequence == 1
+    assert other.get('a') == [1]
+    other.write(5, 6)
+    assert bus.get('a') == [5]
+    assert np.array_equal(bus.get('b')[0], [6, 6, 6])
+
+    # values that cannot be stored become nan
+    other.write('x', [1, 2])
+    (a, b) = bus.get('a', 'b')
+    assert np.isnan(a) and np.all(np.isnan(b))
+
+    # a torn record is ignored
+    other.write(1, [2, 3, 4])
+    other.records[other.sequence % 2, 2] = 7
+    (a, b) = bus.get('a', 'b')
+    assert np.isnan(a) and np.all(np.isnan(b))
+
+    # readers see values from a single update
+    def write():
+        for k in range(10000):
+            other.write(k, [k, k, k])
+    writer = threading.Thread(target = write)
+    writer.start()
+    while writer.is_alive():
+        (a, b) = bus.get('a', 'b')
+        assert np.all(b == a)
+    writer.join()
+    other.close()
+    bus.close()
+
+def test_process():
+
+    with ProcessController(sim.Controller, period = 0.01) as controller:
+
+        # proxied methods
+        assert 'encoder1' in controller.list_signals()
+        controller.add_sink('logger', Logger(), ['clock', 'encoder1'])
+        assert 'logger' in controller.list_sinks()
+
+        with pytest.raises(ctrl.ControllerException):
+            controller.set_signal('_unknown_', 1)
+        
+        controller.set_signal('motor1', 100)
+        assert controller.get_signal('motor1') == 100
+
+        controller.add_signal('_label_')
+        controller.set_signal('_label_', 'text')
+        controller.start()
+        assert controller.bus is not None
+        assert 'motor1' in controller.bus
+        assert '_label_' not in controller.bus
+        assert controller.get_signal('_label_') == 'text'
+        
+        time.sleep(1)
+
+        # read from bus while running
+        (clock, encoder1) = controller.get_signals('clock', 'encoder1')
+        assert encoder1 > 0
+        assert controller.get_signal('is_running') == 1
+        time.sleep(0.1)
+        assert controller.get_signal('clock') > clock
+        
+        # set while running
+        controller.set_signal('motor1', 0)
+
+        controller.stop()
+        assert controller.bus is None
+        assert '_bus_' not in controller.list_sinks()
+
+        log = controller.read_sink('logger')
+        assert log.shape[1] == 2
+        assert log[-1,1] > 0
+
+    assert not controller.process.is_alive()
@@ -264,3 +264,67 @@ def test2():
     yk = log[-1,1:]
 
     print('2. [{:3.2f}, {:3.2f}] = {}'.format(t0, tk, yk))
+
+def test_virtual():
+
+    import ctrl.sim as sim
+    from ctrl.block.clock import VirtualClock
+
+    clock = VirtualClock(period = 0.5)
+    assert clock.read() == (0.5,)
+    assert clock.read() == (1.0,)
+    clock.reset()
+    assert clock.read() == (0.5,)
+    
+    def simulate():
+
+        controller = sim.Controller(virtual = True)
+        controller.add_sink('logger', Logger(number_of_rows = 7000),
+                            ['clock', 'encoder1'])
+
+        # step at 1s on virtual time
+        controller.add_timer('step', Constant(value = 100),
+                             None, ['motor1'], 1, False)
+
+        t0 = time.perf_counter()
+        assert controller.simulate(60) == 6000
+        assert time.perf_counter() - t0 < 30
+
+        return controller.read_sink('logger')
+
+    log = simulate()
+    assert log.shape == (6000, 2)
+    assert np.all(np.diff(log[:,0]) > 0)
+    assert abs(log[-1,0] - 60) < 1e-9
+    
+    # motor starts moving after 1s
+    assert log[99,1] == 0
+    assert log[-1,1] > 0
+    
+    # results are reproducible
+    assert np.array_equal(simulate(), log)
+
+def test_batch():
+
+    import ctrl.sim as sim
+
+    a = np.array([10, 17, 25])
+    X = np.array([5, 10, 15])
+
+    def simulate(**kwargs):
+
+        controller = sim.Controller(virtual = True, **kwargs)
+        controller.add_sink('logger', Logger(number_of_rows = 500),
+                            ['clock', 'encoder1'])
+        controller.set_signal('motor1', 50)
+        controller.simulate(2)
+        return controller.read_sink('logger')
+
+    # batch of N motors matches N separate simulations
+    log = simulate(a = a, X = X)
+    assert log.shape == (200, 1 + len(a))
+    for k in range(len(a)):
+        single = simulate(a = int(a[k]), X = int(X[k]))
+        assert np.allclose(log[:,0], single[:,0])
+        assert np.allclose(log[:,1+k], single[:,1])
+    assert log[-1,1] > log[-1,3]
@@ -697,6 +697,59 @@ def test6():
     assert np.all(np.abs(yk - soln[1]) < 1e-4)
 
 
+def test_batch():
+
+    # batch of DTTFs matches individual DTTFs
+    N = 5
+    c = np.linspace(0.1, 0.9, N)
+    num = np.array([np.zeros(N), 1 - c])
+    den = np.array([np.ones(N), -c])
+    batch = tf.DTTF(num, den)
+    assert batch.state.shape == (1, N)
+
+    models = [tf.DTTF(np.array([0, 1 - ck]), np.array([1, -ck])) for ck in c]
+    uk = np.arange(N, dtype=float)
+    for k in range(10):
+        yk = batch.update(uk)
+        assert yk.shape == (N,)
+        assert np.allclose(yk, [m.update(u) for (m, u) in zip(models, uk)])
+
+    # set_output
+    batch.set_output(np.ones(N))
+    assert np.allclose(batch.update(np.zeros(N)), np.ones(N))
+
+    # numerator of lower order is padded
+    batch = tf.DTTF(np.array([1]), den)
+    assert batch.num.shape == (2, N)
+    
+    # single DTTF applied to a batch of inputs
+    sys = tf.DTTF(np.array([0, 1]), np.array([1, -0.5]))
+    sys.update(1)
+    yk = sys.update(np.ones(N))
+    assert sys.state.shape == (1, N)
+    assert np.allclose(yk, np.ones(N))
+    assert np.allclose(sys.update(np.ones(N)), 1.5 * np.ones(N))
+
+    with pytest.raises(system.SystemException):
+        tf.DTTF(num, np.array([np.ones(N) - (c > 0.5), -c]))
+    
+    # batch of DTSS with shared matrices
+    A = np.array([[0.5, 0], [0, 0.25]])
+    B = np.array([[1, 0], [0, 1]])
+    C = np.array([[1, 1]])
+    D = np.array([[0, 0]])
+    batch = ss.DTSS(A, B, C, D)
+    models = [ss.DTSS(A, B, C, D) for k in range(N)]
+    u1 = np.arange(N, dtype=float)
+    u2 = -np.arange(N, dtype=float) ** 2
+    for k in range(5):
+        yk = batch.update(np.hstack((u1, u2)))
+        assert yk.shape == (N,)
+        assert batch.state.shape == (2, N)
+        assert np.allclose(yk, [m.update(np.array([v1, v2]))[0]
+                                for (m, v1, v2) in zip(models, u1, u2)])
+
+
 if __name__ == "__main__":
 
     test1()
@@ -705,3 +758,4 @@ if __name__ == "__main__":
     test4()
     test5()
     test6()
+    test_batch()